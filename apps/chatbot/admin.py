@@ -1,6 +1,11 @@
 from django.contrib import admin
+from django.db.models import Q
 from django.utils.html import format_html
-from .models import Dashboard, AIAssistant, Messenger, Message, Chat, Client
+from .admin_utils import LargeTableAdminMixin, CreatedDateFilter
+from .models import (
+    Dashboard, AIAssistant, Messenger, Message, Chat, Client, DashboardDailyStats, BotRunner, MessengerLease,
+    GenerationJob
+)
 
 @admin.register(Dashboard)
 class DashboardAdmin(admin.ModelAdmin):
@@ -18,6 +23,18 @@ class DashboardAdmin(admin.ModelAdmin):
         ('Sharing', {
             'fields': ('is_shared', 'share_token')
         }),
+        ('Retention', {
+            'fields': ('message_retention_days',)
+        }),
+        ('Quotas', {
+            'fields': (
+                ('daily_token_limit', 'monthly_token_limit'),
+                ('daily_request_limit', 'monthly_request_limit'),
+            )
+        }),
+        ('LLM Scheduling', {
+            'fields': (('llm_weight', 'llm_max_concurrency'),)
+        }),
         ('Timestamps', {
             'fields': ('created_date', 'updated_date'),
             'classes': ('collapse',)
@@ -51,10 +68,10 @@ class DashboardAdmin(admin.ModelAdmin):
 
 @admin.register(AIAssistant)
 class AIAssistantAdmin(admin.ModelAdmin):
-    list_display = ('model', 'dashboard', 'assistant_type', 'is_active', 'last_used')
+    list_display = ('model', 'dashboard', 'assistant_type', 'is_active', 'usage_count', 'last_used')
     list_filter = ('model', 'assistant_type', 'is_active', 'dashboard__name')
     search_fields = ('assistant_id', 'description', 'dashboard__name')
-    readonly_fields = ('created_date',)
+    readonly_fields = ('created_date', 'usage_count', 'prompt_tokens', 'completion_tokens', 'last_used')
     fieldsets = (
         ('Basic Information', {
             'fields': ('dashboard', 'assistant_type', 'is_active')
@@ -66,7 +83,7 @@ class AIAssistantAdmin(admin.ModelAdmin):
             'fields': ('description', 'instructions')
         }),
         ('Usage', {
-            'fields': ('last_used', 'created_date'),
+            'fields': ('usage_count', 'prompt_tokens', 'completion_tokens', 'last_used', 'created_date'),
             'classes': ('collapse',)
         }),
     )
@@ -101,15 +118,28 @@ class MessengerAdmin(admin.ModelAdmin):
     
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
-    list_display = ('chat', 'timestamp', 'client', 'ai_assistant')
-    list_filter = ('timestamp',)
-    search_fields = ('chat',)
-    readonly_fields = ('timestamp',)
+class MessageAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ('id', 'chat', 'client', 'ai_assistant', 'outgoing', 'created_date')
+    list_filter = (CreatedDateFilter, 'outgoing')
+    list_select_related = ('chat', 'client', 'ai_assistant__dashboard')
+    list_only = (
+        'id', 'outgoing', 'created_date',
+        'chat__id', 'chat__type',
+        'client__id', 'client__username', 'client__name',
+        'ai_assistant__id', 'ai_assistant__model', 'ai_assistant__assistant_type', 'ai_assistant__dashboard__name',
+    )
+    search_fields = ('client__username',)
+    search_help_text = 'Chat id, Telegram user id or exact username'
+    readonly_fields = ('timestamp', 'prompt_tokens', 'completion_tokens')
+    raw_id_fields = ('client', 'ai_assistant', 'chat')
     fieldsets = (
         ('Basic Information', {
             'fields': ('client', 'ai_assistant', 'chat', 'text', 'sender_info')
         }),
+        ('Usage', {
+            'fields': ('prompt_tokens', 'completion_tokens'),
+            'classes': ('collapse',)
+        }),
         ('Timestamps', {
             'fields': ('timestamp',),
             'classes': ('collapse',)
@@ -117,19 +147,45 @@ class MessageAdmin(admin.ModelAdmin):
     )
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('client', 'ai_assistant')
+        return super().get_queryset(request).select_related('chat', 'client', 'ai_assistant__dashboard')
+
+    def get_search_results(self, request, queryset, search_term):
+        # Only indexed equality lookups, never LIKE scans over the whole table
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        if search_term.isdigit():
+            return queryset.filter(Q(chat_id=search_term) | Q(client__telegram_chat_id=search_term)), False
+        return queryset.filter(client__username=search_term.lstrip('@')), False
     
 
 @admin.register(Chat)
-class ChatAdmin(admin.ModelAdmin):
-    list_display = ('client', 'assistant', 'created_date', 'last_updated')
-    list_filter = ('assistant__model', 'created_date')
+class ChatAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = (
+        'id', 'client', 'assistant', 'message_count', 'last_message_preview',
+        'last_inbound_at', 'last_outbound_at', 'created_date'
+    )
+    list_filter = (CreatedDateFilter, 'assistant__model')
+    list_select_related = ('client', 'assistant__dashboard')
+    list_only = (
+        'id', 'created_date', 'last_updated', 'message_count', 'last_message_preview',
+        'last_inbound_at', 'last_outbound_at',
+        'client__id', 'client__username', 'client__name',
+        'assistant__id', 'assistant__model', 'assistant__assistant_type', 'assistant__dashboard__name',
+    )
     search_fields = ('client__name', 'assistant__description')
-    readonly_fields = ('created_date', 'last_updated')
+    readonly_fields = (
+        'created_date', 'last_updated', 'message_count', 'last_message_preview',
+        'last_inbound_at', 'last_outbound_at'
+    )
+    raw_id_fields = ('client', 'assistant')
     fieldsets = (
         ('Basic Information', {
             'fields': ('client', 'assistant')
         }),
+        ('Activity', {
+            'fields': ('message_count', 'last_message_preview', 'last_inbound_at', 'last_outbound_at')
+        }),
         ('Timestamps', {
             'fields': ('created_date', 'last_updated'),
             'classes': ('collapse',)
@@ -137,7 +193,7 @@ class ChatAdmin(admin.ModelAdmin):
     )
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('client', 'assistant')
+        return super().get_queryset(request).select_related('client', 'assistant__dashboard')
     
 
 @admin.register(Client)
@@ -152,4 +208,58 @@ class ClientAdmin(admin.ModelAdmin):
     )
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('messenger_type')
\ No newline at end of file
+        return super().get_queryset(request).select_related('dashboard')
+
+
+@admin.register(DashboardDailyStats)
+class DashboardDailyStatsAdmin(admin.ModelAdmin):
+    list_display = (
+        'day', 'dashboard', 'messenger_type', 'inbound_messages', 'outbound_messages',
+        'active_clients', 'average_response_ms', 'llm_requests', 'prompt_tokens', 'completion_tokens'
+    )
+    list_filter = ('messenger_type', 'day')
+    search_fields = ('dashboard__name',)
+    list_select_related = ('dashboard__owner',)
+    date_hierarchy = 'day'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(BotRunner)
+class BotRunnerAdmin(admin.ModelAdmin):
+    list_display = ('name', 'hostname', 'started_at', 'heartbeat_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MessengerLease)
+class MessengerLeaseAdmin(admin.ModelAdmin):
+    list_display = ('messenger', 'owner', 'acquired_at', 'expires_at')
+    search_fields = ('owner', 'messenger__dashboard__name')
+    list_select_related = ('messenger__dashboard__owner',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'messenger', 'telegram_chat_id', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('telegram_chat_id', 'locked_by', 'last_error')
+    list_select_related = ('messenger__dashboard__owner',)
+    raw_id_fields = ('messenger', 'chat', 'message', 'reply')
+
+    def has_add_permission(self, request):
+        return False
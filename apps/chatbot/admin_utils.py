@@ -0,0 +1,118 @@
+import logging
+from datetime import timedelta
+from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never runs an unbounded COUNT(*).
+
+    Unfiltered querysets on PostgreSQL use the planner's row estimate, everything
+    else is counted up to `count_limit` rows.
+    """
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where and connections[queryset.db].vendor == 'postgresql':
+            estimate = self.estimated_table_rows(queryset)
+            if estimate > self.count_limit:
+                return estimate
+        return queryset.order_by()[:self.count_limit].count()
+
+    def estimated_table_rows(self, queryset):
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        return max(row[0], 0) if row else 0
+
+
+class CreatedDateFilter(admin.SimpleListFilter):
+    """Relative date ranges on created_date, resolved to plain range conditions"""
+    title = 'created'
+    parameter_name = 'created'
+    ranges = (
+        ('1h', 'Last hour', timedelta(hours=1)),
+        ('24h', 'Last 24 hours', timedelta(days=1)),
+        ('7d', 'Last 7 days', timedelta(days=7)),
+        ('30d', 'Last 30 days', timedelta(days=30)),
+    )
+
+    def lookups(self, request, model_admin):
+        return [(key, label) for key, label, _ in self.ranges]
+
+    def queryset(self, request, queryset):
+        for key, _, delta in self.ranges:
+            if self.value() == key:
+                return queryset.filter(created_date__gte=now() - delta)
+        return queryset
+
+
+class LargeTableAdminMixin:
+    """
+    Changelist settings for tables with millions of rows.
+
+    - estimated counts, no full result count
+    - keyset navigation: `?id__lt=<last id>` links to older rows without OFFSET
+    - `list_only` restricts the changelist query to the displayed columns
+    - a per-page query budget, exceeding it is logged
+    """
+    change_list_template = 'admin/chatbot/change_list_keyset.html'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    ordering = ('-id',)
+    list_only = None
+    query_budget = 5
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if self.list_only and self.is_changelist(request):
+            queryset = queryset.only(*self.list_only)
+        return queryset
+
+    def is_changelist(self, request):
+        match = request.resolver_match
+        return bool(match and match.url_name and match.url_name.endswith('_changelist'))
+
+    def changelist_view(self, request, extra_context=None):
+        queries = []
+
+        def count_queries(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connections['default'].execute_wrapper(count_queries):
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render'):
+                self.add_keyset_cursor(request, response)
+                response.render()
+
+        if len(queries) > self.query_budget:
+            logger.warning(
+                f"{self.__class__.__name__} changelist ran {len(queries)} queries "
+                f"(budget {self.query_budget})"
+            )
+        return response
+
+    def add_keyset_cursor(self, request, response):
+        changelist = response.context_data.get('cl')
+        if changelist is None:
+            return
+        results = list(changelist.result_list)
+        if len(results) < changelist.list_per_page:
+            return
+        params = request.GET.copy()
+        params.pop('p', None)
+        params['id__lt'] = results[-1].pk
+        response.context_data['keyset_next_url'] = f"?{params.urlencode()}"
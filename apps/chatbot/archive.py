@@ -0,0 +1,181 @@
+import gzip
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import now
+
+from .models import Message, Chat, Client, AIAssistant
+
+logger = logging.getLogger(__name__)
+
+DATETIME_FIELDS = ('created_date', 'updated_date', 'timestamp')
+
+
+class ArchiveEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder cuts datetimes to milliseconds, archives keep them exact"""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def retention_days(dashboard):
+    """Retention window of a dashboard in days, 0 means keep forever"""
+    if dashboard.message_retention_days is not None:
+        return dashboard.message_retention_days
+    return settings.MESSAGE_RETENTION_DAYS
+
+
+def archive_path(dashboard):
+    directory = Path(settings.MESSAGE_ARCHIVE_ROOT) / str(dashboard.pk)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / f"messages-{now():%Y%m%d%H%M%S}.jsonl.gz"
+
+
+def archive_dashboard(dashboard, chunk_size=5000, pause=0.0, dry_run=False):
+    """
+    Move messages older than the dashboard's retention window into a gzip JSONL file.
+
+    Each chunk is appended to the archive as its own gzip member, closed and
+    synced to disk before its rows are deleted in a short transaction. No long
+    locks are held, and an interrupted run leaves at most a truncated last
+    member whose rows are still in the table.
+    Returns the number of archived messages.
+    """
+    days = retention_days(dashboard)
+    if not days:
+        return 0
+
+    cutoff = now() - timedelta(days=days)
+    queryset = Message.objects.filter(chat__dashboard=dashboard, created_date__lt=cutoff)
+    if dry_run:
+        return queryset.count()
+
+    fields = [field.attname for field in Message._meta.concrete_fields]
+    total = 0
+    path = None
+    last_id = 0
+    while True:
+        rows = list(
+            queryset.filter(pk__gt=last_id).order_by('pk').values(*fields)[:chunk_size]
+        )
+        if not rows:
+            break
+        path = path or archive_path(dashboard)
+        append_chunk(path, rows)
+
+        ids = [row['id'] for row in rows]
+        with transaction.atomic():
+            Message.objects.filter(pk__in=ids).delete()
+        last_id = ids[-1]
+        total += len(ids)
+        logger.info(f"Archived {total} messages of dashboard {dashboard.pk} to {path}")
+        if pause:
+            time.sleep(pause)
+    return total
+
+
+def append_chunk(path, rows):
+    """Append rows as one complete gzip member, on disk once this returns"""
+    with open(path, 'ab') as file:
+        with gzip.GzipFile(fileobj=file, mode='wb') as archive:
+            for row in rows:
+                archive.write(json.dumps(row, cls=ArchiveEncoder, ensure_ascii=False).encode('utf-8'))
+                archive.write(b'\n')
+        file.flush()
+        os.fsync(file.fileno())
+
+
+@contextmanager
+def preserved_timestamps():
+    """Keep archived created/updated dates instead of letting auto_now fields overwrite them"""
+    fields = [Message._meta.get_field(name) for name in DATETIME_FIELDS]
+    flags = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, flags):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def existing_ids(model, ids):
+    return set(model.objects.filter(pk__in={pk for pk in ids if pk}).values_list('pk', flat=True))
+
+
+def insert_missing(batch):
+    """
+    Insert the messages whose id is not in the table. Messages of a deleted
+    chat or client are skipped, as the cascade would have removed them, and a
+    deleted assistant is cleared like SET_NULL does.
+    Returns (inserted, orphaned) counts.
+    """
+    existing = existing_ids(Message, [message.pk for message in batch])
+    chats = existing_ids(Chat, [message.chat_id for message in batch])
+    clients = existing_ids(Client, [message.client_id for message in batch])
+    assistants = existing_ids(AIAssistant, [message.ai_assistant_id for message in batch])
+    missing, orphaned = [], 0
+    for message in batch:
+        if message.pk in existing:
+            continue
+        if (message.chat_id and message.chat_id not in chats) or (message.client_id and message.client_id not in clients):
+            orphaned += 1
+            continue
+        if message.ai_assistant_id not in assistants:
+            message.ai_assistant_id = None
+        missing.append(message)
+    # ignore_conflicts still guards against rows inserted concurrently
+    Message.objects.bulk_create(missing, ignore_conflicts=True)
+    return len(missing), orphaned
+
+
+def restore_archive(path, chunk_size=5000):
+    """
+    Insert the messages of an archive file back into the hot table, skipping
+    existing ids and messages whose chat or client was deleted since.
+
+    A file cut short by an interrupted archive run is restored up to the last
+    complete line. Returns (restored, orphaned, truncated).
+    """
+    restored = orphaned = 0
+    truncated = False
+    batch = []
+
+    def insert():
+        nonlocal restored, orphaned
+        inserted, skipped = insert_missing(batch)
+        restored += inserted
+        orphaned += skipped
+        batch.clear()
+
+    with gzip.open(path, 'rt', encoding='utf-8') as archive, preserved_timestamps():
+        try:
+            for line in archive:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    # Only the last line of a truncated member can be incomplete
+                    truncated = True
+                    break
+                for name in DATETIME_FIELDS:
+                    if row.get(name):
+                        row[name] = parse_datetime(row[name])
+                batch.append(Message(**row))
+                if len(batch) >= chunk_size:
+                    insert()
+        except (EOFError, gzip.BadGzipFile) as e:
+            logger.warning(f"Archive {path} is truncated, restoring the messages read so far: {str(e)}")
+            truncated = True
+        if batch:
+            insert()
+    return restored, orphaned, truncated
@@ -0,0 +1,309 @@
+import atexit
+import logging
+import threading
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils.timezone import localdate, now
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LENGTH = 100
+
+
+class ChatDelta:
+    __slots__ = ('count', 'preview', 'last_inbound_at', 'last_outbound_at')
+
+    def __init__(self):
+        self.count = 0
+        self.preview = None
+        self.last_inbound_at = None
+        self.last_outbound_at = None
+
+    def merge(self, other):
+        self.count += other.count
+        self.preview = self.preview if other.preview is None else other.preview
+        self.last_inbound_at = max(filter(None, (self.last_inbound_at, other.last_inbound_at)), default=None)
+        self.last_outbound_at = max(filter(None, (self.last_outbound_at, other.last_outbound_at)), default=None)
+
+
+class AssistantDelta:
+    __slots__ = ('count', 'last_used', 'prompt_tokens', 'completion_tokens')
+
+    def __init__(self):
+        self.count = 0
+        self.last_used = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def merge(self, other):
+        self.count += other.count
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.last_used = max(filter(None, (self.last_used, other.last_used)), default=None)
+
+
+class StatsDelta:
+    __slots__ = (
+        'inbound', 'outbound', 'replies',
+        'requests', 'prompt_tokens', 'completion_tokens', 'first_inbound_at',
+    )
+
+    def __init__(self):
+        self.inbound = 0
+        self.outbound = 0
+        # Outgoing message ids, their response latency is read from the stored messages when flushed
+        self.replies = []
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.first_inbound_at = None
+
+    def merge(self, other):
+        for name in self.__slots__[:-1]:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        self.first_inbound_at = min(filter(None, (self.first_inbound_at, other.first_inbound_at)), default=None)
+
+
+def add_daily_stats(dashboard_id, day, messenger_type, **values):
+    """Atomically add values to a DashboardDailyStats row, creating it when missing"""
+    DashboardDailyStats = apps.get_model('chatbot', 'DashboardDailyStats')
+    increments = {name: F(name) + value for name, value in values.items() if value}
+    if not increments:
+        return
+    rows = DashboardDailyStats.objects.filter(dashboard_id=dashboard_id, day=day, messenger_type=messenger_type)
+    if rows.update(**increments):
+        return
+    try:
+        with transaction.atomic():
+            DashboardDailyStats.objects.create(
+                dashboard_id=dashboard_id, day=day, messenger_type=messenger_type, **values
+            )
+    except IntegrityError:
+        rows.update(**increments)
+
+
+class CounterBuffer:
+    """
+    Accumulates per-chat and per-assistant counters and the daily dashboard
+    rollups in memory and writes them with one atomic F() update per row per
+    flush interval, instead of one extra write per message.
+
+    Only processes that flush on a timer (the telegram runner and the
+    generation worker) buffer: everywhere else (web, admin, shell, other
+    commands) a message's counters are written as soon as it commits.
+    """
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self.periodic = False
+        self.lock = threading.Lock()
+        self.chats = {}
+        self.assistants = {}
+        self.stats = {}
+
+    def record_message(self, message):
+        """Count a stored message, call once its transaction has committed"""
+        created = message.created_date or now()
+        with self.lock:
+            if message.chat_id:
+                delta = self.chats.setdefault(message.chat_id, ChatDelta())
+                delta.count += 1
+                delta.preview = (message.text or '')[:PREVIEW_LENGTH]
+                if message.outgoing:
+                    delta.last_outbound_at = created
+                else:
+                    delta.last_inbound_at = created
+                self.record_stats(message, created)
+            if message.ai_assistant_id and message.outgoing:
+                self.add_usage(
+                    message.chat_id, message.ai_assistant_id,
+                    message.prompt_tokens, message.completion_tokens, created
+                )
+        if not self.periodic:
+            self.flush()
+
+    def record_usage(self, assistant_id, prompt_tokens, completion_tokens):
+        """
+        Count an LLM reply that is not stored as a Message (photos, audio) on its
+        assistant only. The daily rollups count stored replies, which is what
+        rebuild_daily_stats recomputes them from.
+        """
+        with self.lock:
+            self.add_usage(None, assistant_id, prompt_tokens, completion_tokens, now())
+        if not self.periodic:
+            self.flush()
+
+    def add_usage(self, chat_id, assistant_id, prompt_tokens, completion_tokens, created):
+        """One LLM call on the assistant and in the chat's daily rollup, called with the lock held"""
+        if assistant_id:
+            delta = self.assistants.setdefault(assistant_id, AssistantDelta())
+            delta.count += 1
+            delta.last_used = created
+            delta.prompt_tokens += prompt_tokens
+            delta.completion_tokens += completion_tokens
+        if chat_id:
+            stats = self.stats.setdefault((chat_id, localdate(created)), StatsDelta())
+            stats.requests += 1
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+
+    def record_stats(self, message, created):
+        """Rollup deltas per (chat, day), resolved to the dashboard when flushed"""
+        stats = self.stats.setdefault((message.chat_id, localdate(created)), StatsDelta())
+        if message.outgoing:
+            stats.outbound += 1
+            stats.replies.append(message.pk)
+        else:
+            stats.inbound += 1
+            stats.first_inbound_at = stats.first_inbound_at or created
+
+    def start_periodic_flush(self):
+        """Buffer from now on, the caller flushes every flush_interval and on exit"""
+        self.periodic = True
+
+    def flush(self):
+        """Write pending deltas, returns the number of updated rows"""
+        with self.lock:
+            chats, self.chats = self.chats, {}
+            assistants, self.assistants = self.assistants, {}
+            stats, self.stats = self.stats, {}
+        if not chats and not assistants and not stats:
+            return 0
+
+        try:
+            self.write(chats, assistants, stats)
+        except Exception as e:
+            logger.error(f"Failed to flush chat counters: {str(e)}", exc_info=True)
+            self.restore(chats, assistants, stats)
+            return 0
+        return len(chats) + len(assistants)
+
+    def write(self, chats, assistants, stats):
+        Chat = apps.get_model('chatbot', 'Chat')
+        AIAssistant = apps.get_model('chatbot', 'AIAssistant')
+        timestamp = now()
+        with transaction.atomic():
+            # Rollups first: they need the chats' previous last_inbound_at
+            self.write_stats(stats)
+            for chat_id, delta in sorted(chats.items()):
+                fields = {
+                    'message_count': F('message_count') + delta.count,
+                    'updated_date': timestamp,
+                    'last_updated': timestamp,
+                }
+                if delta.preview is not None:
+                    fields['last_message_preview'] = delta.preview
+                if delta.last_inbound_at:
+                    fields['last_inbound_at'] = Greatest(
+                        Coalesce('last_inbound_at', delta.last_inbound_at), delta.last_inbound_at
+                    )
+                if delta.last_outbound_at:
+                    fields['last_outbound_at'] = Greatest(
+                        Coalesce('last_outbound_at', delta.last_outbound_at), delta.last_outbound_at
+                    )
+                Chat.objects.filter(pk=chat_id).update(**fields)
+            for assistant_id, delta in sorted(assistants.items()):
+                AIAssistant.objects.filter(pk=assistant_id).update(
+                    usage_count=F('usage_count') + delta.count,
+                    prompt_tokens=F('prompt_tokens') + delta.prompt_tokens,
+                    completion_tokens=F('completion_tokens') + delta.completion_tokens,
+                    last_used=Greatest(Coalesce('last_used', delta.last_used), delta.last_used),
+                )
+
+    def write_stats(self, stats):
+        if not stats:
+            return
+        Chat = apps.get_model('chatbot', 'Chat')
+        chats = {
+            pk: (dashboard_id, messenger_type, last_inbound_at)
+            for pk, dashboard_id, messenger_type, last_inbound_at in Chat.objects.filter(
+                pk__in={chat_id for chat_id, _ in stats}
+            ).values_list('pk', 'dashboard_id', 'type', 'last_inbound_at')
+        }
+        latencies = self.response_latencies([pk for delta in stats.values() for pk in delta.replies])
+        rollups = {}
+        for (chat_id, day), delta in stats.items():
+            if chat_id not in chats or chats[chat_id][0] is None:
+                continue
+            dashboard_id, messenger_type, last_inbound_at = chats[chat_id]
+            values = rollups.setdefault((dashboard_id, day, messenger_type), dict.fromkeys((
+                'inbound_messages', 'outbound_messages', 'active_clients', 'response_count',
+                'response_time_total_ms', 'llm_requests', 'prompt_tokens', 'completion_tokens',
+            ), 0))
+            values['inbound_messages'] += delta.inbound
+            values['outbound_messages'] += delta.outbound
+            for pk in delta.replies:
+                if pk in latencies:
+                    values['response_count'] += 1
+                    values['response_time_total_ms'] += latencies[pk]
+            values['llm_requests'] += delta.requests
+            values['prompt_tokens'] += delta.prompt_tokens
+            values['completion_tokens'] += delta.completion_tokens
+            # First inbound message of the client that day
+            if delta.first_inbound_at and (last_inbound_at is None or localdate(last_inbound_at) < day):
+                values['active_clients'] += 1
+        for (dashboard_id, day, messenger_type), values in sorted(rollups.items()):
+            add_daily_stats(dashboard_id, day, messenger_type, **values)
+
+    def response_latencies(self, reply_ids):
+        """
+        Milliseconds from the latest inbound message to each reply that is the first answer to it.
+        Read from the stored messages, the inbound message may have been written by another process
+        (with GENERATION_QUEUE the runner stores it and a generation worker the reply)
+        """
+        if not reply_ids:
+            return {}
+        Message = apps.get_model('chatbot', 'Message')
+        replies = Message.objects.filter(pk__in=reply_ids).annotate(
+            inbound_at=Subquery(
+                Message.objects.filter(
+                    chat_id=OuterRef('chat_id'), outgoing=False, created_date__lte=OuterRef('created_date')
+                ).order_by('-created_date').values('created_date')[:1]
+            ),
+        ).annotate(
+            answered=Exists(Message.objects.filter(
+                chat_id=OuterRef('chat_id'), outgoing=True,
+                created_date__gte=OuterRef('inbound_at'), created_date__lt=OuterRef('created_date')
+            )),
+        ).filter(inbound_at__isnull=False, answered=False)
+        return {
+            pk: int((created - inbound_at).total_seconds() * 1000)
+            for pk, created, inbound_at in replies.values_list('pk', 'created_date', 'inbound_at')
+        }
+
+    def restore(self, chats, assistants, stats):
+        """Put deltas of a failed flush back in front of the ones recorded since"""
+        with self.lock:
+            for pending, failed, delta_class in (
+                (self.chats, chats, ChatDelta),
+                (self.assistants, assistants, AssistantDelta),
+                (self.stats, stats, StatsDelta),
+            ):
+                for key, delta in failed.items():
+                    merged = delta_class()
+                    merged.merge(delta)
+                    if key in pending:
+                        merged.merge(pending[key])
+                    pending[key] = merged
+
+    def depth(self):
+        """Pending deltas per kind, reported as a queue depth metric"""
+        return {('chats',): len(self.chats), ('assistants',): len(self.assistants), ('stats',): len(self.stats)}
+
+
+counters = CounterBuffer(getattr(settings, 'CHAT_COUNTERS_FLUSH_INTERVAL', 5))
+registry.gauge('chatbot_counter_buffer_pending', 'Counter deltas waiting to be flushed', ('kind',), counters.depth)
+
+
+@atexit.register
+def flush_at_exit():
+    """Write what is still buffered, a failure is logged instead of raised during shutdown"""
+    try:
+        counters.flush()
+    except Exception as e:
+        logger.error(f"Failed to flush chat counters at exit: {str(e)}", exc_info=True)
@@ -0,0 +1,64 @@
+import csv
+import json
+from datetime import datetime, time
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.timezone import is_naive, make_aware
+
+from .models import Message
+
+EXPORT_FORMATS = ('jsonl', 'csv')
+EXPORT_FIELDS = (
+    'id', 'chat_id', 'client_id', 'ai_assistant_id', 'outgoing',
+    'text', 'media_type', 'media_url', 'created_date', 'sender_info',
+)
+CHUNK_SIZE = 2000
+
+
+def parse_bound(value):
+    """Parse an ISO date or datetime export bound, dates start at midnight"""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: {value}")
+        parsed = datetime.combine(day, time.min)
+    return make_aware(parsed) if is_naive(parsed) else parsed
+
+
+def export_queryset(dashboard, start=None, end=None):
+    queryset = Message.objects.filter(chat__dashboard=dashboard)
+    if start:
+        queryset = queryset.filter(created_date__gte=start)
+    if end:
+        queryset = queryset.filter(created_date__lt=end)
+    return queryset.order_by('pk').values_list(*EXPORT_FIELDS)
+
+
+class Echo:
+    """Pseudo file for csv.writer that hands back each written row"""
+
+    def write(self, value):
+        return value
+
+
+def export_lines(dashboard, start=None, end=None, export_format='jsonl'):
+    """
+    Yield export lines for the dashboard's messages.
+
+    Rows are read through a server-side cursor in chunks, so memory stays
+    constant however many messages are exported.
+    """
+    rows = export_queryset(dashboard, start, end).iterator(chunk_size=CHUNK_SIZE)
+    if export_format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            row = list(row)
+            row[-1] = json.dumps(row[-1], ensure_ascii=False) if row[-1] is not None else ''
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_FIELDS, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
@@ -0,0 +1,155 @@
+"""
+Logging for the long-running bot runner.
+
+Records are put on an in-memory queue by the calling thread (usually the
+event loop) and formatted, redacted and written by a background
+QueueListener, so log I/O never blocks update handling.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+from datetime import datetime, timezone
+
+# Context attributes passed with `extra=` that are copied to JSON records
+CONTEXT_FIELDS = ('dashboard', 'chat_id', 'update_id', 'user_id', 'stage', 'model', 'duration_ms')
+
+REDACTIONS = (
+    # Also inside Bot API URLs, where the token follows "/bot"
+    (re.compile(r'(?<!\d)\d{6,12}:[A-Za-z0-9_-]{30,}'), '<bot-token>'),
+    (re.compile(r'\bsk-[A-Za-z0-9_-]{16,}\b'), '<api-key>'),
+    (re.compile(r'(?i)\b(bearer|token|api_key|password)(["\']?\s*[:=]\s*["\']?)[^\s"\',}]+'), r'\1\2<redacted>'),
+    # Authorization headers: "Bearer <token>"
+    (re.compile(r'(?i)\b(bearer)(\s+)[^\s"\',}]+'), r'\1\2<redacted>'),
+    (re.compile(r'\b[\w.+-]+@[\w-]+\.[\w.-]+\b'), '<email>'),
+    (re.compile(r'\+\d[\d ()-]{8,}\d\b'), '<phone>'),
+)
+
+
+def redact(text):
+    for pattern, replacement in REDACTIONS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+class RedactingFilter(logging.Filter):
+    """Masks bot tokens, API keys, credentials, emails and phone numbers"""
+
+    def filter(self, record):
+        record.msg = redact(record.getMessage())
+        record.args = None
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of records below WARNING for the configured loggers.
+
+    `rates` maps logger name prefixes to the kept fraction, e.g.
+    {'apps.chatbot.management.telegram_manager': 0.1}; the longest prefix wins.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = sorted((rates or {}).items(), key=lambda item: len(item[0]), reverse=True)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + '.'):
+                return rate >= 1 or random.random() < rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for name in CONTEXT_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                data[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that merges args in the caller and drops records when the queue is full"""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener = None
+
+
+def setup_logging(level='INFO', log_file=None, json_format=True, sampling=None,
+                  max_bytes=50 * 1024 * 1024, backup_count=5, queue_size=10000):
+    """
+    Route all logging through a bounded queue and a background listener.
+
+    When the queue is full new records are dropped instead of blocking the caller.
+    Returns the QueueListener, stopped by `stop_logging()`.
+    """
+    global _listener
+    stop_logging()
+
+    formatter = JsonFormatter() if json_format else logging.Formatter(
+        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        handler.addFilter(RedactingFilter())
+
+    records = queue.Queue(maxsize=queue_size)
+    queue_handler = ContextQueueHandler(records)
+    queue_handler.addFilter(SamplingFilter(sampling))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the background listener"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
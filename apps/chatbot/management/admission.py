@@ -0,0 +1,79 @@
+"""
+Admission control for the LLM calls of a runner process.
+
+Load is the number of LLM calls in progress and how many of them wait for a
+scheduler slot (see scheduler.py). Above a soft threshold calls are
+degraded: at most LLM_DEGRADED_MAX_TOKENS, the assistant's fast model when
+its routing policy has one, the last LLM_DEGRADED_HISTORY history entries and
+no hedging. Above a hard threshold calls are shed: the user gets an immediate
+"busy" reply and nothing is sent to the LLM. A threshold of 0 is disabled.
+
+A shed call is not a reply: it is not stored, counted or kept in history, and
+the generation worker requeues its job (Overloaded) instead of answering it.
+"""
+from django.conf import settings
+
+from apps.chatbot.management.scheduler import scheduler
+from apps.chatbot.metrics import registry
+
+NORMAL, DEGRADED, SHED = 'normal', 'degraded', 'shed'
+
+BUSY_REPLY = "⏳ I'm very busy right now. Please try again in a minute."
+
+
+class Overloaded(Exception):
+    """A call shed by admission control, for callers that retry later"""
+
+
+ADMISSIONS = registry.counter('chatbot_llm_admissions_total', 'LLM calls by admission result', ('result', 'dashboard'))
+
+
+def exceeds(value, limit):
+    return bool(limit) and value >= limit
+
+
+class AdmissionControl:
+    def __init__(self, soft_in_flight=0, hard_in_flight=0, soft_queue=0, hard_queue=0):
+        self.soft_in_flight = soft_in_flight
+        self.hard_in_flight = hard_in_flight
+        self.soft_queue = soft_queue
+        self.hard_queue = hard_queue
+        self.in_flight = 0
+
+    def level(self):
+        queued = scheduler.waiting()
+        if exceeds(self.in_flight, self.hard_in_flight) or exceeds(queued, self.hard_queue):
+            return SHED
+        if exceeds(self.in_flight, self.soft_in_flight) or exceeds(queued, self.soft_queue):
+            return DEGRADED
+        return NORMAL
+
+    def enter(self, metrics_label=''):
+        """Admit a call, returns its level. Calls not shed must `leave` when done"""
+        level = self.level()
+        ADMISSIONS.inc(level, metrics_label)
+        if level != SHED:
+            self.in_flight += 1
+        return level
+
+    def leave(self):
+        self.in_flight -= 1
+
+    def samples(self):
+        return {
+            ('in_flight', 'current'): self.in_flight,
+            ('in_flight', 'soft'): self.soft_in_flight,
+            ('in_flight', 'hard'): self.hard_in_flight,
+            ('queued', 'current'): scheduler.waiting(),
+            ('queued', 'soft'): self.soft_queue,
+            ('queued', 'hard'): self.hard_queue,
+        }
+
+
+admission = AdmissionControl(
+    settings.ADMISSION_SOFT_IN_FLIGHT, settings.ADMISSION_HARD_IN_FLIGHT,
+    settings.ADMISSION_SOFT_QUEUE, settings.ADMISSION_HARD_QUEUE
+)
+registry.gauge(
+    'chatbot_llm_admission', 'LLM call load and the admission thresholds', ('load', 'value'), admission.samples
+)
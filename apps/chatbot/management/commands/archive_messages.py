@@ -0,0 +1,48 @@
+import logging
+import time
+from django.core.management.base import BaseCommand
+from apps.chatbot.archive import archive_dashboard, retention_days
+from apps.chatbot.models import Dashboard
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Moves messages older than the retention window of each dashboard to compressed archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dashboard', type=int, action='append', help='Only archive these dashboard ids')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Messages archived per transaction')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between chunks')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many messages would be archived')
+        parser.add_argument('--every', type=int, default=0,
+                            help='Keep running and archive every N seconds (scheduled job mode)')
+
+    def handle(self, *args, **options):
+        while True:
+            self.archive(options)
+            if not options['every']:
+                break
+            time.sleep(options['every'])
+
+    def archive(self, options):
+        dashboards = Dashboard.objects.all()
+        if options['dashboard']:
+            dashboards = dashboards.filter(pk__in=options['dashboard'])
+
+        for dashboard in dashboards.iterator():
+            if not retention_days(dashboard):
+                continue
+            try:
+                count = archive_dashboard(
+                    dashboard,
+                    chunk_size=options['chunk_size'],
+                    pause=options['pause'],
+                    dry_run=options['dry_run']
+                )
+            except Exception as e:
+                logger.error(f"Failed to archive dashboard {dashboard.pk}: {str(e)}", exc_info=True)
+                continue
+            if count:
+                verb = 'would be archived' if options['dry_run'] else 'archived'
+                self.stdout.write(f"Dashboard {dashboard.pk}: {count} messages {verb}")
@@ -0,0 +1,325 @@
+import asyncio
+import gc
+import json
+import os
+import logging
+import statistics
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from apps.chatbot.counters import counters
+from apps.chatbot.metrics import CACHE, STAGE_LATENCY, percentile, process_rss_bytes
+from apps.chatbot.management.admission import ADMISSIONS
+from apps.chatbot.management.deadlines import TIMEOUTS
+from apps.chatbot.management.jobs import JOBS, GenerationWorker
+from apps.chatbot.management.llm import HEDGES
+from apps.chatbot.management.poller import SharedPoller
+from apps.chatbot.management.routing import ROUTES
+from apps.chatbot.management.scheduler import QUEUE_WAIT, scheduler
+from apps.chatbot.management.fake_servers import FakeOpenAIServer, FakeTelegramServer
+from apps.chatbot.management.telegram_manager import TelegramBotManager
+from apps.chatbot.models import Messenger, AIAssistant, Dashboard
+from apps.accounts.models import User
+
+BENCH_PREFIX = 'bench-load'
+
+
+def rss_mb():
+    """Resident memory of this process"""
+    return process_rss_bytes() / 2 ** 20
+
+
+def open_sockets():
+    """Socket descriptors of this process, including the fake servers' side of each connection"""
+    count = 0
+    for fd in os.listdir('/proc/self/fd'):
+        try:
+            count += os.readlink(f'/proc/self/fd/{fd}').startswith('socket:')
+        except OSError:
+            pass
+    return count
+
+
+class Command(BaseCommand):
+    help = 'Drives N bots x M chats through local fake Telegram/OpenAI servers and reports end-to-end latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bots', type=int, default=5)
+        parser.add_argument('--chats', type=int, default=20, help='Chats per bot')
+        parser.add_argument('--messages', type=int, default=5, help='Messages per chat, each waits for its reply')
+        parser.add_argument('--telegram-latency', default='lognormal:20:120',
+                            help='fixed:MS, uniform:MIN:MAX or lognormal:MEDIAN:P99')
+        parser.add_argument('--openai-latency', default='lognormal:400:3000')
+        parser.add_argument('--telegram-error-rate', type=float, default=0.0)
+        parser.add_argument('--openai-error-rate', type=float, default=0.0)
+        parser.add_argument('--assistant-config', type=json.loads, default={},
+                            help='JSON AIAssistant.config for the bench assistants, e.g. a routing policy')
+        parser.add_argument('--poller', choices=('shared', 'ptb'), default='shared',
+                            help='Shared long-poller over pooled connections, or one PTB Updater per bot')
+        parser.add_argument('--backlog', type=int, default=0,
+                            help='Messages per chat queued before the bots start, drained by catch-up')
+        parser.add_argument('--noisy-chats', type=int, default=0,
+                            help='Extra chats for the first bot, to see how the others fare next to it')
+        parser.add_argument('--llm-capacity', type=int, default=None,
+                            help='LLM calls running at once (LLM_MAX_CONCURRENCY), 0 means unlimited')
+        parser.add_argument('--generation-workers', type=int, default=0,
+                            help='Reply through the GenerationJob queue with this many in-process workers')
+        parser.add_argument('--idle-bots', type=int, default=0,
+                            help='Extra bots without traffic, hibernated to report per-bot memory (shared poller)')
+        parser.add_argument('--hibernate-after', type=float, default=2.0,
+                            help='Seconds without updates before a bot hibernates once the traffic is done')
+        parser.add_argument('--reply-timeout', type=float, default=60.0, help='Seconds to wait for each reply')
+
+    def handle(self, *args, **options):
+        logging.getLogger('apps.chatbot').setLevel(logging.WARNING)
+        # Like the runner, counters are buffered and not written on the measured path
+        counters.start_periodic_flush()
+        self.pending = defaultdict(deque)
+        self.unsolicited = 0
+        self.loop = None
+
+        telegram = FakeTelegramServer(
+            options['telegram_latency'], options['telegram_error_rate'], on_message=self.on_message
+        ).start()
+        openai = FakeOpenAIServer(options['openai_latency'], options['openai_error_rate']).start()
+        owner, _ = User.objects.get_or_create(email=f'{BENCH_PREFIX}@example.com')
+        dashboards = []
+        try:
+            messengers = []
+            for index in range(options['bots'] + options['idle_bots']):
+                dashboard = Dashboard.objects.create(name=f'{BENCH_PREFIX} {index}', owner=owner)
+                dashboards.append(dashboard)
+                AIAssistant.objects.create(
+                    dashboard=dashboard, assistant_id=f'{BENCH_PREFIX}-{dashboard.pk}', model='gpt-4o-mini',
+                    config=options['assistant_config']
+                )
+                messenger = Messenger.objects.create(
+                    dashboard=dashboard, messenger_type='telegram', token=f'{900000 + dashboard.pk}:{BENCH_PREFIX}'
+                )
+                messengers.append(Messenger.objects.select_related('dashboard').get(pk=messenger.pk))
+
+            with override_settings(
+                TELEGRAM_API_BASE_URL=telegram.api_url,
+                TELEGRAM_FILE_BASE_URL=telegram.file_url,
+                OPENAI_BASE_URL=openai.api_url,
+                GENERATION_QUEUE=bool(options['generation_workers']),
+            ):
+                report = asyncio.run(self.run(messengers, telegram, options))
+        finally:
+            telegram.stop()
+            openai.stop()
+            for dashboard in dashboards:
+                dashboard.delete()
+
+        self.print_report(report, telegram, openai, options)
+
+    def on_message(self, token, chat_id, text):
+        """Called from the fake server thread for every message the bot sends"""
+        waiters = self.pending[(token, chat_id)]
+        if waiters and self.loop:
+            future = waiters.popleft()
+            self.loop.call_soon_threadsafe(lambda: future.done() or future.set_result((time.perf_counter(), text)))
+        else:
+            self.unsolicited += 1
+
+    async def run(self, messengers, telegram, options):
+        self.loop = asyncio.get_running_loop()
+        if options['llm_capacity'] is not None:
+            scheduler.capacity = options['llm_capacity']
+        if options['backlog']:
+            for messenger in messengers:
+                for chat in range(options['chats']):
+                    telegram.push_text(messenger.token, 10_000_000 + chat, '/start')
+                    for index in range(options['backlog']):
+                        telegram.push_text(messenger.token, 10_000_000 + chat, f'Backlog message {index}')
+        rss_before = rss_mb()
+        poller = None
+        if options['poller'] == 'shared':
+            if options['idle_bots']:
+                # Hibernation is switched on after the traffic, see `hibernation`
+                poller = SharedPoller(timeout=1, idle_timeout=4)
+                tracemalloc.start()
+            else:
+                poller = SharedPoller(timeout=10)
+            await poller.initialize()
+        stop_workers = asyncio.Event()
+        workers = [
+            asyncio.create_task(GenerationWorker(f'{BENCH_PREFIX}-{index}').run(stop_workers))
+            for index in range(options['generation_workers'])
+        ]
+        backlog_started = time.perf_counter()
+        managers = []
+        for messenger in messengers:
+            manager = TelegramBotManager(messenger, poller)
+            if await manager.initialize():
+                managers.append(manager)
+        await asyncio.gather(*(manager.resume_task for manager in managers))
+        idle = [manager for manager in managers if manager.messenger in messengers[options['bots']:]]
+        managers = [manager for manager in managers if manager not in idle]
+        backlog_elapsed = time.perf_counter() - backlog_started
+        backlog_replies = self.unsolicited
+        latencies = []
+        quiet_latencies = []
+        failures = defaultdict(int)
+
+        async def send(token, chat_id, text):
+            future = self.loop.create_future()
+            self.pending[(token, chat_id)].append(future)
+            started = time.perf_counter()
+            telegram.push_text(token, chat_id, text)
+            try:
+                finished, reply = await asyncio.wait_for(future, options['reply_timeout'])
+            except asyncio.TimeoutError:
+                failures['timeout'] += 1
+                return None
+            if reply.startswith(('⚠️', '⏳', '⌛', '🔌')):
+                failures['error reply'] += 1
+            return finished - started
+
+        async def conversation(token, chat_id, quiet):
+            await send(token, chat_id, '/start')
+            for index in range(options['messages']):
+                latency = await send(token, chat_id, f'Benchmark message {index}')
+                if latency is not None:
+                    latencies.append(latency)
+                    if quiet:
+                        quiet_latencies.append(latency)
+
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(
+                conversation(manager.token, 10_000_000 + chat, options['noisy_chats'] and index > 0)
+                for index, manager in enumerate(managers)
+                for chat in range(options['chats'] + (options['noisy_chats'] if index == 0 else 0))
+            ))
+        finally:
+            elapsed = time.perf_counter() - started
+            resources = {
+                'rss_mb': rss_mb() - rss_before,
+                'sockets': open_sockets(),
+                'poll_calls': sum(telegram.poll_calls.values()),
+            }
+            if idle and poller:
+                resources['hibernation'] = await self.hibernation(poller, managers + idle, send, options)
+            for manager in managers + idle:
+                await manager.shutdown()
+            stop_workers.set()
+            await asyncio.gather(*workers)
+            if poller:
+                await poller.close()
+        return {
+            'resources': resources,
+            'noisy_dashboard': managers[0].metrics_label if managers else None,
+            'bots': len(managers), 'latencies': latencies, 'quiet_latencies': quiet_latencies, 'failures': dict(failures), 'elapsed': elapsed,
+            'backlog_elapsed': backlog_elapsed, 'backlog_replies': backlog_replies,
+        }
+
+    async def hibernation(self, poller, managers, send, options):
+        """Memory released by hibernating the bots and the latency of waking one"""
+        gc.collect()
+        awake, awake_heap = rss_mb(), tracemalloc.get_traced_memory()[0]
+        poller.hibernate_after = options['hibernate_after']
+        deadline = time.perf_counter() + options['hibernate_after'] + 30
+        while not all(manager.hibernated for manager in managers) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.5)
+        hibernated = [manager for manager in managers if manager.hibernated]
+        gc.collect()
+        asleep, asleep_heap = rss_mb(), tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        wake = await send(hibernated[-1].token, 20_000_000, '/start') if hibernated else None
+        return {
+            'bots': len(hibernated), 'awake_mb': awake, 'asleep_mb': asleep,
+            'rss_kb': (awake - asleep) * 1024 / max(len(hibernated), 1),
+            'heap_kb': (awake_heap - asleep_heap) / 1024 / max(len(hibernated), 1),
+            'wake_ms': wake * 1000 if wake is not None else None,
+        }
+
+    def print_report(self, report, telegram, openai, options):
+        latencies = [latency * 1000 for latency in report['latencies']]
+        self.stdout.write(
+            f"\n{report['bots']} bots x {options['chats']} chats x {options['messages']} messages"
+            f" | telegram {options['telegram_latency']} (errors {options['telegram_error_rate']:.0%})"
+            f" | openai {options['openai_latency']} (errors {options['openai_error_rate']:.0%})"
+        )
+        if options['backlog']:
+            queued = report['bots'] * options['chats'] * (options['backlog'] + 1)
+            self.stdout.write(f"backlog:     {queued} updates drained in {report['backlog_elapsed']:.2f}s "
+                              f"with {report['backlog_replies']} replies")
+        self.stdout.write(f"replies:     {len(latencies)} in {report['elapsed']:.2f}s "
+                          f"({len(latencies) / report['elapsed']:.1f}/s)")
+        if latencies:
+            self.stdout.write(
+                f"latency ms:  p50 {percentile(latencies, 0.50):.0f}  p95 {percentile(latencies, 0.95):.0f}"
+                f"  p99 {percentile(latencies, 0.99):.0f}  max {max(latencies):.0f}"
+                f"  mean {statistics.mean(latencies):.0f}"
+            )
+        quiet = [latency * 1000 for latency in report['quiet_latencies']]
+        if quiet:
+            self.stdout.write(
+                f"quiet bots:  p50 {percentile(quiet, 0.50):.0f}  p95 {percentile(quiet, 0.95):.0f}"
+                f"  p99 {percentile(quiet, 0.99):.0f}  next to a bot with {options['noisy_chats']} extra chats"
+            )
+            noisy_label = report['noisy_dashboard']
+            waits = defaultdict(lambda: [0.0, 0])
+            for name, (dashboard,), _, value in QUEUE_WAIT.samples():
+                group = 'noisy' if dashboard == noisy_label else 'quiet'
+                if name.endswith('_sum'):
+                    waits[group][0] += value
+                elif name.endswith('_count'):
+                    waits[group][1] += value
+            self.stdout.write("llm wait:    " + "  ".join(
+                f"{group} {total / count * 1000:.0f}ms" for group, (total, count) in waits.items() if count
+            ))
+        self.stdout.write(f"failures:    {report['failures'] or 'none'}")
+        resources = report['resources']
+        self.stdout.write(
+            f"resources:   {options['poller']} poller, rss +{resources['rss_mb']:.1f}MB, "
+            f"{resources['sockets']} sockets, {resources['poll_calls']} getUpdates calls "
+            f"({resources['poll_calls'] / max(report['bots'], 1) / report['elapsed']:.2f}/bot/s)"
+        )
+        hibernation = resources.get('hibernation')
+        if hibernation:
+            wake = f"{hibernation['wake_ms']:.0f}ms" if hibernation['wake_ms'] is not None else 'timed out'
+            self.stdout.write(
+                f"hibernation: {hibernation['bots']} bots, rss {hibernation['awake_mb']:.1f}MB -> "
+                f"{hibernation['asleep_mb']:.1f}MB, released per bot {hibernation['rss_kb']:.0f}KB rss "
+                f"{hibernation['heap_kb']:.0f}KB python heap, first reply after wake {wake}"
+            )
+        self.stdout.write(f"telegram:    requests {dict(telegram.requests)} errors {dict(telegram.errors)}")
+        self.stdout.write(f"openai:      requests {dict(openai.requests)} errors {dict(openai.errors)}")
+
+        routes = {f'{route}:{model}': int(value) for _, (route, model), _, value in ROUTES.samples()}
+        if routes:
+            self.stdout.write(f"routes:      {routes}")
+        admissions = defaultdict(int)
+        for _, (result, _dashboard), _, value in ADMISSIONS.samples():
+            admissions[result] += int(value)
+        if set(admissions) - {'normal'}:
+            self.stdout.write(f"admission:   {dict(admissions)}")
+        timeouts = defaultdict(int)
+        for _, (stage, _dashboard), _, value in TIMEOUTS.samples():
+            timeouts[stage] += int(value)
+        if timeouts:
+            self.stdout.write(f"timeouts:    {dict(timeouts)}")
+        caches = {f'{cache}:{result}': int(value) for _, (cache, result), _, value in CACHE.samples()}
+        if caches:
+            self.stdout.write(f"caches:      {caches}")
+        jobs = {result: int(value) for _, (result,), _, value in JOBS.samples()}
+        if jobs:
+            self.stdout.write(f"jobs:        {jobs}")
+        hedges = {f'{result}:{model}': int(value) for _, (model, result), _, value in HEDGES.samples()}
+        if hedges:
+            self.stdout.write(f"hedges:      {hedges}")
+
+        stages = defaultdict(lambda: [0.0, 0])
+        for name, labels, _, value in STAGE_LATENCY.samples():
+            if name.endswith('_sum'):
+                stages[labels[0]][0] += value
+            elif name.endswith('_count'):
+                stages[labels[0]][1] += value
+        if stages:
+            self.stdout.write("stage means: " + "  ".join(
+                f"{stage} {total / count * 1000:.0f}ms" for stage, (total, count) in stages.items() if count
+            ))
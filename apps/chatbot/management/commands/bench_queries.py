@@ -0,0 +1,176 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from apps.chatbot.models import Messenger, Message, Chat, Client, AIAssistant, Dashboard
+from apps.accounts.models import User
+
+
+BENCH_PREFIX = 'bench-queries'
+# Added by migration 0014_hot_path_indexes
+HOT_PATH_INDEXES = (
+    (AIAssistant, {'assistant_active_dashboard_idx'}),
+    (Message, {'message_chat_created_idx'}),
+    (Client, {'unique_dashboard_telegram_chat_id', 'unique_dashboard_whatsapp_chat_id'}),
+)
+
+
+class Command(BaseCommand):
+    help = 'Seeds a large Message table and reports query plans and latency of the bot hot-path queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2_000_000, help='Number of messages to seed')
+        parser.add_argument('--clients', type=int, default=20_000, help='Number of clients (one chat each) to seed')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=50, help='Executions per query when timing')
+        parser.add_argument('--skip-seed', action='store_true', help='Reuse previously seeded data')
+        parser.add_argument('--cleanup', action='store_true', help='Delete seeded data and exit')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            # Messages go first in batches, one cascading delete exceeds SQLite's variable limit
+            messages = Message.objects.filter(chat__dashboard__name__startswith=BENCH_PREFIX)
+            while ids := list(messages.values_list('pk', flat=True)[:options['batch_size']]):
+                Message.objects.filter(pk__in=ids).delete()
+            Dashboard.objects.filter(name__startswith=BENCH_PREFIX).delete()
+            User.objects.filter(email=f'{BENCH_PREFIX}@example.com').delete()
+            self.stdout.write("Benchmark data removed.")
+            return
+
+        if options['skip_seed']:
+            dashboard = Dashboard.objects.filter(name__startswith=BENCH_PREFIX).first()
+            if not dashboard:
+                self.stderr.write("No seeded data found, run without --skip-seed first.")
+                return
+        else:
+            dashboard = self.seed(options)
+
+        messenger = Messenger.objects.get(dashboard=dashboard)
+        client = Client.objects.filter(dashboard=dashboard).order_by('?').first()
+        chat = Chat.objects.get(client=client)
+
+        queries = {
+            'client lookup': lambda: Client.objects.filter(
+                dashboard=dashboard, telegram_chat_id=client.telegram_chat_id
+            ),
+            'chat lookup': lambda: Chat.objects.filter(messenger=messenger, client=client),
+            'default assistant': lambda: AIAssistant.objects.filter(
+                dashboard=dashboard, is_active=True
+            ).order_by('-created_date')[:1],
+            'conversation history': lambda: Message.objects.filter(chat=chat).order_by('-created_date')[:5],
+        }
+
+        # Measure without the hot-path indexes first, then with them restored
+        indexed = self.hot_path_indexes()
+        with connection.schema_editor() as editor:
+            for model, item in indexed:
+                self.drop(editor, model, item)
+        try:
+            before = self.measure(queries, options['repeat'], 'BEFORE (no hot-path indexes)')
+        finally:
+            with connection.schema_editor() as editor:
+                for model, item in indexed:
+                    self.create(editor, model, item)
+        after = self.measure(queries, options['repeat'], 'AFTER (hot-path indexes)')
+
+        self.stdout.write("\nSummary (median ms):")
+        for name in queries:
+            self.stdout.write(f"  {name:<22} {before[name]:>10.3f} -> {after[name]:>10.3f}")
+
+    def seed(self, options):
+        self.stdout.write(f"Seeding {options['clients']} clients and {options['messages']} messages...")
+        owner, _ = User.objects.get_or_create(email=f'{BENCH_PREFIX}@example.com')
+        dashboard = Dashboard.objects.create(name=f'{BENCH_PREFIX} {int(time.time())}', owner=owner)
+        messenger = Messenger.objects.create(
+            dashboard=dashboard,
+            messenger_type='telegram',
+            token=f'{BENCH_PREFIX}-{dashboard.id}'
+        )
+        for i in range(5):
+            AIAssistant.objects.create(
+                dashboard=dashboard,
+                assistant_id=f'{BENCH_PREFIX}-{dashboard.id}-{i}',
+                is_active=i == 4
+            )
+
+        batch_size = options['batch_size']
+        clients = []
+        for start in range(0, options['clients'], batch_size):
+            with transaction.atomic():
+                clients += Client.objects.bulk_create(
+                    Client(
+                        dashboard=dashboard,
+                        telegram_chat_id=start + i,
+                        messenger_type='telegram',
+                        name=f'Client {start + i}'
+                    )
+                    for i in range(min(batch_size, options['clients'] - start))
+                )
+        chats = []
+        for start in range(0, len(clients), batch_size):
+            with transaction.atomic():
+                chats += Chat.objects.bulk_create(
+                    Chat(messenger=messenger, type='telegram', client=client, dashboard=dashboard, is_active=True)
+                    for client in clients[start:start + batch_size]
+                )
+
+        for start in range(0, options['messages'], batch_size):
+            batch = []
+            for i in range(min(batch_size, options['messages'] - start)):
+                chat = random.choice(chats)
+                batch.append(Message(
+                    text='benchmark message',
+                    client_id=chat.client_id,
+                    chat=chat,
+                    outgoing=bool(i % 2),
+                ))
+            with transaction.atomic():
+                Message.objects.bulk_create(batch)
+            self.stdout.write(f"  {start + len(batch)} messages", ending='\r')
+        self.stdout.write("")
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        return dashboard
+
+    def hot_path_indexes(self):
+        """The indexes and constraints added by migration 0014, only these are dropped for the baseline"""
+        return [
+            (model, item)
+            for model, names in HOT_PATH_INDEXES
+            for item in model._meta.indexes + model._meta.constraints
+            if item.name in names
+        ]
+
+    def drop(self, editor, model, item):
+        if isinstance(item, models.Index):
+            editor.remove_index(model, item)
+        else:
+            editor.remove_constraint(model, item)
+
+    def create(self, editor, model, item):
+        if isinstance(item, models.Index):
+            editor.add_index(model, item)
+        else:
+            editor.add_constraint(model, item)
+
+    def measure(self, queries, repeat, title):
+        self.stdout.write(f"\n=== {title}")
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        results = {}
+        for name, build in queries.items():
+            explain_options = {'analyze': True} if connection.vendor == 'postgresql' else {}
+            self.stdout.write(f"\n-- {name}")
+            self.stdout.write(build().explain(**explain_options))
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                list(build())
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = statistics.median(timings)
+            self.stdout.write(f"median {results[name]:.3f} ms over {repeat} runs")
+        return results
@@ -0,0 +1,109 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import connection
+from apps.chatbot.management.repository import ChatRepository, db_task
+from apps.chatbot.models import Messenger, Message, Chat, Client, AIAssistant, Dashboard
+from apps.accounts.models import User
+
+
+BENCH_PREFIX = 'bench-repository'
+
+
+def slow_query(seconds):
+    """Simulates a slow statement holding a database thread"""
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_sleep(%s)', [seconds])
+    else:
+        time.sleep(seconds)
+
+
+class LegacyRepository:
+    """The previous data access path: every call hops onto the thread-sensitive executor"""
+
+    def __init__(self, messenger):
+        self.messenger = messenger
+        self.dashboard = messenger.dashboard
+
+    async def get_client_and_chat(self, user):
+        try:
+            client = await sync_to_async(Client.objects.get)(dashboard=self.dashboard, telegram_chat_id=user.id)
+        except Client.DoesNotExist:
+            client = await sync_to_async(Client.objects.create)(
+                dashboard=self.dashboard, telegram_chat_id=user.id, name=user.first_name
+            )
+        try:
+            chat = await sync_to_async(Chat.objects.get)(messenger=self.messenger, client=client)
+        except Chat.DoesNotExist:
+            chat = await sync_to_async(Chat.objects.create)(
+                messenger=self.messenger, type='telegram', client=client, is_active=True, dashboard=self.dashboard
+            )
+        return client, chat
+
+    async def get_default_assistant(self):
+        return await sync_to_async(AIAssistant.objects.filter(
+            dashboard=self.dashboard, is_active=True
+        ).order_by('-created_date').first)()
+
+    async def get_history(self, chat, limit=5):
+        return await sync_to_async(list)(Message.objects.filter(chat=chat).order_by('-created_date')[:limit])
+
+    async def create_message(self, **fields):
+        return await sync_to_async(Message.objects.create)(**fields)
+
+
+class Command(BaseCommand):
+    help = 'Compares runner DB throughput of the legacy sync_to_async path and the async repository'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chats', type=int, default=200, help='Concurrent chats')
+        parser.add_argument('--turns', type=int, default=5, help='Message turns per chat')
+        parser.add_argument('--slow-query-ms', type=int, default=50,
+                            help='Duration of a slow statement issued by every 10th chat, 0 to disable')
+
+    def handle(self, *args, **options):
+        owner, _ = User.objects.get_or_create(email=f'{BENCH_PREFIX}@example.com')
+        dashboard = Dashboard.objects.create(name=f'{BENCH_PREFIX} {int(time.time())}', owner=owner)
+        try:
+            messenger = Messenger.objects.create(
+                dashboard=dashboard, messenger_type='telegram', token=f'{BENCH_PREFIX}-{dashboard.id}'
+            )
+            AIAssistant.objects.create(dashboard=dashboard, assistant_id=f'{BENCH_PREFIX}-{dashboard.id}')
+            messenger = Messenger.objects.select_related('dashboard').get(pk=messenger.pk)
+
+            for name, repository in (
+                ('legacy sync_to_async', LegacyRepository(messenger)),
+                ('async repository', ChatRepository(messenger)),
+            ):
+                Client.objects.filter(dashboard=dashboard).delete()
+                elapsed = asyncio.run(self.run(repository, options))
+                turns = options['chats'] * options['turns']
+                self.stdout.write(
+                    f"{name:<22} {turns} turns in {elapsed:.2f}s -> {turns / elapsed:.1f} turns/s"
+                )
+        finally:
+            dashboard.delete()
+
+    async def run(self, repository, options):
+        slow = db_task(slow_query) if isinstance(repository, ChatRepository) else sync_to_async(slow_query)
+        delay = options['slow_query_ms'] / 1000
+
+        async def conversation(index):
+            user = SimpleNamespace(
+                id=10_000 + index, first_name=f'User {index}', last_name=None, username=None, is_bot=False
+            )
+            for _ in range(options['turns']):
+                client, chat = await repository.get_client_and_chat(user)
+                await repository.create_message(text='hello', client=client, chat=chat)
+                await repository.get_default_assistant()
+                await repository.get_history(chat)
+                if delay and index % 10 == 0:
+                    await slow(delay)
+                await repository.create_message(text='reply', client=client, chat=chat, outgoing=True)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(conversation(i) for i in range(options['chats'])))
+        return time.perf_counter() - started
@@ -0,0 +1,45 @@
+import gzip
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from apps.chatbot.exports import EXPORT_FORMATS, export_lines, parse_bound
+from apps.chatbot.models import Dashboard
+
+
+class Command(BaseCommand):
+    help = 'Streams the messages of a dashboard to a JSONL or CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dashboard', type=int, help='Dashboard id')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl')
+        parser.add_argument('--start', help='ISO date or datetime, inclusive')
+        parser.add_argument('--end', help='ISO date or datetime, exclusive')
+        parser.add_argument('--output', default='-', help='Output file, "-" for stdout, .gz to compress')
+
+    def handle(self, *args, **options):
+        try:
+            dashboard = Dashboard.objects.get(pk=options['dashboard'])
+            start = parse_bound(options['start'])
+            end = parse_bound(options['end'])
+        except Dashboard.DoesNotExist:
+            raise CommandError(f"Dashboard {options['dashboard']} does not exist")
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        output = options['output']
+        if output == '-':
+            stream = sys.stdout
+        elif output.endswith('.gz'):
+            stream = gzip.open(output, 'wt', encoding='utf-8', newline='')
+        else:
+            stream = open(output, 'w', encoding='utf-8', newline='')
+
+        count = 0
+        try:
+            for line in export_lines(dashboard, start, end, options['format']):
+                stream.write(line)
+                count += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        if stream is not sys.stdout:
+            self.stderr.write(f"Exported {count} lines to {output}")
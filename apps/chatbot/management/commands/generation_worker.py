@@ -0,0 +1,53 @@
+import asyncio
+import logging
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from apps.chatbot import metrics
+from apps.chatbot.counters import counters
+from apps.chatbot.logutils import setup_logging, stop_logging
+from apps.chatbot.management.jobs import GenerationWorker
+from apps.chatbot.management.leases import runner_name
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Generates and sends the replies queued by the bot runner when GENERATION_QUEUE is on'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.GENERATION_WORKER_CONCURRENCY,
+                            help='Chats generated at the same time by this process')
+        parser.add_argument('--name', default='', help='Worker name recorded on claimed jobs')
+        parser.add_argument('--metrics-port', type=int, default=0,
+                            help='Serve Prometheus metrics on this port, 0 disables')
+
+    def handle(self, *args, **options):
+        setup_logging(
+            level=settings.LOG_LEVEL,
+            log_file=settings.LOG_FILE,
+            json_format=settings.LOG_FORMAT == 'json',
+            sampling=settings.LOG_SAMPLING,
+            max_bytes=settings.LOG_MAX_BYTES,
+            backup_count=settings.LOG_BACKUP_COUNT,
+            queue_size=settings.LOG_QUEUE_SIZE,
+        )
+        if options['metrics_port']:
+            metrics.start_http_server(options['metrics_port'])
+
+        worker = GenerationWorker(options['name'] or runner_name(), options['concurrency'])
+        self.stdout.write(f"Generation worker {worker.name} started with concurrency {worker.concurrency}")
+        try:
+            asyncio.run(self.run(worker))
+        finally:
+            counters.flush()
+            self.stdout.write("Generation worker stopped.")
+            stop_logging()
+
+    async def run(self, worker):
+        # Finish the jobs in hand on SIGTERM/SIGINT, the rest stay queued for other workers
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        await worker.run(stop)
@@ -0,0 +1,33 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from django.utils.timezone import localdate
+from apps.chatbot.models import Dashboard
+from apps.chatbot.stats import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Backfills or rebuilds the daily dashboard stats rollups from the Message table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dashboard', type=int, action='append', help='Only these dashboard ids')
+        parser.add_argument('--start', help='First day (YYYY-MM-DD), defaults to 30 days ago')
+        parser.add_argument('--end', help='Last day (YYYY-MM-DD, inclusive), defaults to today')
+        parser.add_argument('--missing-only', action='store_true',
+                            help='Backfill days without rollup rows instead of rebuilding them')
+
+    def handle(self, *args, **options):
+        end = parse_date(options['end']) if options['end'] else localdate()
+        start = parse_date(options['start']) if options['start'] else end - timedelta(days=29)
+        if not start or not end or start > end:
+            raise CommandError("Invalid --start/--end range")
+
+        dashboards = Dashboard.objects.all()
+        if options['dashboard']:
+            dashboards = dashboards.filter(pk__in=options['dashboard'])
+
+        for dashboard in dashboards.iterator():
+            rows = rebuild_daily_stats(
+                dashboard, start, end + timedelta(days=1), missing_only=options['missing_only']
+            )
+            self.stdout.write(f"Dashboard {dashboard.pk}: {rows} daily rows written ({start} - {end})")
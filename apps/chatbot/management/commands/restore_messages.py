@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from apps.chatbot.archive import restore_archive
+
+
+class Command(BaseCommand):
+    help = 'Restores messages from archive files created by archive_messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Archive files (.jsonl.gz)')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        for path in options['paths']:
+            try:
+                restored, orphaned, truncated = restore_archive(path, chunk_size=options['chunk_size'])
+            except OSError as e:
+                raise CommandError(f"Cannot read {path}: {e}")
+            self.stdout.write(f"{path}: {restored} messages restored")
+            if orphaned:
+                self.stdout.write(f"{path}: {orphaned} messages skipped, their chat or client no longer exists")
+            if truncated:
+                self.stderr.write(f"{path}: file is truncated, restored up to the last complete message")
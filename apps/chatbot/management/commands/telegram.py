@@ -1,14 +1,29 @@
 import logging
 import asyncio
+import signal
 import time
-from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db import DatabaseError
+from django.db import DatabaseError, connections
+from apps.chatbot import metrics
+from apps.chatbot.counters import counters
+from apps.chatbot.logutils import setup_logging, stop_logging
+from apps.chatbot.management.leases import LeaseManager, runner_name
+from apps.chatbot.management.poller import SharedPoller
+from apps.chatbot.management.repository import db_task
+from apps.chatbot.management.scheduler import scheduler
 from apps.chatbot.management.telegram_manager import TelegramBotManager
 from apps.chatbot.models import Messenger
+from apps.chatbot.quotas import quotas
 
 logger = logging.getLogger(__name__)
 
+POOL_STATS = metrics.registry.gauge('chatbot_db_pool', 'Database connection pool state', ('stat',))
+POOL_WAIT = metrics.registry.counter('chatbot_db_pool_wait_seconds_total', 'Time spent waiting for a pooled connection')
+POOL_REQUESTS = metrics.registry.counter('chatbot_db_pool_requests_total', 'Connection requests by outcome', ('result',))
+# Seconds before a bot whose token Telegram rejected is claimed again
+REJECTED_RETRY = 3600
+
 
 class Command(BaseCommand):
     help = 'Runs all Telegram bots configured in the system'
@@ -17,20 +32,36 @@ class Command(BaseCommand):
         super().__init__(*args, **kwargs)
         self.shutdown_flag = False
         self.bot_managers = []
+        self.poller = None
+        self.leases = None
+        self.retry_at = {}
+        self.stop = None
+        self.replicas = 1
+        self.renewed_at = 0
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pool-stats-interval', type=int, default=60,
+                            help='Seconds between connection pool stats reports (DB_POOL only)')
+        parser.add_argument('--metrics-port', type=int, default=0,
+                            help='Serve Prometheus metrics on this port, 0 disables')
 
     def handle(self, *args, **options):
         self.stdout.write("Starting Telegram bot manager...")
         
         # Configure logging
-        logging.basicConfig(
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            level=logging.INFO,
-            handlers=[
-                logging.FileHandler('telegram_bot_manager.log'),
-                logging.StreamHandler()
-            ]
+        setup_logging(
+            level=settings.LOG_LEVEL,
+            log_file=settings.LOG_FILE,
+            json_format=settings.LOG_FORMAT == 'json',
+            sampling=settings.LOG_SAMPLING,
+            max_bytes=settings.LOG_MAX_BYTES,
+            backup_count=settings.LOG_BACKUP_COUNT,
+            queue_size=settings.LOG_QUEUE_SIZE,
         )
-        logging.getLogger('httpx').setLevel(logging.WARNING)
+        
+        if options['metrics_port']:
+            metrics.start_http_server(options['metrics_port'])
+            self.stdout.write(f"Metrics available on :{options['metrics_port']}/metrics")
         
         # Create and run the main async loop
         loop = asyncio.new_event_loop()
@@ -38,57 +69,212 @@ class Command(BaseCommand):
         
         try:
             # Run the main async function
-            loop.run_until_complete(self.async_main())
+            loop.run_until_complete(self.async_main(options))
         except KeyboardInterrupt:
             self.stdout.write("\nReceived shutdown signal...")
         finally:
-            self.shutdown_bots()
+            # Stop the bots on the loop they run on, their leases are released afterwards
+            loop.run_until_complete(self.stop_bots({manager.messenger.id for manager in self.bot_managers}))
+            if self.poller:
+                loop.run_until_complete(self.poller.close())
             loop.close()
+            if self.leases:
+                self.leases.release_all()
+            counters.flush()
+            self.close_pool()
             self.stdout.write("Telegram bot manager stopped.")
+            stop_logging()
+
+    async def async_main(self, options):
+        """Main async loop, returns on SIGTERM/SIGINT so `handle` stops the bots and hands back their leases"""
+        self.stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop.set)
+        tasks = [
+            asyncio.create_task(self.report_pool_stats(options['pool_stats_interval'])),
+            asyncio.create_task(self.flush_counters()),
+            asyncio.create_task(self.refresh_quota_limits()),
+        ]
+        try:
+            await self.run_bots()
+            self.stdout.write("\nReceived shutdown signal...")
+        finally:
+            self.shutdown_flag = True
+            for task in tasks:
+                task.cancel()
+
+    async def run_bots(self):
+        """Lease rounds until a shutdown signal"""
+        if settings.TELEGRAM_SHARED_POLLER:
+            self.poller = SharedPoller(
+                settings.TELEGRAM_POLL_TIMEOUT, settings.TELEGRAM_POLL_CONNECTIONS, settings.TELEGRAM_API_CONNECTIONS,
+                settings.TELEGRAM_IDLE_POLL_TIMEOUT, settings.TELEGRAM_HIBERNATE_AFTER
+            )
+            await self.poller.initialize()
+        
+        # Bots are split between runner replicas through leases (apps/chatbot/management/leases.py)
+        self.leases = LeaseManager(settings.TELEGRAM_RUNNER_NAME or runner_name(), settings.TELEGRAM_LEASE_TTL)
+        self.stdout.write(f"Running as replica {self.leases.name}")
+        # Announce this replica before the first claim, then renew apart from bot startup:
+        # starting a batch of bots can take longer than the lease TTL
+        self.renewed_at = time.monotonic()
+        await self.renew_leases()
+        renewal = asyncio.create_task(self.keep_leases())
+        try:
+            while not self.stop.is_set():
+                try:
+                    await self.sync_bots()
+                except Exception as e:
+                    logger.error(f"Error in bot manager: {str(e)}", exc_info=True)
+                await self.wait(settings.TELEGRAM_LEASE_RENEW_INTERVAL)
+        finally:
+            renewal.cancel()
+
+    async def keep_leases(self):
+        """Renew the leases every TELEGRAM_LEASE_RENEW_INTERVAL until a shutdown signal"""
+        while not self.stop.is_set():
+            await self.wait(settings.TELEGRAM_LEASE_RENEW_INTERVAL)
+            await self.renew_leases()
+
+    async def renew_leases(self):
+        """Heartbeat and renewal, stops the bots whose lease is lost or about to expire"""
+        try:
+            self.replicas = await self.leases.heartbeat()
+            lost = await self.leases.renew()
+            self.renewed_at = time.monotonic()
+        except Exception as e:
+            logger.error(f"Failed to renew messenger leases: {str(e)}", exc_info=True)
+            if self.bot_managers and (
+                time.monotonic() - self.renewed_at >= settings.TELEGRAM_LEASE_TTL - settings.TELEGRAM_LEASE_RENEW_INTERVAL
+            ):
+                # The leases expire before the next round, stop before another replica takes the bots over
+                logger.error("Could not renew messenger leases, stopping all bots")
+                await self.stop_bots({manager.messenger.id for manager in self.bot_managers})
+            return
+        if lost:
+            logger.warning(f"Messengers {sorted(lost)} were taken over by another replica")
+            await self.stop_bots(lost)
+
+    async def wait(self, seconds):
+        """Sleep for `seconds` or until a shutdown signal"""
+        try:
+            await asyncio.wait_for(self.stop.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def sync_bots(self):
+        """One assignment round: stop deactivated bots, claim up to this replica's share"""
+        messengers = {
+            messenger.id: messenger async for messenger in Messenger.objects.filter(
+                messenger_type='telegram',
+                is_active=True
+            ).select_related('dashboard')
+        }
+        running = {manager.messenger.id for manager in self.bot_managers}
+        deactivated = running - set(messengers)
+        if deactivated:
+            await self.stop_bots(deactivated)
+            await self.leases.release(deactivated)
+            running -= deactivated
+        if self.poller:
+            rejected = {manager.messenger.id for manager in self.bot_managers if manager.token in self.poller.rejected}
+            if rejected:
+                # Polling stopped for good, free the lease instead of renewing it for a dead bot
+                logger.warning(f"Telegram rejected messengers {sorted(rejected)}, retrying in {REJECTED_RETRY}s")
+                await self.stop_bots(rejected)
+                await self.leases.release(rejected)
+                self.retry_at.update(dict.fromkeys(rejected, time.monotonic() + REJECTED_RETRY))
+                running -= rejected
+        
+        share = self.leases.share(len(messengers), self.replicas)
+        if len(running) > share:
+            # Hand one bot per round to a replica with fewer
+            surplus = {max(running)}
+            await self.stop_bots(surplus)
+            await self.leases.release(surplus)
+            return
+        
+        now = time.monotonic()
+        candidates = [
+            messenger_id for messenger_id in messengers
+            if messenger_id not in running and self.retry_at.get(messenger_id, 0) <= now
+        ]
+        claimed = await self.leases.claim(candidates, min(share - len(running), settings.TELEGRAM_LEASE_CLAIM_BATCH))
+        await asyncio.gather(*(self.start_bot(messengers[messenger_id]) for messenger_id in claimed))
+
+    async def start_bot(self, messenger):
+        manager = TelegramBotManager(messenger, self.poller)
+        if await manager.initialize():
+            if messenger.id not in self.leases.held:
+                # Lost while starting, see renew_leases
+                await manager.shutdown()
+                return
+            self.bot_managers.append(manager)
+            self.stdout.write(f"✓ Bot for {messenger.dashboard.name} initialized")
+            return
+        self.stdout.write(f"× Failed to initialize bot for {messenger.dashboard.name}")
+        await manager.shutdown()
+        self.retry_at[messenger.id] = time.monotonic() + 60
+        await self.leases.release([messenger.id])
 
-    async def async_main(self):
-        """Main async loop"""
+    async def stop_bots(self, messenger_ids):
+        """Shut down the given bots, their offsets are saved before the leases can be handed over"""
+        for manager in [manager for manager in self.bot_managers if manager.messenger.id in messenger_ids]:
+            # Renewal and assignment rounds both stop bots, each manager is shut down once
+            self.bot_managers.remove(manager)
+            await manager.shutdown()
+            self.stdout.write(f"✓ Bot for {manager.messenger.dashboard.name} stopped")
+
+    async def report_pool_stats(self, interval):
+        """Periodically log connection pool usage and wait times when DB_POOL is enabled"""
+        pool = getattr(connections['default'], 'pool', None)
+        if pool is None:
+            return
         while not self.shutdown_flag:
+            await asyncio.sleep(interval)
+            stats = pool.pop_stats()
+            for name in ('pool_size', 'pool_available', 'requests_waiting'):
+                POOL_STATS.set(stats.get(name, 0), name)
+            POOL_WAIT.inc(amount=stats.get('requests_wait_ms', 0) / 1000)
+            POOL_REQUESTS.inc('total', amount=stats.get('requests_num', 0))
+            POOL_REQUESTS.inc('error', amount=stats.get('requests_errors', 0))
+            POOL_REQUESTS.inc('timeout', amount=stats.get('requests_timeouts', 0))
+            logger.info(
+                "DB pool: size=%s available=%s waiting=%s requests=%s wait_ms=%s errors=%s timeouts=%s",
+                stats.get('pool_size'), stats.get('pool_available'), stats.get('requests_waiting'),
+                stats.get('requests_num', 0), stats.get('requests_wait_ms', 0),
+                stats.get('requests_errors', 0), stats.get('requests_timeouts', 0)
+            )
+
+    async def flush_counters(self):
+        """Write coalesced chat/assistant counters even when no new messages arrive"""
+        counters.start_periodic_flush()
+        flush = db_task(counters.flush)
+        while not self.shutdown_flag:
+            await asyncio.sleep(counters.flush_interval)
             try:
-                # Get active messengers
-                messengers = await sync_to_async(list)(
-                    Messenger.objects.filter(
-                        messenger_type='telegram',
-                        is_active=True
-                    ).select_related('dashboard')
-                )
-                
-                if not messengers:
-                    self.stdout.write("No active Telegram messengers found.")
-                    await asyncio.sleep(60)
-                    continue
-                    
-                self.stdout.write(f"Found {len(messengers)} active Telegram messenger(s)")
-                
-                # Initialize all bots
-                current_bot_managers = []
-                for messenger in messengers:
-                    if any(m.messenger.id == messenger.id for m in self.bot_managers):
-                        continue
-                        
-                    manager = TelegramBotManager(messenger)
-                    if await manager.initialize():  # Changed to direct await
-                        current_bot_managers.append(manager)
-                        self.bot_managers.append(manager)
-                        self.stdout.write(f"✓ Bot for {messenger.dashboard.name} initialized")
-                    
-                if not current_bot_managers:
-                    self.stdout.write("No new bots could be initialized")
-                    await asyncio.sleep(60)
-                    continue
-                    
-                # Keep running while bots are active
-                while not self.shutdown_flag and self.bot_managers:
-                    await asyncio.sleep(1)
-                    
+                await flush()
             except Exception as e:
-                logger.error(f"Error in bot manager: {str(e)}", exc_info=True)
-                await asyncio.sleep(30)
+                logger.error(f"Failed to flush chat counters: {str(e)}", exc_info=True)
+
+    async def refresh_quota_limits(self):
+        """Pick up quota and LLM scheduling changes made in the admin, and the usage of other processes"""
+        flush, refresh = db_task(counters.flush), db_task(quotas.refresh_limits)
+        while not self.shutdown_flag:
+            await asyncio.sleep(settings.QUOTA_REFRESH_INTERVAL)
+            try:
+                # Our own calls reach the rollups first, refreshing takes the larger count
+                await flush()
+                await refresh()
+                await scheduler.refresh()
+            except DatabaseError as e:
+                logger.error(f"Failed to refresh quota limits: {str(e)}")
+
+    def close_pool(self):
+        """Close pooled connections on exit"""
+        if getattr(connections['default'], 'pool', None) is not None:
+            connections['default'].close_pool()
 
     def signal_handler(self, signum, frame):
         """Handle shutdown signals"""
@@ -0,0 +1,70 @@
+"""
+Deadline budgets for handling an update.
+
+A handler gives its update UPDATE_DEADLINE seconds (`update_deadline`), kept
+in a context variable so it follows the update through every await. Each
+stage (DB access, transcription, the LLM call, Telegram requests) runs under
+`budget`: it is cancelled once its own STAGE_BUDGETS entry or the update's
+remaining time runs out, whichever comes first, and DeadlineExceeded is
+raised so the handler can answer with TIMEOUT_REPLY.
+
+Blocking calls moved to a thread (ORM queries) cannot be interrupted: the
+update stops waiting for them and the thread finishes on its own. Calls that
+take a timeout of their own should be given `remaining()`.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+
+from apps.chatbot.metrics import registry
+
+TIMEOUTS = registry.counter(
+    'chatbot_stage_timeouts_total', 'Handling stages cancelled by their deadline budget', ('stage', 'dashboard')
+)
+
+TIMEOUT_REPLY = "⌛ This is taking too long. Please try again."
+
+_deadline = ContextVar('update_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage):
+        super().__init__(f"{stage} ran out of its deadline budget")
+        self.stage = stage
+
+
+@contextmanager
+def update_deadline(seconds):
+    """Give the update handled in this context `seconds` to finish, 0 means no deadline"""
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining(stage=None):
+    """Seconds `stage` may take: its budget capped by the update's deadline, None without either"""
+    limits = []
+    if settings.STAGE_BUDGETS.get(stage):
+        limits.append(settings.STAGE_BUDGETS[stage])
+    deadline = _deadline.get()
+    if deadline is not None:
+        limits.append(deadline - time.monotonic())
+    return max(min(limits), 0) if limits else None
+
+
+@asynccontextmanager
+async def budget(stage, metrics_label=''):
+    """Cancel the block when `stage` runs out of time, raising DeadlineExceeded"""
+    timeout = asyncio.timeout(remaining(stage))
+    try:
+        async with timeout:
+            yield
+    except TimeoutError:
+        if not timeout.expired():
+            raise
+        TIMEOUTS.inc(stage, metrics_label)
+        raise DeadlineExceeded(stage) from None
@@ -0,0 +1,283 @@
+"""
+In-process stand-ins for the Telegram Bot API and the OpenAI API.
+
+Both servers run on 127.0.0.1 in a background thread, answer with the
+payload shapes python-telegram-bot and the openai SDK expect, and support
+configurable latency distributions and error injection. Used by
+`manage.py bench_load` to measure the runner offline.
+"""
+import json
+import math
+import random
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class Latency:
+    """
+    Latency distribution parsed from a spec string:
+    `fixed:MS`, `uniform:MIN_MS:MAX_MS` or `lognormal:MEDIAN_MS:P99_MS`
+    """
+
+    def __init__(self, spec='fixed:0'):
+        kind, *values = spec.split(':')
+        values = [float(value) for value in values]
+        if kind == 'fixed' and len(values) == 1:
+            self.sample = lambda: values[0] / 1000
+        elif kind == 'uniform' and len(values) == 2:
+            self.sample = lambda: random.uniform(*values) / 1000
+        elif kind == 'lognormal' and len(values) == 2:
+            median, p99 = values
+            sigma = math.log(max(p99, median) / median) / 2.326 if median > 0 else 0
+            self.sample = lambda: random.lognormvariate(math.log(median), sigma) / 1000 if median > 0 else 0
+        else:
+            raise ValueError(f"Invalid latency spec: {spec}")
+        self.spec = spec
+
+    def __str__(self):
+        return self.spec
+
+
+class FakeServer:
+    """Threaded HTTP server dispatching requests to `handle(method, path, params)`"""
+
+    def __init__(self, latency='fixed:0', error_rate=0.0):
+        self.latency = Latency(latency) if isinstance(latency, str) else latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.dispatch('GET')
+
+            def do_POST(self):
+                self.dispatch('POST')
+
+            def dispatch(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                params = server.parse_params(url.query, body, self.headers.get('Content-Type', ''))
+                status, content_type, payload = server.handle(method, url.path, params)
+                if not isinstance(payload, bytes):
+                    payload = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def parse_params(self, query, body, content_type):
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+        if not body:
+            return params
+        if 'application/json' in content_type:
+            params.update(json.loads(body))
+        elif 'multipart/form-data' in content_type:
+            params['_multipart'] = True
+        else:
+            # python-telegram-bot sends form fields with JSON encoded values
+            for key, values in parse_qs(body.decode()).items():
+                try:
+                    params[key] = json.loads(values[-1])
+                except ValueError:
+                    params[key] = values[-1]
+        return params
+
+    def simulate(self, name):
+        """Sleep for a latency sample and decide whether to inject an error"""
+        delay = self.latency.sample()
+        if delay > 0:
+            time.sleep(delay)
+        with self.lock:
+            self.requests[name] += 1
+            failed = self.error_rate and random.random() < self.error_rate
+            if failed:
+                self.errors[name] += 1
+        return failed
+
+    def handle(self, method, path, params):
+        """Returns (status, content type, payload), subclasses answer the paths they simulate"""
+        return 404, 'text/plain', 'Not Found'
+
+
+class FakeTelegramServer(FakeServer):
+    """
+    Bot API subset used by the runner: getMe, deleteWebhook, getUpdates,
+    sendMessage, editMessageText, sendChatAction and getFile (plus file download).
+
+    Updates are queued with `push_text`; every outgoing message is reported to
+    the `on_message(token, chat_id, text)` callback.
+    """
+    # Methods subject to latency and error injection, the rest answer immediately
+    SIMULATED_METHODS = {'sendMessage', 'editMessageText', 'getFile', 'sendChatAction'}
+
+    def __init__(self, latency='fixed:0', error_rate=0.0, on_message=None):
+        super().__init__(latency, error_rate)
+        self.on_message = on_message
+        self.updates = defaultdict(list)
+        self.update_condition = threading.Condition()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.poll_calls = defaultdict(int)
+
+    @property
+    def api_url(self):
+        return f'{self.url}/bot'
+
+    @property
+    def file_url(self):
+        return f'{self.url}/file/bot'
+
+    def bot_user(self, token):
+        bot_id = int(token.split(':')[0])
+        return {'id': bot_id, 'is_bot': True, 'first_name': 'Bench', 'username': f'bench_{bot_id}_bot'}
+
+    def push_text(self, token, chat_id, text, first_name='User'):
+        """Queue a private text message update for a bot, returns its update_id"""
+        with self.update_condition:
+            update_id = self.next_update_id
+            self.next_update_id += 1
+            message = {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private', 'first_name': first_name},
+                'from': {'id': chat_id, 'is_bot': False, 'first_name': first_name},
+                'text': text,
+            }
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+            self.updates[token].append({'update_id': update_id, 'message': message})
+            self.update_condition.notify_all()
+        return update_id
+
+    def handle(self, method, path, params):
+        if path.startswith('/file/bot'):
+            return 200, 'application/octet-stream', b'\0' * 1024
+
+        token, _, api_method = path[len('/bot'):].partition('/')
+        if api_method == 'getUpdates':
+            return self.ok(self.get_updates(token, params))
+        if api_method in self.SIMULATED_METHODS and self.simulate(api_method):
+            return 500, 'application/json', {'ok': False, 'error_code': 500, 'description': 'Injected error'}
+
+        if api_method == 'getMe':
+            return self.ok(self.bot_user(token))
+        if api_method in ('deleteWebhook', 'sendChatAction', 'close', 'logOut'):
+            return self.ok(True)
+        if api_method in ('sendMessage', 'editMessageText'):
+            chat_id = int(params['chat_id'])
+            if self.on_message:
+                self.on_message(token, chat_id, params.get('text', ''))
+            with self.lock:
+                message_id = params.get('message_id') or self.next_message_id
+                self.next_message_id += 1
+            return self.ok({
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': self.bot_user(token),
+                'text': params.get('text', ''),
+            })
+        if api_method == 'getFile':
+            return self.ok({
+                'file_id': params.get('file_id', ''),
+                'file_unique_id': params.get('file_id', ''),
+                'file_size': 1024,
+                'file_path': 'voice/file.ogg',
+            })
+        return 404, 'application/json', {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+
+    def get_updates(self, token, params):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + timeout
+        with self.update_condition:
+            self.poll_calls[token] += 1
+            while True:
+                queue = self.updates[token]
+                if offset:
+                    queue[:] = [update for update in queue if update['update_id'] >= offset]
+                if queue:
+                    return queue[:limit]
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self.update_condition.wait(remaining)
+
+    def ok(self, result):
+        return 200, 'application/json', {'ok': True, 'result': result}
+
+
+class FakeOpenAIServer(FakeServer):
+    """Chat completions and audio transcriptions with canned answers and token usage"""
+
+    def __init__(self, latency='fixed:0', error_rate=0.0, reply='This is a benchmark reply.'):
+        super().__init__(latency, error_rate)
+        self.reply = reply
+
+    @property
+    def api_url(self):
+        return f'{self.url}/v1'
+
+    def handle(self, method, path, params):
+        if path.endswith('/chat/completions'):
+            if self.simulate('chat.completions'):
+                return self.error()
+            messages = params.get('messages', [])
+            prompt_tokens = sum(len(json.dumps(message.get('content', ''))) // 4 + 1 for message in messages)
+            completion_tokens = len(self.reply) // 4 + 1
+            return 200, 'application/json', {
+                'id': f'chatcmpl-bench-{time.monotonic_ns()}',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': params.get('model', 'bench'),
+                'choices': [{
+                    'index': 0,
+                    'message': {'role': 'assistant', 'content': self.reply},
+                    'finish_reason': 'stop',
+                }],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens,
+                },
+            }
+        if path.endswith('/audio/transcriptions'):
+            if self.simulate('audio.transcriptions'):
+                return self.error()
+            return 200, 'text/plain', 'This is a benchmark transcription.'
+        return 404, 'application/json', {'error': {'message': 'Not Found', 'type': 'invalid_request_error'}}
+
+    def error(self):
+        return 500, 'application/json', {'error': {'message': 'Injected error', 'type': 'server_error'}}
@@ -0,0 +1,126 @@
+"""
+In-memory conversation history of the bot runner.
+
+The runner writes every message of the chats it serves, so the latest turns
+of a chat are kept in a ring buffer (the last HISTORY_CACHE_TURNS messages)
+and updated as messages are stored. The ORDER BY/LIMIT query on Message only
+runs on a cold miss, the loaded rows are merged with what was stored while
+the query ran. Chats are evicted least recently used first once the buffers
+take more than HISTORY_CACHE_MAX_BYTES.
+
+Only the process writing a chat's messages may use the cache: the generation
+worker reads history from the database (the runner stores the incoming
+messages there), and a bot's chats are forgotten when it stops, so a replica
+taking the bot back later does not serve turns written elsewhere meanwhile.
+"""
+import sys
+from collections import OrderedDict, deque
+from itertools import islice
+from django.conf import settings
+
+from apps.chatbot.metrics import CACHE, registry
+
+# Approximate footprint besides the text, measured with tracemalloc: a Turn with
+# its datetime, and a chat's deque, ChatTurns and OrderedDict slot
+TURN_BYTES = 160
+CHAT_BYTES = 900
+
+
+def latest(turns, limit):
+    return list(islice(turns, max(len(turns) - limit, 0), None))
+
+
+class Turn:
+    """A stored message, with the attributes of a Message that history uses"""
+    __slots__ = ('id', 'outgoing', 'text', 'created_date', 'size')
+
+    def __init__(self, message):
+        self.id = message.id
+        self.outgoing = message.outgoing
+        self.text = message.text
+        self.created_date = message.created_date
+        self.size = TURN_BYTES + sys.getsizeof(self.text)
+
+
+class ChatTurns:
+    __slots__ = ('messenger_id', 'turns', 'size', 'loaded')
+
+    def __init__(self, messenger_id, maxlen):
+        self.messenger_id = messenger_id
+        self.turns = deque(maxlen=maxlen)
+        self.size = CHAT_BYTES
+        self.loaded = False
+
+
+class HistoryCache:
+    """Latest turns per chat with a global LRU over chats, on a single event loop"""
+
+    def __init__(self, turns=20, max_bytes=64 * 2 ** 20):
+        self.turns = turns
+        self.max_bytes = max_bytes
+        self.chats = OrderedDict()
+        self.size = 0
+
+    def get(self, messenger_id, chat_id, limit):
+        """The chat's last `limit` turns, oldest first, or None when they have to be loaded"""
+        entry = self.chats.get(chat_id)
+        if entry is None:
+            entry = self.chats[chat_id] = ChatTurns(messenger_id, self.turns)
+            self.size += entry.size
+        self.chats.move_to_end(chat_id)
+        if not entry.loaded or limit > self.turns:
+            CACHE.inc('chat_history', 'miss')
+            return None
+        CACHE.inc('chat_history', 'hit')
+        return latest(entry.turns, limit)
+
+    def load(self, chat_id, messages, limit):
+        """Seed a chat after a miss with its latest messages, oldest first. Returns its last `limit` turns"""
+        entry = self.chats.get(chat_id)
+        if entry is None or limit > self.turns:
+            # Evicted while loading, or asked for more than a buffer holds
+            return latest(messages, limit)
+        loaded = {message.id for message in messages}
+        appended = [turn for turn in entry.turns if turn.id not in loaded]
+        entry.turns.clear()
+        self.resize(entry, CHAT_BYTES)
+        for turn in [Turn(message) for message in messages] + appended:
+            self.push(entry, turn)
+        entry.loaded = True
+        self.evict()
+        return latest(entry.turns, limit)
+
+    def append(self, messenger_id, message):
+        """Record a message just stored. Chats not cached are left to their next read"""
+        entry = self.chats.get(message.chat_id)
+        if entry is not None and entry.messenger_id == messenger_id:
+            self.push(entry, Turn(message))
+            self.evict()
+
+    def push(self, entry, turn):
+        if len(entry.turns) == entry.turns.maxlen:
+            self.resize(entry, entry.size - entry.turns[0].size)
+        entry.turns.append(turn)
+        self.resize(entry, entry.size + turn.size)
+
+    def resize(self, entry, size):
+        self.size += size - entry.size
+        entry.size = size
+
+    def evict(self):
+        while self.size > self.max_bytes and len(self.chats) > 1:
+            _, entry = self.chats.popitem(last=False)
+            self.size -= entry.size
+            CACHE.inc('chat_history', 'evicted')
+
+    def forget(self, messenger_id):
+        """Drop a messenger's chats, when its bot stops"""
+        for chat_id in [chat_id for chat_id, entry in self.chats.items() if entry.messenger_id == messenger_id]:
+            self.size -= self.chats.pop(chat_id).size
+
+    def samples(self):
+        return {('chats',): len(self.chats), ('bytes',): self.size}
+
+
+history_cache = HistoryCache(settings.HISTORY_CACHE_TURNS, settings.HISTORY_CACHE_MAX_BYTES)
+registry.gauge('chatbot_history_cache', 'Chats and approximate bytes in the history cache', ('stat',), history_cache.samples)
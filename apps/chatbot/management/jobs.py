@@ -0,0 +1,296 @@
+"""
+Durable reply generation queue.
+
+With GENERATION_QUEUE on, the bot runner only stores an incoming text
+message together with a GenerationJob (see ChatRepository.create_queued_message)
+and `manage.py generation_worker` processes, as many as needed, generate and
+send the replies:
+
+- jobs are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so workers never
+  wait on each other's rows, and a conditional UPDATE, so a backend without
+  row locks (SQLite) still hands each job to one worker only;
+- a claimed job is leased for GENERATION_JOB_TIMEOUT, a job whose worker died
+  is claimed again once the lease runs out;
+- one chat's jobs are generated one at a time, in order: a job waits while an
+  older job of its chat is queued (possibly in retry backoff) or running;
+- the generated reply is stored and recorded on the job before it is sent, and
+  the send is recorded too, so a retry neither generates nor sends it twice. A
+  send that timed out may have been delivered and counts as sent;
+- failed jobs are retried with exponential backoff and dead-lettered after
+  GENERATION_MAX_ATTEMPTS, the user then gets an error reply. A job shed by an
+  overloaded worker (see admission.py) is requeued without using an attempt.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from collections import defaultdict
+from contextlib import nullcontext
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+from telegram import Bot
+from telegram.error import TimedOut
+
+from apps.chatbot.counters import counters
+from apps.chatbot.management.admission import Overloaded
+from apps.chatbot.management.deadlines import DeadlineExceeded
+from apps.chatbot.management.poller import SharedRequest
+from apps.chatbot.management.repository import db_task
+from apps.chatbot.management.scheduler import scheduler
+from apps.chatbot.management.telegram_manager import TelegramBotManager
+from apps.chatbot.metrics import registry
+from apps.chatbot.models import GenerationJob, Message
+from apps.chatbot.quotas import quotas
+
+logger = logging.getLogger(__name__)
+
+JOBS = registry.counter('chatbot_generation_jobs_total', 'Generation jobs by outcome', ('result',))
+QUEUE_WAIT = registry.histogram('chatbot_generation_queue_wait_seconds', 'Time from enqueue to the first claim')
+RUNNING_JOBS = registry.gauge('chatbot_generation_jobs_running', 'Jobs being generated by this worker')
+
+DEAD_LETTER_REPLY = "⚠️ I encountered an error processing your request. Please try again."
+
+
+class LeaseLost(Exception):
+    """The job was claimed again by another worker"""
+
+
+def claimable(now):
+    return (
+        Q(status='queued', available_at__lte=now)
+        | Q(status='running', locked_until__lt=now)
+    ) & ~Q(
+        # Keep a chat's replies in order: not while another of its jobs is generated
+        chat_id__in=GenerationJob.objects.filter(status='running', locked_until__gte=now).values('chat_id')
+    ) & ~Exists(
+        # nor before its older jobs, even those waiting out a retry backoff
+        GenerationJob.objects.filter(
+            chat_id=OuterRef('chat_id'), id__lt=OuterRef('id'), status__in=('queued', 'running')
+        )
+    )
+
+
+def claim(worker, limit, timeout):
+    """Lease up to `limit` jobs to `worker`, oldest first. Blocking"""
+    now = timezone.now()
+    token = f"{worker}:{uuid.uuid4().hex[:8]}"
+    # Without row locks (SQLite) the conditional UPDATE alone decides, a read-then-write
+    # transaction there fails with "database is locked" instead of waiting
+    locking = connection.features.has_select_for_update_skip_locked
+    with transaction.atomic() if locking else nullcontext():
+        job_ids = list(
+            GenerationJob.objects.select_for_update(skip_locked=True)
+            .filter(claimable(now))
+            .order_by('available_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not job_ids:
+            return []
+        GenerationJob.objects.filter(claimable(now), id__in=job_ids).update(
+            status='running', locked_by=token, locked_until=now + timedelta(seconds=timeout),
+            attempts=F('attempts') + 1
+        )
+    jobs = list(
+        GenerationJob.objects.filter(locked_by=token, status='running')
+        .select_related('messenger__dashboard', 'chat__client', 'message', 'reply')
+        .order_by('available_at', 'id')
+    )
+    for job in jobs:
+        # A requeued job has an error recorded, its wait was observed before
+        if job.attempts == 1 and not job.last_error:
+            QUEUE_WAIT.observe((now - job.created_at).total_seconds())
+    return jobs
+
+
+def complete(job):
+    GenerationJob.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        status='done', locked_until=None, finished_at=timezone.now()
+    )
+
+
+def store_reply(job, **fields):
+    """Store the generated reply and record it on the job, both or neither"""
+    with transaction.atomic():
+        message = Message.objects.create(**fields)
+        if not GenerationJob.objects.filter(pk=job.pk, locked_by=job.locked_by).update(reply=message):
+            raise LeaseLost(f"Generation job {job.id} was claimed again")
+    return message
+
+
+def mark_sent(job):
+    job.sent_at = timezone.now()
+    GenerationJob.objects.filter(pk=job.pk, locked_by=job.locked_by).update(sent_at=job.sent_at)
+
+
+def defer(job, error):
+    """Requeue a job that could not run yet, without using one of its attempts"""
+    GenerationJob.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        status='queued', attempts=F('attempts') - 1, locked_until=None,
+        available_at=timezone.now() + timedelta(seconds=settings.GENERATION_RETRY_BACKOFF),
+        last_error=f"{type(error).__name__}: {error}"[:2000]
+    )
+
+
+def fail(job, error):
+    """Schedule a retry, or dead-letter the job after its last attempt. Returns True when dead"""
+    now = timezone.now()
+    dead = job.attempts >= settings.GENERATION_MAX_ATTEMPTS
+    changes = {'last_error': f"{type(error).__name__}: {error}"[:2000], 'locked_until': None}
+    if dead:
+        changes.update(status='dead', finished_at=now)
+    else:
+        backoff = settings.GENERATION_RETRY_BACKOFF * 2 ** (job.attempts - 1)
+        changes.update(status='queued', available_at=now + timedelta(seconds=backoff))
+    GenerationJob.objects.filter(pk=job.pk, locked_by=job.locked_by).update(**changes)
+    return dead
+
+
+def purge(retention):
+    """Delete jobs done longer than `retention` seconds ago, dead ones are kept for inspection"""
+    return GenerationJob.objects.filter(
+        status='done', finished_at__lt=timezone.now() - timedelta(seconds=retention)
+    ).delete()[0]
+
+
+class GenerationWorker:
+    """Claims jobs and runs up to `concurrency` chats' generations at a time"""
+
+    def __init__(self, name, concurrency=20):
+        self.name = name
+        self.concurrency = concurrency
+        self.request = SharedRequest(connection_pool_size=settings.TELEGRAM_API_CONNECTIONS, pool_timeout=5.0)
+        self.generators = {}
+        self.running = set()
+
+    async def run(self, stop=None):
+        """Work until `stop` (an asyncio.Event) is set"""
+        stop = stop or asyncio.Event()
+        claim_jobs = db_task(claim)
+        await self.request.initialize()
+        maintenance = asyncio.create_task(self.maintain())
+        try:
+            while not stop.is_set():
+                free = self.concurrency - len(self.running)
+                jobs = []
+                if free > 0:
+                    try:
+                        jobs = await claim_jobs(self.name, free, settings.GENERATION_JOB_TIMEOUT)
+                    except Exception as e:
+                        logger.error(f"Failed to claim generation jobs: {str(e)}", exc_info=True)
+                for chat_jobs in self.by_chat(jobs):
+                    task = asyncio.create_task(self.process_chat(chat_jobs))
+                    self.running.add(task)
+                    task.add_done_callback(self.running.discard)
+                RUNNING_JOBS.set(len(self.running))
+                if not jobs:
+                    await self.wait(stop)
+            if self.running:
+                await asyncio.wait(self.running)
+        finally:
+            maintenance.cancel()
+            for generator in self.generators.values():
+                await generator.llm.close()
+            await self.request.close()
+
+    async def wait(self, stop):
+        """Sleep until the poll interval passes, a slot frees up or `stop` is set"""
+        waiters = [asyncio.ensure_future(stop.wait()), *self.running]
+        await asyncio.wait(waiters, timeout=settings.GENERATION_POLL_INTERVAL, return_when=asyncio.FIRST_COMPLETED)
+        waiters[0].cancel()
+
+    def by_chat(self, jobs):
+        chats = defaultdict(list)
+        for job in jobs:
+            chats[job.chat_id].append(job)
+        return chats.values()
+
+    async def process_chat(self, jobs):
+        for job in jobs:
+            await self.process(job)
+
+    async def process(self, job):
+        try:
+            generator, bot = await self.generator(job.messenger)
+            await self.reply(generator, bot, job)
+        except Overloaded as e:
+            await db_task(defer)(job, e)
+            JOBS.inc('deferred')
+            return
+        except Exception as e:
+            logger.warning(
+                f"Generation job {job.id} failed (attempt {job.attempts}): {str(e)}",
+                extra={'dashboard': job.messenger.dashboard_id, 'chat_id': job.telegram_chat_id}
+            )
+            if await db_task(fail)(job, e):
+                JOBS.inc('dead')
+                logger.error(f"Generation job {job.id} dead-lettered", extra={'chat_id': job.telegram_chat_id})
+                await self.send_dead_letter_reply(job)
+            else:
+                JOBS.inc('retried')
+            return
+        await db_task(complete)(job)
+        JOBS.inc('done')
+
+    async def reply(self, generator, bot, job):
+        """Generate, store and send the job's reply, a retry resumes after the steps already done"""
+        if job.reply is None:
+            if not await generator.check_quota(bot, job.telegram_chat_id):
+                return
+            reply = await generator.compose_reply(
+                bot, job.telegram_chat_id, job.chat, job.chat.client, job.message.text, raise_errors=True
+            )
+            if reply is None:
+                return
+            async with generator.stage('message_write'):
+                job.reply = await db_task(store_reply)(job, **generator.reply_fields(job.chat, job.chat.client, *reply))
+        if job.sent_at is None:
+            try:
+                async with generator.stage('telegram_send'):
+                    await bot.send_message(chat_id=job.telegram_chat_id, text=job.reply.text)
+            except (TimedOut, DeadlineExceeded) as e:
+                # Telegram may have delivered it, a reply is never sent twice
+                logger.warning(f"Reply of generation job {job.id} possibly not sent: {str(e)}",
+                               extra={'chat_id': job.telegram_chat_id})
+            await db_task(mark_sent)(job)
+
+    async def send_dead_letter_reply(self, job):
+        try:
+            _, bot = await self.generator(job.messenger)
+            await bot.send_message(chat_id=job.telegram_chat_id, text=DEAD_LETTER_REPLY)
+        except Exception as e:
+            logger.error(f"Failed to report dead-lettered job {job.id}: {str(e)}")
+
+    async def generator(self, messenger):
+        """Per-messenger manager used for generation only, and a Bot on the shared pool"""
+        if messenger.id not in self.generators:
+            generator = TelegramBotManager(messenger)
+            await generator.start_generator()
+            generator.bot = Bot(
+                messenger.token, base_url=settings.TELEGRAM_API_BASE_URL,
+                base_file_url=settings.TELEGRAM_FILE_BASE_URL, request=self.request, get_updates_request=self.request
+            )
+            self.generators[messenger.id] = generator
+        generator = self.generators[messenger.id]
+        return generator, generator.bot
+
+    async def maintain(self):
+        """Counter flushes, quota and scheduling reloads and purging of old jobs"""
+        counters.start_periodic_flush()
+        flush, refresh, purge_jobs = db_task(counters.flush), db_task(quotas.refresh_limits), db_task(purge)
+        refreshed_at = purged_at = time.monotonic()
+        while True:
+            await asyncio.sleep(counters.flush_interval)
+            try:
+                await flush()
+                if time.monotonic() - refreshed_at > settings.QUOTA_REFRESH_INTERVAL:
+                    refreshed_at = time.monotonic()
+                    await refresh()
+                    await scheduler.refresh()
+                if time.monotonic() - purged_at > 600:
+                    purged_at = time.monotonic()
+                    await purge_jobs(settings.GENERATION_JOB_RETENTION)
+            except Exception as e:
+                logger.error(f"Generation worker maintenance failed: {str(e)}", exc_info=True)
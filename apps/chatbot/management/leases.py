@@ -0,0 +1,128 @@
+"""
+Messenger ownership for running several bot runner replicas.
+
+A replica only runs the messengers it holds a MessengerLease on. Leases are
+renewed every TELEGRAM_LEASE_RENEW_INTERVAL and expire after
+TELEGRAM_LEASE_TTL without renewal, so the bots of a dead replica are taken
+over by the others within seconds. Claiming is a conditional UPDATE on an
+expired lease, so a messenger never has two owners on any database backend.
+
+Replicas announce themselves with a BotRunner heartbeat and split the active
+messengers evenly: each claims up to its share and, while above it, hands one
+bot back per round. A bot is stopped (and its offset saved) before its lease
+is released, and a replica that cannot renew for a whole TTL stops its bots
+by itself, so a taken-over bot is never polled twice.
+"""
+import math
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.chatbot.management.repository import db_task
+from apps.chatbot.metrics import registry
+from apps.chatbot.models import BotRunner, MessengerLease
+
+LEASES = registry.gauge('chatbot_messenger_leases', 'Messengers leased by this runner replica')
+LEASE_EVENTS = registry.counter('chatbot_lease_events_total', 'Messenger lease changes', ('event',))
+
+NEVER = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def runner_name():
+    """Name unique to this process, readable in the admin"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class LeaseManager:
+    def __init__(self, name, ttl=15):
+        self.name = name
+        self.ttl = timedelta(seconds=ttl)
+        self.held = set()
+        # Renewal runs in its own task, concurrently with claims and releases on other pool threads
+        self.lock = threading.Lock()
+
+    def _heartbeat(self):
+        """Mark this replica alive, returns the number of live replicas"""
+        now = timezone.now()
+        BotRunner.objects.update_or_create(
+            name=self.name, defaults={'hostname': socket.gethostname(), 'heartbeat_at': now}
+        )
+        BotRunner.objects.filter(heartbeat_at__lt=now - self.ttl * 20).delete()
+        return BotRunner.objects.filter(heartbeat_at__gte=now - self.ttl).count()
+
+    def _renew(self):
+        """Extend the held leases, returns the messenger ids whose lease was taken over"""
+        with self.lock:
+            held = set(self.held)
+        if not held:
+            return set()
+        now = timezone.now()
+        MessengerLease.objects.filter(messenger_id__in=held, owner=self.name).update(expires_at=now + self.ttl)
+        still_held = set(
+            MessengerLease.objects.filter(messenger_id__in=held, owner=self.name).values_list('messenger_id', flat=True)
+        )
+        with self.lock:
+            # Leases released meanwhile are not lost, ones claimed meanwhile are kept
+            lost = (held - still_held) & self.held
+            self.held -= lost
+        LEASE_EVENTS.inc('lost', amount=len(lost))
+        LEASES.set(len(self.held))
+        return lost
+
+    def _claim(self, messenger_ids, limit):
+        """Take up to `limit` free or expired leases among `messenger_ids`, returns the claimed ids"""
+        claimed = []
+        if limit <= 0 or not messenger_ids:
+            return claimed
+        MessengerLease.objects.bulk_create(
+            [MessengerLease(messenger_id=messenger_id, expires_at=NEVER) for messenger_id in messenger_ids],
+            ignore_conflicts=True
+        )
+        now = timezone.now()
+        candidates = MessengerLease.objects.filter(
+            messenger_id__in=messenger_ids, expires_at__lte=now
+        ).values_list('messenger_id', flat=True)
+        for messenger_id in candidates:
+            # Whoever updates the still expired row first owns it
+            if MessengerLease.objects.filter(
+                Q(expires_at__lte=now) | Q(owner=self.name), messenger_id=messenger_id
+            ).update(owner=self.name, expires_at=now + self.ttl, acquired_at=now):
+                claimed.append(messenger_id)
+                if len(claimed) >= limit:
+                    break
+        with self.lock:
+            self.held.update(claimed)
+        LEASE_EVENTS.inc('claimed', amount=len(claimed))
+        LEASES.set(len(self.held))
+        return claimed
+
+    def _release(self, messenger_ids):
+        """Hand leases back at once, for bots already stopped"""
+        with self.lock:
+            messenger_ids = set(messenger_ids) & self.held
+            self.held -= messenger_ids
+        if not messenger_ids:
+            return
+        MessengerLease.objects.filter(messenger_id__in=messenger_ids, owner=self.name).update(
+            owner='', expires_at=timezone.now()
+        )
+        LEASE_EVENTS.inc('released', amount=len(messenger_ids))
+        LEASES.set(len(self.held))
+
+    def release_all(self):
+        """Blocking, used on exit once every bot is stopped"""
+        self._release(self.held)
+        BotRunner.objects.filter(name=self.name).delete()
+
+    def share(self, messengers, replicas):
+        """Bots this replica should run"""
+        return math.ceil(messengers / max(replicas, 1))
+
+    heartbeat = db_task(_heartbeat)
+    renew = db_task(_renew)
+    claim = db_task(_claim)
+    release = db_task(_release)
@@ -0,0 +1,166 @@
+"""
+LLM call layer of the bot runner.
+
+Wraps one AsyncOpenAI client per bot and adds opt-in request hedging: when
+`AIAssistant.config['hedging']` is set and a completion takes longer than the
+configured percentile of the model's recent latency, an identical second
+request is sent, the first successful answer wins and the other request is
+cancelled.
+
+    "hedging": {"percentile": 95, "min_delay_ms": 500, "min_samples": 20}
+
+Hedges are limited process-wide to LLM_HEDGE_BUDGET_RATIO of all calls.
+
+Requests without private context can also be coalesced: concurrent calls
+with the same fingerprint (see `fingerprint`) share one upstream request
+and its response. Upstream requests wait for a slot of the dashboard's fair
+share (see scheduler.py).
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from django.conf import settings
+from openai import AsyncOpenAI
+
+from apps.chatbot.management.routing import health
+from apps.chatbot.management.scheduler import scheduler
+from apps.chatbot.metrics import CACHE, registry
+
+HEDGES = registry.counter('chatbot_llm_hedges_total', 'Hedged LLM requests by result', ('model', 'result'))
+
+
+class HedgeBudget:
+    """Token bucket earning `ratio` of a hedge per call, so hedges stay below that share of calls"""
+
+    def __init__(self, ratio, burst=10):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.lock = threading.Lock()
+
+    def earn(self):
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+hedge_budget = HedgeBudget(settings.LLM_HEDGE_BUDGET_RATIO, settings.LLM_HEDGE_BUDGET_BURST)
+
+
+def fingerprint(assistant_id, model, instructions, text, **params):
+    """Key of a history-free request: case and whitespace of the text are ignored"""
+    normalized = ' '.join((text or '').casefold().split())
+    payload = json.dumps([assistant_id, model, instructions, normalized, params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class SingleFlight:
+    """Concurrent callers with the same key share one in-flight call, on a single event loop"""
+
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, factory):
+        """Returns (result, shared)"""
+        future = self.calls.get(key)
+        shared = future is not None
+        CACHE.inc('llm_single_flight', 'hit' if shared else 'miss')
+        if not shared:
+            future = self.calls[key] = asyncio.ensure_future(factory())
+            future.add_done_callback(lambda done: self.forget(key, done))
+        # A cancelled caller must not cancel the call the others are waiting for
+        return await asyncio.shield(future), shared
+
+    def forget(self, key, future):
+        if self.calls.get(key) is future:
+            del self.calls[key]
+        if not future.cancelled():
+            future.exception()  # retrieved even when every caller has gone
+
+
+single_flight = SingleFlight()
+
+
+class LLMClient:
+    def __init__(self, dashboard_id=None):
+        self.dashboard_id = dashboard_id
+        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
+
+    async def close(self):
+        await self.client.close()
+
+    async def complete(self, model, messages, hedging=None, coalesce_key=None, **params):
+        """
+        chat.completions.create, hedged when a policy is given and the model has enough history.
+
+        Returns (response, shared), shared being True when the response came
+        from a concurrent call with the same coalesce_key.
+        """
+        if coalesce_key is not None:
+            return await single_flight.do(coalesce_key, lambda: self.call(model, messages, hedging, **params))
+        return await self.call(model, messages, hedging, **params), False
+
+    async def call(self, model, messages, hedging=None, **params):
+        request = {'model': model, 'messages': messages, **params}
+        async with scheduler.slot(self.dashboard_id):
+            hedge_budget.earn()
+            delay = self.hedge_delay(model, hedging) if hedging else None
+            if delay is None:
+                return await self.attempt(request)
+            return await self.hedged(request, delay)
+
+    def hedge_delay(self, model, hedging):
+        """Seconds to wait before hedging, None while the model has too few samples"""
+        delay = health.latency_percentile(
+            model, hedging.get('percentile', 95) / 100, hedging.get('min_samples', 20)
+        )
+        if delay is None:
+            return None
+        return max(delay, hedging.get('min_delay_ms', 0) / 1000)
+
+    async def attempt(self, request):
+        """One upstream call feeding the model's rolling health stats, cancelled calls are not counted"""
+        started = time.perf_counter()
+        try:
+            response = await self.client.chat.completions.create(**request)
+        except Exception:
+            health.record(request['model'], time.perf_counter() - started, False)
+            raise
+        health.record(request['model'], time.perf_counter() - started, True)
+        return response
+
+    async def hedged(self, request, delay):
+        model = request['model']
+        primary = asyncio.ensure_future(self.attempt(request))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+            if not hedge_budget.spend():
+                HEDGES.inc(model, 'budget_exhausted')
+                return await primary
+
+            HEDGES.inc(model, 'sent')
+            hedge = asyncio.ensure_future(self.attempt(request))
+            pending.add(hedge)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        HEDGES.inc(model, 'won' if task is hedge else 'lost')
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,175 @@
+"""
+Shared getUpdates poller for the bot runner.
+
+Instead of one python-telegram-bot Updater, HTTP client pair and poll loop
+with a 0.5s sleep per bot, every bot is long-polled over the same two
+bounded connection pools (one for getUpdates, one for the other API calls)
+and updates are handed to the bot's Application through its update queue.
+
+Polling adapts to traffic: each empty poll doubles the long-poll timeout up
+to `idle_timeout`, and a bot without updates for `hibernate_after` seconds
+is hibernated (see TelegramBotManager.hibernate) until its next update.
+
+Each getUpdates confirms the updates fetched before it, whether or not they
+have been handled. Telegram returns unconfirmed updates at once, so polling
+from the handled watermark instead would turn every long poll into a busy
+loop while a reply is generated. A graceful stop (SIGTERM, lease handover,
+hibernation) handles everything already queued before the bot stops. A hard
+crash loses the updates that were queued or in flight at that moment: the
+persisted watermark lies below them, but Telegram no longer has them.
+"""
+import asyncio
+import logging
+import time
+from telegram import Bot, Update
+from telegram.error import Forbidden, InvalidToken, NetworkError, RetryAfter, TimedOut
+from telegram.request import HTTPXRequest
+
+from apps.chatbot.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+POLLS = registry.counter('chatbot_poll_requests_total', 'getUpdates calls by result', ('result',))
+POLLED_BOTS = registry.gauge('chatbot_polled_bots', 'Bots long-polled by the shared poller')
+HIBERNATED_BOTS = registry.gauge('chatbot_hibernated_bots', 'Bots whose Application is torn down until their next update')
+WAKE_SECONDS = registry.histogram('chatbot_bot_wake_seconds', 'Time to restore a hibernated bot')
+
+
+class SharedRequest(HTTPXRequest):
+    """HTTPXRequest used by many bots: their shutdown leaves the pool open, `close` shuts it down"""
+
+    async def shutdown(self):
+        pass
+
+    async def close(self):
+        await super().shutdown()
+
+
+class SharedPoller:
+    def __init__(self, timeout=30, poll_connections=256, api_connections=64, idle_timeout=50, hibernate_after=0):
+        self.timeout = timeout
+        self.idle_timeout = max(idle_timeout, timeout)
+        self.hibernate_after = hibernate_after
+        # Long polls wait for a free connection instead of failing when there are more bots than connections
+        self.updates_request = SharedRequest(connection_pool_size=poll_connections, pool_timeout=None)
+        self.api_request = SharedRequest(connection_pool_size=api_connections, pool_timeout=5.0)
+        self.tasks = {}
+        # Tokens Telegram rejected, the runner stops these bots and releases their leases
+        self.rejected = set()
+
+    async def initialize(self):
+        await self.updates_request.initialize()
+        await self.api_request.initialize()
+
+    async def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
+        await self.updates_request.close()
+        await self.api_request.close()
+
+    def configure(self, builder):
+        """Point an ApplicationBuilder at the shared pools, without an Updater of its own"""
+        return builder.request(self.api_request).get_updates_request(self.updates_request).updater(None)
+
+    def make_bot(self, token, base_url, base_file_url):
+        """
+        Plain Bot used for getUpdates, kept while the bot's Application is hibernated.
+
+        Polled updates are bound to it, so it shares the Application's pools.
+        """
+        return Bot(
+            token, base_url=base_url, base_file_url=base_file_url,
+            request=self.api_request, get_updates_request=self.updates_request
+        )
+
+    def register(self, manager):
+        """Start long-polling a bot from the update after its offset watermark"""
+        self.unregister(manager)
+        self.rejected.discard(manager.token)
+        self.tasks[manager.token] = asyncio.create_task(self.poll(manager))
+        POLLED_BOTS.set(len(self.tasks))
+
+    def unregister(self, manager):
+        self.rejected.discard(manager.token)
+        task = self.tasks.pop(manager.token, None)
+        if task is not None:
+            task.cancel()
+            if manager.hibernated:
+                HIBERNATED_BOTS.dec()
+        POLLED_BOTS.set(len(self.tasks))
+
+    async def poll(self, manager):
+        offset = manager.offsets.highest + 1
+        errors = 0
+        timeout = self.timeout
+        last_update = time.monotonic()
+        while True:
+            try:
+                updates = await manager.poll_bot.get_updates(
+                    offset=offset, timeout=timeout, allowed_updates=Update.ALL_TYPES
+                )
+            except RetryAfter as e:
+                POLLS.inc('retry_after')
+                await asyncio.sleep(e.retry_after if isinstance(e.retry_after, (int, float)) else 5)
+                continue
+            except (InvalidToken, Forbidden) as e:
+                POLLS.inc('rejected')
+                logger.error(f"Stopped polling bot of dashboard {manager.dashboard.id}: {str(e)}")
+                self.rejected.add(manager.token)
+                return
+            except (TimedOut, NetworkError) as e:
+                POLLS.inc('error')
+                errors += 1
+                logger.warning(f"getUpdates failed for dashboard {manager.dashboard.id}: {str(e)}")
+                await asyncio.sleep(min(30, 2 ** min(errors, 5)))
+                continue
+            except Exception as e:
+                POLLS.inc('error')
+                errors += 1
+                logger.error(f"Unexpected getUpdates error for dashboard {manager.dashboard.id}: {str(e)}", exc_info=True)
+                await asyncio.sleep(min(30, 2 ** min(errors, 5)))
+                continue
+            POLLS.inc('updates' if updates else 'empty')
+            if not updates:
+                errors = 0
+                timeout = min(timeout * 2, self.idle_timeout)
+                if self.hibernate_after and time.monotonic() - last_update >= self.hibernate_after:
+                    try:
+                        await self.hibernate(manager)
+                    except Exception as e:
+                        logger.error(f"Failed to hibernate bot of dashboard {manager.dashboard.id}: {str(e)}", exc_info=True)
+                continue
+
+            timeout = self.timeout
+            last_update = time.monotonic()
+            if manager.hibernated:
+                try:
+                    await self.wake(manager)
+                except Exception as e:
+                    # The updates are fetched again, they are not confirmed before the offset moves past them
+                    errors += 1
+                    logger.error(f"Failed to wake bot of dashboard {manager.dashboard.id}: {str(e)}", exc_info=True)
+                    await asyncio.sleep(min(30, 2 ** min(errors, 5)))
+                    continue
+            errors = 0
+            for update in updates:
+                # Confirmed with Telegram by the next poll, see the module docstring
+                offset = max(offset, update.update_id + 1)
+                await manager.application.update_queue.put(update)
+
+    async def hibernate(self, manager):
+        if manager.hibernated:
+            return
+        try:
+            await manager.hibernate()
+        finally:
+            # A failed teardown still leaves the bot hibernated
+            if manager.hibernated:
+                HIBERNATED_BOTS.inc()
+
+    async def wake(self, manager):
+        started = time.perf_counter()
+        await manager.wake()
+        HIBERNATED_BOTS.dec()
+        WAKE_SECONDS.observe(time.perf_counter() - started)
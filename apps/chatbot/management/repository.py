@@ -0,0 +1,144 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+
+from apps.chatbot.models import Message, Chat, Client, AIAssistant, Messenger, GenerationJob
+from apps.chatbot.quotas import quotas
+
+logger = logging.getLogger(__name__)
+
+DB_EXECUTOR = ThreadPoolExecutor(getattr(settings, 'DB_TASK_THREADS', 8), thread_name_prefix='db')
+
+
+def release_connections():
+    """
+    Called after every db_task. Pooled connections go back to the pool and
+    an explicit CONN_MAX_AGE is honoured. With the default CONN_MAX_AGE=0 the
+    thread keeps its connection across calls and closes it only once it is
+    broken, instead of reconnecting for every query.
+    """
+    for conn in connections.all(initialized_only=True):
+        if conn.settings_dict['CONN_MAX_AGE'] != 0 or conn.settings_dict['OPTIONS'].get('pool'):
+            conn.close_if_unusable_or_obsolete()
+        elif conn.errors_occurred:
+            if conn.is_usable():
+                conn.errors_occurred = False
+            else:
+                conn.close()
+
+
+def db_task(func):
+    """
+    Run a blocking ORM function from async code without the global thread hop.
+
+    Django's async queryset API (aget, acreate, ...) still funnels every call
+    through sync_to_async(thread_sensitive=True), i.e. one shared thread for the
+    whole event loop. Repository calls run on DB_EXECUTOR instead, each of its
+    DB_TASK_THREADS threads keeping its own connection, so one slow query does
+    not stall every other bot and database calls do not queue behind other
+    to_thread work in the default executor.
+    """
+    @wraps(func)
+    def inner(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            release_connections()
+
+    return sync_to_async(inner, thread_sensitive=False, executor=DB_EXECUTOR)
+
+
+class ChatRepository:
+    """
+    Data access used by the bot runner, scoped to a single messenger
+    """
+
+    def __init__(self, messenger):
+        self.messenger = messenger
+        self.dashboard = messenger.dashboard
+
+    def _get_or_create_client(self, user):
+        return Client.objects.get_or_create(
+            dashboard=self.dashboard,
+            telegram_chat_id=user.id,
+            defaults={
+                'name': f"{user.first_name} {user.last_name}" if user.last_name else user.first_name,
+                'username': user.username,
+                'is_bot': user.is_bot,
+                'messenger_type': 'telegram',
+            }
+        )
+
+    def _get_or_create_chat(self, client):
+        return Chat.objects.get_or_create(
+            messenger=self.messenger,
+            client=client,
+            defaults={
+                'type': 'telegram',
+                'is_active': True,
+                'dashboard': self.dashboard,
+            }
+        )
+
+    def _get_client_and_chat(self, user):
+        client, _ = self._get_or_create_client(user)
+        chat, _ = self._get_or_create_chat(client)
+        return client, chat
+
+    def _get_default_assistant(self):
+        return AIAssistant.objects.filter(
+            dashboard=self.dashboard,
+            is_active=True
+        ).order_by('-created_date').first()
+
+    def _get_history(self, chat, limit=5):
+        messages = list(
+            Message.objects.filter(chat=chat)
+            .order_by('-created_date')
+            .only('text', 'outgoing', 'created_date')[:limit]
+        )
+        messages.reverse()
+        return messages
+
+    def _create_message(self, **fields):
+        return Message.objects.create(**fields)
+
+    def _create_queued_message(self, telegram_chat_id, **fields):
+        with transaction.atomic():
+            message = Message.objects.create(**fields)
+            GenerationJob.objects.create(
+                messenger=self.messenger, chat=message.chat, message=message, telegram_chat_id=telegram_chat_id
+            )
+        return message
+
+    def _is_active_chat(self, telegram_chat_id):
+        return Chat.objects.filter(
+            messenger=self.messenger, is_active=True, client__telegram_chat_id=telegram_chat_id
+        ).exists()
+
+    def _save_offset(self, update_id):
+        return Messenger.objects.filter(pk=self.messenger.pk).filter(
+            Q(last_update_id__isnull=True) | Q(last_update_id__lt=update_id)
+        ).update(last_update_id=update_id)
+
+    def _load_quotas(self):
+        return quotas.load(self.dashboard)
+
+    # Async API: (client, created), (chat, created), client/chat pair in one hop,
+    # default assistant, chronological history, message creation (alone or with its
+    # generation job), quota seeding,
+    # whether a Telegram chat has an active session and the handled update offset
+    get_or_create_client = db_task(_get_or_create_client)
+    get_or_create_chat = db_task(_get_or_create_chat)
+    get_client_and_chat = db_task(_get_client_and_chat)
+    get_default_assistant = db_task(_get_default_assistant)
+    get_history = db_task(_get_history)
+    create_message = db_task(_create_message)
+    create_queued_message = db_task(_create_queued_message)
+    load_quotas = db_task(_load_quotas)
+    is_active_chat = db_task(_is_active_chat)
+    save_offset = db_task(_save_offset)
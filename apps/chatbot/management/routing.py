@@ -0,0 +1,138 @@
+"""
+Model routing for assistants.
+
+The policy lives in `AIAssistant.config['routing']`, all keys optional:
+
+    {
+        "fast_model": "gpt-4o-mini",   # used for short small-talk messages
+        "fast_max_chars": 20,          # messages up to this length count as short
+        "fallback_model": "gpt-4o-mini",
+        "max_p95_ms": 8000,            # fail over when the model's rolling p95 is slower
+        "max_error_rate": 0.25,        # ... or when it fails more often than this
+        "min_samples": 10              # calls needed before a model can be marked unhealthy
+    }
+
+Without a routing section every message goes to `assistant.model`. While the
+runner is overloaded (see admission.py) every text message goes to the fast
+model.
+"""
+import re
+import threading
+import time
+from collections import deque
+
+from apps.chatbot.metrics import percentile, registry
+
+SMALL_TALK = re.compile(
+    r'^\W*(ok(ay)?|k|thanks?( you)?|thx|ty|cool|great|nice|good|yes|no|yep|nope|sure|hi|hello|hey|bye|'
+    r'спасибо|ок|да|нет|привет|пока|рахмат|👍|🙏|😊)\W*$',
+    re.IGNORECASE
+)
+# Heuristics that keep a short message on the primary model
+NEEDS_PRIMARY = re.compile(r'[?`]|https?://|\d+\s*[-+*/^]\s*\d+')
+
+ROUTES = registry.counter('chatbot_llm_routes_total', 'Model chosen for LLM calls', ('route', 'model'))
+
+
+class ModelHealth:
+    """Rolling latency and error rate per model over the last `window` calls not older than `max_age`"""
+
+    def __init__(self, window=100, max_age=300):
+        self.window = window
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def record(self, model, seconds, ok):
+        with self.lock:
+            calls = self.calls.get(model)
+            if calls is None:
+                calls = self.calls[model] = deque(maxlen=self.window)
+            calls.append((time.monotonic(), seconds, ok))
+
+    def recent(self, model):
+        horizon = time.monotonic() - self.max_age
+        with self.lock:
+            calls = self.calls.get(model, ())
+            while calls and calls[0][0] < horizon:
+                calls.popleft()
+            return list(calls)
+
+    def stats(self, model):
+        """(calls, p95 seconds, error rate) for the model's recent calls"""
+        recent = self.recent(model)
+        if not recent:
+            return 0, 0.0, 0.0
+        errors = sum(1 for _, _, ok in recent if not ok)
+        return len(recent), percentile([seconds for _, seconds, _ in recent], 0.95), errors / len(recent)
+
+    def latency_percentile(self, model, fraction, min_samples=20):
+        """Percentile of the model's recent successful call latencies, None with too few samples"""
+        latencies = [seconds for _, seconds, ok in self.recent(model) if ok]
+        if len(latencies) < min_samples:
+            return None
+        return percentile(latencies, fraction)
+
+    def is_healthy(self, model, max_p95_ms=None, max_error_rate=None, min_samples=10):
+        count, p95, error_rate = self.stats(model)
+        if count < min_samples:
+            return True
+        if max_p95_ms is not None and p95 * 1000 > max_p95_ms:
+            return False
+        if max_error_rate is not None and error_rate > max_error_rate:
+            return False
+        return True
+
+    def samples(self):
+        with self.lock:
+            models = list(self.calls)
+        values = {}
+        for model in models:
+            _, p95, error_rate = self.stats(model)
+            values[(model, 'p95_seconds')] = p95
+            values[(model, 'error_rate')] = error_rate
+        return values
+
+
+health = ModelHealth()
+registry.gauge('chatbot_llm_model_health', 'Rolling LLM latency and error rate', ('model', 'stat'), health.samples)
+
+
+def choose_model(assistant, message_text, has_image=False, degraded=False):
+    """
+    Pick the model for one call, returns (model, route).
+
+    route is 'primary', 'fast', 'degraded' or 'fallback'. Image messages
+    always use a model of the assistant's own configuration.
+    """
+    policy = assistant.config.get('routing') if isinstance(assistant.config, dict) else None
+    if not policy:
+        ROUTES.inc('primary', assistant.model)
+        return assistant.model, 'primary'
+
+    model, route = assistant.model, 'primary'
+    fast_model = policy.get('fast_model')
+    if fast_model and not has_image and degraded:
+        model, route = fast_model, 'degraded'
+    elif fast_model and not has_image and is_small_talk(message_text, policy.get('fast_max_chars', 20)):
+        model, route = fast_model, 'fast'
+
+    fallback_model = policy.get('fallback_model')
+    if fallback_model and fallback_model != model and not has_image:
+        thresholds = {
+            'max_p95_ms': policy.get('max_p95_ms'),
+            'max_error_rate': policy.get('max_error_rate'),
+            'min_samples': policy.get('min_samples', 10),
+        }
+        if not health.is_healthy(model, **thresholds) and health.is_healthy(fallback_model, **thresholds):
+            model, route = fallback_model, 'fallback'
+
+    ROUTES.inc(route, model)
+    return model, route
+
+
+def is_small_talk(text, max_chars=20):
+    text = (text or '').strip()
+    if SMALL_TALK.match(text):
+        return True
+    return len(text) <= max_chars and not NEEDS_PRIMARY.search(text)
@@ -0,0 +1,137 @@
+"""
+Weighted fair scheduling of LLM calls across dashboards.
+
+Every LLM call of the process takes a slot from one FairScheduler. While
+fewer than LLM_MAX_CONCURRENCY calls run, a call starts at once, unless its
+dashboard already runs `Dashboard.llm_max_concurrency` calls. Once the
+process is saturated, freed slots go to the waiting dashboard with the lowest
+virtual time (start-time fair queuing): each call advances its dashboard's
+virtual time by 1 / `Dashboard.llm_weight`, so a dashboard with weight 2 gets
+twice the slots of one with weight 1, and a flood from one dashboard only
+delays that dashboard's own calls. A dashboard returning from idle starts at
+the current virtual time, without credit for the time it did not use.
+"""
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from django.apps import apps
+from django.conf import settings
+
+from apps.chatbot.management.repository import db_task
+from apps.chatbot.metrics import registry
+
+QUEUE_WAIT = registry.histogram(
+    'chatbot_llm_queue_wait_seconds', 'Time LLM calls waited for a scheduler slot', ('dashboard',)
+)
+
+
+class DashboardShare:
+    __slots__ = ('weight', 'max_concurrency', 'running', 'waiters', 'virtual')
+
+    def __init__(self, weight=1, max_concurrency=None):
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.running = 0
+        self.waiters = deque()
+        self.virtual = 0.0
+
+    def has_room(self):
+        return self.max_concurrency is None or self.running < self.max_concurrency
+
+
+class FairScheduler:
+    """Slots for LLM calls shared fairly between dashboards, on a single event loop. capacity 0 means unlimited"""
+
+    def __init__(self, capacity=0):
+        self.capacity = capacity
+        self.running = 0
+        self.virtual = 0.0
+        self.shares = {}
+
+    def configure(self, dashboard_id, weight=1, max_concurrency=None):
+        share = self.share(dashboard_id)
+        share.weight = max(weight or 1, 1)
+        share.max_concurrency = max_concurrency or None
+        self.dispatch()
+
+    def read_settings(self, dashboard_ids):
+        Dashboard = apps.get_model('chatbot', 'Dashboard')
+        return list(
+            Dashboard.objects.filter(pk__in=dashboard_ids).values_list('pk', 'llm_weight', 'llm_max_concurrency')
+        )
+
+    async def refresh(self):
+        """Re-read weights and caps of known dashboards so admin changes apply without a restart"""
+        for dashboard_id, weight, max_concurrency in await db_task(self.read_settings)(list(self.shares)):
+            self.configure(dashboard_id, weight, max_concurrency)
+
+    def share(self, dashboard_id):
+        share = self.shares.get(dashboard_id)
+        if share is None:
+            share = self.shares[dashboard_id] = DashboardShare()
+        return share
+
+    def waiting(self):
+        return sum(len(share.waiters) for share in list(self.shares.values()))
+
+    def has_capacity(self):
+        return not self.capacity or self.running < self.capacity
+
+    @asynccontextmanager
+    async def slot(self, dashboard_id):
+        share = self.share(dashboard_id)
+        started = time.perf_counter()
+        if not share.waiters and share.has_room() and self.has_capacity():
+            self.grant(share)
+        else:
+            if not share.waiters:
+                share.virtual = max(share.virtual, self.virtual)
+            future = asyncio.get_running_loop().create_future()
+            share.waiters.append(future)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    share.waiters.remove(future)
+                else:
+                    # Granted just before the cancellation
+                    self.release(share)
+                raise
+        QUEUE_WAIT.observe(time.perf_counter() - started, str(dashboard_id))
+        try:
+            yield
+        finally:
+            self.release(share)
+
+    def grant(self, share):
+        self.running += 1
+        share.running += 1
+        self.virtual = max(self.virtual, share.virtual)
+        share.virtual = max(share.virtual, self.virtual) + 1 / share.weight
+
+    def release(self, share):
+        self.running -= 1
+        share.running -= 1
+        self.dispatch()
+
+    def dispatch(self):
+        """Hand free slots to waiting dashboards, lowest virtual time first"""
+        while self.has_capacity():
+            eligible = [share for share in self.shares.values() if share.waiters and share.has_room()]
+            if not eligible:
+                return
+            share = min(eligible, key=lambda share: share.virtual)
+            self.grant(share)
+            share.waiters.popleft().set_result(None)
+
+    def samples(self):
+        values = {}
+        for dashboard_id, share in list(self.shares.items()):
+            values[(str(dashboard_id), 'running')] = share.running
+            values[(str(dashboard_id), 'waiting')] = len(share.waiters)
+        return values
+
+
+scheduler = FairScheduler(settings.LLM_MAX_CONCURRENCY)
+registry.gauge('chatbot_llm_slots', 'LLM calls running and waiting per dashboard', ('dashboard', 'state'), scheduler.samples)
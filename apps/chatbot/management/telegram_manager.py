@@ -2,8 +2,8 @@ import logging
 import openai
 import asyncio
 import requests
-from asgiref.sync import sync_to_async
 import io
+from contextlib import asynccontextmanager
 from pydub import AudioSegment
 from datetime import datetime
 from openai import OpenAI, APIConnectionError, AuthenticationError, RateLimitError
@@ -19,31 +19,54 @@ from telegram.ext import (
 from django.core.management.base import BaseCommand
 from django.conf import settings
 
+from apps.chatbot.counters import counters
 from apps.chatbot.models import Messenger, Message, Chat, Client, AIAssistant, Dashboard
+from apps.chatbot.management.admission import BUSY_REPLY, DEGRADED, SHED, Overloaded, admission
+from apps.chatbot.management.history import history_cache
+from apps.chatbot.management.deadlines import TIMEOUT_REPLY, DeadlineExceeded, budget, remaining, update_deadline
+from apps.chatbot.management.repository import ChatRepository
+from apps.chatbot.management.llm import LLMClient, fingerprint
+from apps.chatbot.management.routing import choose_model
+from apps.chatbot.management.scheduler import scheduler
+from apps.chatbot.management.updates import (
+    DedupeWindow, FloodControl, TrackingUpdateProcessor, UpdateOffsets, catch_up
+)
+from apps.chatbot.quotas import quotas
+from apps.chatbot.metrics import STAGE_LATENCY, UPDATES, ERRORS, TOKENS, IN_FLIGHT
 
 
 logger = logging.getLogger(__name__)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('telegram_bot.log'),
-        logging.StreamHandler()
-    ]
-)
-
 openai.api_key = settings.OPENAI_API_KEY
 
+QUOTA_EXCEEDED_REPLY = "⏳ This assistant has reached its usage limit. Please try again later."
+
 class TelegramBotManager:
-    def __init__(self, messenger_instance):
+    def __init__(self, messenger_instance, poller=None):
         self.messenger = messenger_instance
+        self.poller = poller
         self.token = messenger_instance.token
         self.dashboard = messenger_instance.dashboard
+        self.repository = ChatRepository(messenger_instance)
+        self.llm = None
+        self.history = history_cache
+        self.metrics_label = str(self.dashboard.id)
+        scheduler.configure(self.dashboard.id, self.dashboard.llm_weight, self.dashboard.llm_max_concurrency)
         self.application = None
         self.updater = None
         self.active_chats = set()
+        self.offsets = UpdateOffsets(messenger_instance.last_update_id)
+        self.recent_updates = DedupeWindow(settings.TELEGRAM_DEDUPE_WINDOW)
+        self.flood = None
+        if settings.TELEGRAM_FLOOD_RATE:
+            self.flood = FloodControl(
+                settings.TELEGRAM_FLOOD_RATE, settings.TELEGRAM_FLOOD_BURST, settings.TELEGRAM_FLOOD_CLIENTS
+            )
+        self.resume_task = None
+        self.offsets_task = None
+        self.poll_bot = None
+        self.hibernated = False
+        self.wake_lock = asyncio.Lock()
         logger.info(f"Initializing TelegramBotManager for dashboard: {self.dashboard.name}")
     
     def register_handlers(self):
@@ -71,40 +94,27 @@ class TelegramBotManager:
     async def initialize(self):
         """Initialize the Telegram bot application"""
         try:
-            logger.info(f"Attempting to initialize bot with token (first 5 chars): {self.token[:5]}...")
+            logger.info(f"Initializing bot for dashboard {self.dashboard.id}")
             
-            # Explicitly delete any existing webhook
-            self.application = Application.builder().token(self.token).build()
-            await self.application.bot.delete_webhook(drop_pending_updates=True)
+            await self.repository.load_quotas()
+
+            # Explicitly delete any existing webhook, keeping the updates sent while we were down
+            self.application = self.application_builder().build()
+            await self.application.bot.delete_webhook(drop_pending_updates=False)
             
             # Rebuild application with proper configuration
-            self.application = (
-                Application.builder()
-                .token(self.token)
-                .concurrent_updates(True)  # Enable concurrent updates
-                .build()
-            )
-            
-            # Register handlers
-            self.register_handlers()
-            
-            # Start polling with explicit parameters
-            await self.application.initialize()
-            await self.application.start()
-            
-            # Start polling with error handling
-            self.updater = self.application.updater
-            if self.updater:
-                await self.updater.start_polling(
-                    poll_interval=0.5,
-                    timeout=10,
-                    drop_pending_updates=True,
-                    allowed_updates=Update.ALL_TYPES
+            await self.start_application()
+            if self.poller:
+                self.poll_bot = self.poller.make_bot(
+                    self.token, settings.TELEGRAM_API_BASE_URL, settings.TELEGRAM_FILE_BASE_URL
                 )
+                await self.poll_bot.initialize()
+            
+            # Drain the backlog from the stored offset, then start polling
+            self.resume_task = asyncio.create_task(self.resume())
             
             # Verify bot is working
-            self.bot = self.application.bot
-            bot_info = await self.bot.get_me()
+            bot_info = await self.application.bot.get_me()
             logger.info(f"Bot initialized: @{bot_info.username} (ID: {bot_info.id})")
             
             return True
@@ -113,51 +123,203 @@ class TelegramBotManager:
             logger.error(f"Failed to initialize Telegram bot: {str(e)}", exc_info=True)
             return False
         
+    async def start_application(self):
+        """Build and start the Application with everything needed to handle updates"""
+        self.application = (
+            self.application_builder()
+            # Concurrent, tracking update offsets, without repeated or flooding updates
+            .concurrent_updates(
+                TrackingUpdateProcessor(
+                    self.offsets, self.recent_updates, self.flood, self.metrics_label, settings.UPDATE_DEADLINE
+                )
+            )
+            .build()
+        )
+        
+        self.llm = LLMClient(self.dashboard.id)
+        
+        self.register_handlers()
+        await self.application.initialize()
+        await self.application.start()
+        self.updater = self.application.updater
+        self.offsets_task = asyncio.create_task(self.save_offsets())
+
+    async def stop_application(self):
+        """Stop the Application and release it, even when stopping fails. The offsets handled so far are saved"""
+        if self.offsets_task and not self.offsets_task.done():
+            self.offsets_task.cancel()
+        try:
+            if self.updater and self.updater.running:
+                await self.updater.stop()
+            if self.application.running:
+                await self.application.stop()
+            await self.application.shutdown()
+            await self.save_offset()
+        finally:
+            await self.release_application()
+
+    async def release_application(self):
+        if self.llm:
+            await self.llm.close()
+        self.application = None
+        self.updater = None
+        self.llm = None
+        self.active_chats = set()
+
+    async def hibernate(self):
+        """
+        Tear down an idle bot's Application, LLM client and session cache.
+
+        Only the shared poller's getUpdates loop stays, which calls `wake` on
+        the next update. Returns False when the bot is busy.
+        """
+        async with self.wake_lock:
+            if self.hibernated or self.offsets.in_flight or not self.application.update_queue.empty():
+                return False
+            try:
+                await self.stop_application()
+            finally:
+                # Released even when stopping failed, the next update rebuilds it
+                self.hibernated = True
+        logger.info(f"Hibernated bot of dashboard {self.dashboard.id}", extra={'dashboard': self.dashboard.id})
+        return True
+
+    async def wake(self):
+        """Restore a hibernated bot before its updates are queued"""
+        async with self.wake_lock:
+            if not self.hibernated:
+                return
+            try:
+                await self.start_application()
+            except BaseException:
+                # Stays hibernated, the next poll tries again
+                await self.release_application()
+                raise
+            self.hibernated = False
+        logger.info(f"Woke bot of dashboard {self.dashboard.id}", extra={'dashboard': self.dashboard.id})
+
+    def application_builder(self):
+        """Application builder pointed at the configured Bot API server"""
+        builder = (
+            Application.builder()
+            .token(self.token)
+            .base_url(settings.TELEGRAM_API_BASE_URL)
+            .base_file_url(settings.TELEGRAM_FILE_BASE_URL)
+        )
+        if self.poller:
+            # Shared HTTP pools and polling instead of a per-bot Updater
+            builder = self.poller.configure(builder)
+        return builder
+
+    async def resume(self):
+        """Handle updates received while the bot was down, then poll for new ones"""
+        try:
+            drained = await catch_up(
+                self.application, self.offsets, self.metrics_label, settings.TELEGRAM_CATCH_UP_CONCURRENCY
+            )
+            if drained:
+                logger.info(f"Caught up on {drained} pending updates", extra={'dashboard': self.dashboard.id})
+        except Exception as e:
+            logger.error(f"Catch-up failed, pending updates are left for polling: {str(e)}", exc_info=True)
+        if self.poller:
+            self.poller.register(self)
+        elif self.updater:
+            await self.updater.start_polling(
+                poll_interval=0.5,
+                timeout=10,
+                allowed_updates=Update.ALL_TYPES
+            )
+
+    async def save_offsets(self):
+        """Persist the handled update watermark, at most once per interval"""
+        while True:
+            await asyncio.sleep(settings.TELEGRAM_OFFSET_SAVE_INTERVAL)
+            await self.save_offset()
+
+    async def save_offset(self):
+        update_id = self.offsets.pending_write()
+        if update_id is None:
+            return
+        try:
+            await self.repository.save_offset(update_id)
+            self.offsets.persisted = update_id
+        except Exception as e:
+            logger.error(f"Failed to save update offset: {str(e)}")
+
     async def post_init(self, application):
         """Callback after application initialization"""
         logger.info("Application post-init complete")
 
     async def shutdown(self):
         """Shutdown the bot gracefully"""
-        if self.application:
+        if self.application or self.hibernated:
             try:
                 logger.info("Starting shutdown process")
-                await self.application.stop()
-                await self.application.shutdown()
+                if self.resume_task and not self.resume_task.done():
+                    self.resume_task.cancel()
+                if self.poller:
+                    self.poller.unregister(self)
+                if self.application:
+                    await self.stop_application()
+                await self.save_offset()
+                self.history.forget(self.messenger.id)
                 logger.info(f"Successfully shutdown Telegram bot for dashboard {self.dashboard.name}")
             except Exception as e:
                 logger.error(f"Error during shutdown: {str(e)}", exc_info=True)
 
+    def timed(self, stage):
+        """Record the duration of a handling stage for this dashboard"""
+        return STAGE_LATENCY.time(stage, self.metrics_label)
+
+    @asynccontextmanager
+    async def stage(self, stage):
+        """Time a handling stage and cancel it when its deadline budget runs out"""
+        with self.timed(stage):
+            async with budget(stage, self.metrics_label):
+                yield
+
+    async def reply_timed_out(self, bot, chat_id, error):
+        """Tell the user their update ran out of time, the reply gets a send budget of its own"""
+        logger.warning(f"Update timed out: {str(error)}", extra={'dashboard': self.dashboard.id, 'chat_id': chat_id})
+        try:
+            async with asyncio.timeout(settings.TELEGRAM_SEND_TIMEOUT):
+                await bot.send_message(chat_id=chat_id, text=TIMEOUT_REPLY)
+        except Exception as e:
+            logger.error(f"Failed to send the timeout reply: {str(e)}")
+
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /start command"""
+        UPDATES.inc('start', self.metrics_label)
         try:
             user = update.effective_user
             chat = update.effective_chat
-            logger.info(f"Received /start from user {user.id} in chat {chat.id}")
-            
-            # Get or create client
-            client = await self.get_or_create_client(user, chat)
-            logger.info(f"Client {'created' if client._state.adding else 'retrieved'}: {client.id}")
+            log_context = {'dashboard': self.dashboard.id, 'chat_id': chat.id, 'update_id': update.update_id}
+            logger.info("Received /start", extra=log_context)
             
-            # Get or create chat
-            telegram_chat = await self.get_or_create_chat(chat, client)
-            logger.info(f"Chat {'created' if telegram_chat._state.adding else 'retrieved'}: {telegram_chat.id}")
+            # Get or create client and chat
+            async with self.stage('client_lookup'):
+                client, telegram_chat = await self.repository.get_client_and_chat(user)
+            logger.debug(f"Client/Chat ready - Client ID: {client.id}, Chat ID: {telegram_chat.id}", extra=log_context)
             
             # Get the default AI assistant
-            assistant = await self.get_default_assistant()
-            logger.info(f"Assistant retrieved: {assistant.id if assistant else 'None'}")
+            async with self.stage('assistant_lookup'):
+                assistant = await self.get_default_assistant()
+            logger.debug(f"Assistant retrieved: {assistant.id if assistant else 'None'}", extra=log_context)
             
             welcome_message = f"👋 Hello {user.first_name}! I'm your AI assistant."
             if assistant:
                 welcome_message += f"\n\nCurrent assistant: {assistant.get_assistant_type_display()}"
             
-            await context.bot.send_message(chat_id=chat.id, text=welcome_message)
-            logger.info(f"Sent welcome message to chat {chat.id}")
+            async with self.stage('telegram_send'):
+                await context.bot.send_message(chat_id=chat.id, text=welcome_message)
             
             self.active_chats.add(chat.id)
-            logger.info(f"Added chat {chat.id} to active sessions")
+            logger.debug("Added chat to active sessions", extra=log_context)
             
+        except DeadlineExceeded as e:
+            await self.reply_timed_out(context.bot, chat.id, e)
         except Exception as e:
+            ERRORS.inc(type(e).__name__, self.metrics_label)
             logger.error(f"Error in start_command: {str(e)}", exc_info=True)
             await context.bot.send_message(
                 chat_id=chat.id,
@@ -166,19 +328,31 @@ class TelegramBotManager:
 
     async def handle_message(self, update: Update, context: CallbackContext):
         """Handle incoming text messages"""
+        UPDATES.inc('text', self.metrics_label)
+        IN_FLIGHT.inc(self.metrics_label)
+        try:
+            with self.timed('update'):
+                await self.respond_to_message(update, context)
+        finally:
+            IN_FLIGHT.dec(self.metrics_label)
+
+    async def respond_to_message(self, update: Update, context: CallbackContext):
+        """Store the message, generate a reply and send it"""
         try:
-            logger.info(f"Raw update received: {update}")
             if update.message is None:
-                logger.warning("Update doesn't contain a message!")
+                logger.warning("Update doesn't contain a message!", extra={'update_id': update.update_id})
                 return
                 
             user = update.effective_user
             chat = update.effective_chat
             message_text = update.message.text
+            log_context = {'dashboard': self.dashboard.id, 'chat_id': chat.id, 'update_id': update.update_id}
             
-            logger.info(f"Processing message from {user.id} in chat {chat.id}: {message_text}")
+            logger.info(f"Processing text message ({len(message_text)} chars)", extra=log_context)
             
-            if chat.id not in self.active_chats:
+            async with self.stage('client_lookup'):
+                active = await self.is_active_chat(chat.id)
+            if not active:
                 logger.warning(f"Chat {chat.id} not in active sessions")
                 await context.bot.send_message(
                     chat_id=chat.id,
@@ -187,81 +361,155 @@ class TelegramBotManager:
                 return
             
             # Get or create client and chat
-            client = await self.get_or_create_client(user, chat)
-            telegram_chat = await self.get_or_create_chat(chat, client)
-            logger.info(f"Client/Chat ready - Client ID: {client.id}, Chat ID: {telegram_chat.id}")
+            async with self.stage('client_lookup'):
+                client, telegram_chat = await self.repository.get_client_and_chat(user)
+            logger.debug(f"Client/Chat ready - Client ID: {client.id}, Chat ID: {telegram_chat.id}", extra=log_context)
             
             # Create incoming message record
-            incoming_message = await sync_to_async(Message.objects.create)(
-                text=message_text,
-                client=client,
-                chat=telegram_chat,
-                is_opened=True,
-                outgoing=False,
-                sender_info={
+            incoming = {
+                'text': message_text,
+                'client': client,
+                'chat': telegram_chat,
+                'is_opened': True,
+                'outgoing': False,
+                'sender_info': {
                     'first_name': user.first_name,
                     'last_name': user.last_name,
                     'username': user.username,
                     'id': user.id
                 }
-            )
-            logger.info(f"Created incoming message record: {incoming_message.id}")
-            
-            # Get AI assistant
-            assistant = await self.get_default_assistant()
-            if not assistant:
-                logger.warning("No active assistant found for dashboard")
-                await context.bot.send_message(
-                    chat_id=chat.id,
-                    text="⚠️ No active AI assistant is configured for this dashboard."
-                )
+            }
+            if settings.GENERATION_QUEUE:
+                # Stored with a generation job, a generation_worker process replies
+                async with self.stage('message_write'):
+                    incoming_message = await self.repository.create_queued_message(chat.id, **incoming)
+                logger.info(f"Queued reply to message {incoming_message.id}", extra=log_context)
                 return
             
-            # Get conversation history
-            history = await self.get_conversation_history(telegram_chat)
-            logger.info(f"Retrieved {len(history)} history messages")
+            async with self.stage('message_write'):
+                incoming_message = await self.repository.create_message(**incoming)
+            self.history.append(self.messenger.id, incoming_message)
+            logger.debug(f"Created incoming message record: {incoming_message.id}", extra=log_context)
             
-            # Process with AI
-            response_text = await self.process_with_assistant(
-                assistant, 
-                message_text, 
-                client,
-                history
-            )
-            logger.info("Generated AI response")
-            
-            # Send response
-            await context.bot.send_message(chat_id=chat.id, text=response_text)
-            logger.info("Sent response to user")
-            
-            # Create outgoing message record
-            outgoing_message = await sync_to_async(Message.objects.create)(
-                text=response_text,
-                client=client,
-                ai_assistant=assistant,
-                chat=telegram_chat,
-                is_opened=True,
-                outgoing=True,
-                sender_info={
-                    'assistant_id': assistant.assistant_id,
-                    'assistant_type': assistant.assistant_type,
-                    'model': assistant.model
-                }
-            )
-            logger.info(f"Created outgoing message record: {outgoing_message.id}")
+            if not await self.check_quota(context.bot, chat.id):
+                return
+            
+            await self.generate_reply(context.bot, chat.id, telegram_chat, client, message_text)
             
+        except DeadlineExceeded as e:
+            await self.reply_timed_out(context.bot, chat.id, e)
         except Exception as e:
+            ERRORS.inc(type(e).__name__, self.metrics_label)
             logger.error(f"Error in handle_message: {str(e)}", exc_info=True)
             await context.bot.send_message(
                 chat_id=chat.id,
                 text="⚠️ An error occurred while processing your message. Please try again."
             )
 
+    async def generate_reply(self, bot, chat_id, telegram_chat, client, message_text):
+        """
+        Answer a stored incoming message: LLM call, send and store the reply.
+
+        A stage running out of its deadline budget raises DeadlineExceeded.
+        """
+        log_context = {'dashboard': self.dashboard.id, 'chat_id': chat_id}
+        reply = await self.compose_reply(bot, chat_id, telegram_chat, client, message_text)
+        if reply is None:
+            return
+        assistant, response_text, usage, model = reply
+
+        # Send response
+        async with self.stage('telegram_send'):
+            await bot.send_message(chat_id=chat_id, text=response_text)
+        if usage is None:
+            # Shed: the busy notice is not a reply to store or count
+            return
+        logger.debug("Sent response to user", extra=log_context)
+        
+        # Create outgoing message record. The user has the reply, running out of time here is only logged
+        try:
+            async with self.stage('message_write'):
+                outgoing_message = await self.repository.create_message(
+                    **self.reply_fields(telegram_chat, client, assistant, response_text, usage, model)
+                )
+        except DeadlineExceeded as e:
+            logger.error(f"Sent reply not stored: {str(e)}", extra=log_context)
+            return
+        if self.history is not None:
+            self.history.append(self.messenger.id, outgoing_message)
+        logger.info(f"Replied with message {outgoing_message.id}", extra=log_context)
+
+    async def compose_reply(self, bot, chat_id, telegram_chat, client, message_text, raise_errors=False):
+        """
+        Generate the reply to a stored incoming message. Returns (assistant, reply, usage, model),
+        see process_with_assistant, or None when the dashboard has no assistant (the user is told).
+
+        With raise_errors LLM failures propagate instead of being answered
+        with an error message, so the caller can retry.
+        """
+        log_context = {'dashboard': self.dashboard.id, 'chat_id': chat_id}
+        
+        # Get AI assistant
+        async with self.stage('assistant_lookup'):
+            assistant = await self.get_default_assistant()
+        if not assistant:
+            logger.warning("No active assistant found for dashboard")
+            await bot.send_message(
+                chat_id=chat_id,
+                text="⚠️ No active AI assistant is configured for this dashboard."
+            )
+            return None
+        
+        # Get conversation history
+        async with self.stage('history_fetch'):
+            history = await self.get_conversation_history(telegram_chat)
+        logger.debug(f"Retrieved {len(history)} history messages", extra=log_context)
+        
+        # Process with AI
+        async with self.stage('llm_call'):
+            response_text, usage, model = await self.process_with_assistant(
+                assistant, 
+                message_text, 
+                client,
+                history,
+                raise_errors=raise_errors
+            )
+        logger.debug("Generated AI response", extra=log_context)
+        return assistant, response_text, usage, model
+
+    def reply_fields(self, telegram_chat, client, assistant, response_text, usage, model):
+        """Fields of the outgoing Message storing a generated reply"""
+        return dict(
+            text=response_text,
+            client=client,
+            ai_assistant=assistant,
+            chat=telegram_chat,
+            is_opened=True,
+            outgoing=True,
+            sender_info={
+                'assistant_id': assistant.assistant_id,
+                'assistant_type': assistant.assistant_type,
+                'model': model
+            },
+            **usage
+        )
+
+    async def start_generator(self):
+        """Prepare the manager to generate replies without running the bot (generation_worker)"""
+        await self.repository.load_quotas()
+        self.llm = LLMClient(self.dashboard.id)
+        # The runner stores the incoming messages, history has to come from the database
+        self.history = None
+
     async def handle_other_messages(self, update: Update, context: CallbackContext):
         """Handle non-text messages (photos, audio, etc.)"""
         try:
             chat = update.effective_chat
             message = update.message
+            UPDATES.inc(
+                'photo' if message.photo else 'audio' if message.audio or message.voice else 'other',
+                self.metrics_label
+            )
             
             if message.photo:
                 await self.handle_photo(chat, message, context)
@@ -274,6 +522,7 @@ class TelegramBotManager:
                 )
                 
         except Exception as e:
+            ERRORS.inc(type(e).__name__, self.metrics_label)
             logger.error(f"Error in handle_other_messages: {str(e)}", exc_info=True)
             await context.bot.send_message(
                 chat_id=chat.id,
@@ -285,17 +534,19 @@ class TelegramBotManager:
         try:
             # Get the highest quality photo
             photo = message.photo[-1]
-            file = await context.bot.get_file(photo.file_id)
+            async with self.stage('file_lookup'):
+                file = await context.bot.get_file(photo.file_id)
             file_url = file.file_path
             
-            logger.info(f"Received photo from chat {chat.id}, file URL: {file_url}")
+            logger.info("Received photo", extra={'dashboard': self.dashboard.id, 'chat_id': chat.id})
             
             # Get or create client and chat
-            client = await self.get_or_create_client(message.from_user, chat)
-            telegram_chat = await self.get_or_create_chat(chat, client)
+            async with self.stage('client_lookup'):
+                client, telegram_chat = await self.repository.get_client_and_chat(message.from_user)
             
             # Check if assistant supports images
-            assistant = await self.get_default_assistant()
+            async with self.stage('assistant_lookup'):
+                assistant = await self.get_default_assistant()
             if not assistant:
                 await context.bot.send_message(
                     chat_id=chat.id,
@@ -310,17 +561,27 @@ class TelegramBotManager:
                 )
                 return
                 
+            if not await self.check_quota(context.bot, chat.id):
+                return
+                
             # Process with OpenAI
-            response = await self.process_with_assistant(
-                assistant=assistant,
-                message_text="Describe this image",
-                client=client,
-                image_url=file_url
-            )
+            async with self.stage('llm_call'):
+                response, usage, _ = await self.process_with_assistant(
+                    assistant=assistant,
+                    message_text="Describe this image",
+                    client=client,
+                    image_url=file_url
+                )
+            if usage:
+                counters.record_usage(assistant.id, **usage)
             
-            await context.bot.send_message(chat_id=chat.id, text=response)
+            async with self.stage('telegram_send'):
+                await context.bot.send_message(chat_id=chat.id, text=response)
             
+        except DeadlineExceeded as e:
+            await self.reply_timed_out(context.bot, chat.id, e)
         except Exception as e:
+            ERRORS.inc(type(e).__name__, self.metrics_label)
             logger.error(f"Error processing photo: {str(e)}", exc_info=True)
             await context.bot.send_message(
                 chat_id=chat.id,
@@ -330,13 +591,15 @@ class TelegramBotManager:
     
 
     async def transcribe_audio(self, audio_url):
-        """Transcribe audio using OpenAI Whisper API"""
+        """Transcribe audio using OpenAI Whisper API, within the transcription stage's budget"""
         try:
-            client = OpenAI(api_key=settings.OPENAI_API_KEY)
+            client = OpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
             
             # Download audio file
             with requests.Session() as session:
-                audio_response = await sync_to_async(session.get)(audio_url, stream=True)
+                audio_response = await asyncio.to_thread(
+                    session.get, audio_url, stream=True, timeout=remaining('transcription')
+                )
                 audio_response.raise_for_status()
                 
                 # Convert to file-like object
@@ -359,7 +622,8 @@ class TelegramBotManager:
                     client.audio.transcriptions.create,
                     file=audio_file,
                     model="whisper-1",
-                    response_format="text"
+                    response_format="text",
+                    timeout=remaining('transcription')
                 )
                 return transcription
                 
@@ -374,14 +638,17 @@ class TelegramBotManager:
         """Process audio messages with proper error handling"""
         try:
             audio = message.audio or message.voice
-            file = await context.bot.get_file(audio.file_id)
+            async with self.stage('file_lookup'):
+                file = await context.bot.get_file(audio.file_id)
             file_url = file.file_path
             
-            logger.info(f"Processing audio from chat {chat.id}")
+            logger.info("Processing audio", extra={'dashboard': self.dashboard.id, 'chat_id': chat.id})
             
-            # Get or create client
-            client = await self.get_or_create_client(message.from_user, chat)
-            assistant = await self.get_default_assistant()
+            # Get or create client and chat
+            async with self.stage('client_lookup'):
+                client, telegram_chat = await self.repository.get_client_and_chat(message.from_user)
+            async with self.stage('assistant_lookup'):
+                assistant = await self.get_default_assistant()
             
             if not assistant:
                 await context.bot.send_message(
@@ -389,15 +656,20 @@ class TelegramBotManager:
                     text="⚠️ No active AI assistant is configured."
                 )
                 return
+            
+            if not await self.check_quota(context.bot, chat.id):
+                return
 
             # Show "processing" message
-            processing_msg = await context.bot.send_message(
-                chat_id=chat.id,
-                text="🔊 Processing your audio message..."
-            )
+            async with self.stage('telegram_send'):
+                processing_msg = await context.bot.send_message(
+                    chat_id=chat.id,
+                    text="🔊 Processing your audio message..."
+                )
 
             # Transcribe audio
-            transcription = await self.transcribe_audio(file_url)
+            async with self.stage('transcription'):
+                transcription = await self.transcribe_audio(file_url)
             
             if not transcription:
                 await context.bot.edit_message_text(
@@ -407,23 +679,30 @@ class TelegramBotManager:
                 )
                 return
 
-            logger.info(f"Transcription result: {transcription[:100]}...")
+            logger.debug(f"Transcription received ({len(transcription)} chars)", extra={'chat_id': chat.id})
             
             # Process with assistant
-            response = await self.process_with_assistant(
-                assistant=assistant,
-                message_text=transcription,
-                client=client
-            )
+            async with self.stage('llm_call'):
+                response, usage, _ = await self.process_with_assistant(
+                    assistant=assistant,
+                    message_text=transcription,
+                    client=client
+                )
+            if usage:
+                counters.record_usage(assistant.id, **usage)
             
             # Update message with result
-            await context.bot.edit_message_text(
-                chat_id=chat.id,
-                message_id=processing_msg.message_id,
-                text=response
-            )
+            async with self.stage('telegram_send'):
+                await context.bot.edit_message_text(
+                    chat_id=chat.id,
+                    message_id=processing_msg.message_id,
+                    text=response
+                )
             
+        except DeadlineExceeded as e:
+            await self.reply_timed_out(context.bot, chat.id, e)
         except Exception as e:
+            ERRORS.inc(type(e).__name__, self.metrics_label)
             logger.error(f"Audio processing error: {str(e)}", exc_info=True)
             await context.bot.send_message(
                 chat_id=chat.id,
@@ -431,6 +710,29 @@ class TelegramBotManager:
             )
             
 
+    async def is_active_chat(self, chat_id):
+        """
+        Whether the chat has a session. Sessions survive restarts: a chat is
+        looked up on its first message and then kept in active_chats
+        """
+        if chat_id in self.active_chats:
+            return True
+        if await self.repository.is_active_chat(chat_id):
+            self.active_chats.add(chat_id)
+            return True
+        return False
+
+    async def check_quota(self, bot, chat_id):
+        """Tell the user and return False when the dashboard's LLM quota is used up"""
+        exceeded = quotas.check(self.dashboard.id)
+        if exceeded is None:
+            return True
+        ERRORS.inc('quota_exceeded', self.metrics_label)
+        logger.warning(f"Dashboard {exceeded} reached", extra={'dashboard': self.dashboard.id, 'chat_id': chat_id})
+        async with self.stage('telegram_send'):
+            await bot.send_message(chat_id=chat_id, text=QUOTA_EXCEEDED_REPLY)
+        return False
+
     def model_supports_images(self, model_name):
         """Check if the model supports image processing"""
         image_supporting_models = [
@@ -441,56 +743,35 @@ class TelegramBotManager:
         return any(model in model_name.lower() for model in image_supporting_models)
 
     async def get_or_create_client(self, user, chat):
-        """Get or create a Client record"""
+        """Get or create a Client record, returns (client, created)"""
         try:
-            client = await sync_to_async(Client.objects.get)(
-                dashboard=self.dashboard,
-                telegram_chat_id=user.id
-            )
-            logger.debug(f"Found existing client: {client.id}")
-        except Client.DoesNotExist:
-            client = await sync_to_async(Client.objects.create)(
-                dashboard=self.dashboard,
-                telegram_chat_id=user.id,
-                name=f"{user.first_name} {user.last_name}" if user.last_name else user.first_name,
-                username=user.username,
-                is_bot=user.is_bot
-            )
-            logger.info(f"Created new client: {client.id}")
+            client, created = await self.repository.get_or_create_client(user)
+            if created:
+                logger.info(f"Created new client: {client.id}")
+            else:
+                logger.debug(f"Found existing client: {client.id}")
+            return client, created
         except Exception as e:
             logger.error(f"Error in get_or_create_client: {str(e)}", exc_info=True)
             raise
-        return client
 
     async def get_or_create_chat(self, chat, client):
-        """Get or create a Chat record"""
+        """Get or create a Chat record, returns (chat, created)"""
         try:
-            telegram_chat = await sync_to_async(Chat.objects.get)(
-                messenger=self.messenger,
-                client=client
-            )
-            logger.debug(f"Found existing chat: {telegram_chat.id}")
-        except Chat.DoesNotExist:
-            telegram_chat = await sync_to_async(Chat.objects.create)(
-                messenger=self.messenger,
-                type='telegram',
-                client=client,
-                is_active=True,
-                dashboard=self.dashboard
-            )
-            logger.info(f"Created new chat: {telegram_chat.id}")
+            telegram_chat, created = await self.repository.get_or_create_chat(client)
+            if created:
+                logger.info(f"Created new chat: {telegram_chat.id}")
+            else:
+                logger.debug(f"Found existing chat: {telegram_chat.id}")
+            return telegram_chat, created
         except Exception as e:
             logger.error(f"Error in get_or_create_chat: {str(e)}", exc_info=True)
             raise
-        return telegram_chat
 
     async def get_default_assistant(self):
         """Get the default AI assistant for this dashboard"""
         try:
-            assistant = await sync_to_async(AIAssistant.objects.filter(
-                dashboard=self.dashboard,
-                is_active=True
-            ).order_by('-created_date').first)()
+            assistant = await self.repository.get_default_assistant()
             if assistant:
                 logger.debug(f"Found assistant: {assistant.id} ({assistant.assistant_type})")
             else:
@@ -501,19 +782,22 @@ class TelegramBotManager:
             return None
 
     async def get_conversation_history(self, chat, limit=5):
-        """Get recent conversation history for context"""
+        """Get recent conversation history for context, from the history cache when it has the chat"""
         try:
-            messages = await sync_to_async(list)(
-                Message.objects.filter(chat=chat)
-                .order_by('-created_date')[:limit]
-            )
+            if self.history is None:
+                messages = await self.repository.get_history(chat, limit)
+            else:
+                messages = self.history.get(self.messenger.id, chat.id, limit)
+                if messages is None:
+                    loaded = await self.repository.get_history(chat, max(limit, self.history.turns))
+                    messages = self.history.load(chat.id, loaded, limit)
             history = [
                 {
                     'role': 'assistant' if msg.outgoing else 'user',
                     'content': msg.text,
                     'timestamp': msg.created_date.isoformat()
                 }
-                for msg in reversed(messages)
+                for msg in messages
             ]
             logger.debug(f"Retrieved {len(history)} history messages")
             return history
@@ -521,40 +805,52 @@ class TelegramBotManager:
             logger.error(f"Error getting conversation history: {str(e)}", exc_info=True)
             return []
     
-    async def process_with_assistant(self, assistant, message_text, client, history=None, image_url=None):
-        """Process the message with the OpenAI API (now supports images)"""
+    def has_private_context(self, history, message_text):
+        """Whether the history holds anything besides the message being answered"""
+        return any(
+            entry['role'] != 'user' or entry['content'] != message_text
+            for entry in history or []
+        )
+
+    async def process_with_assistant(self, assistant, message_text, client, history=None, image_url=None,
+                                     raise_errors=False):
+        """
+        Process the message with the OpenAI API (now supports images).
+
+        Returns (reply, usage, model): the token counts to store with the reply
+        ({} when the call failed) and the model picked by the routing policy.
+        With raise_errors a failed call raises instead of returning an error reply.
+        While the runner is overloaded the call is degraded or shed, see admission.py:
+        a shed call returns BUSY_REPLY with usage None, or raises Overloaded with raise_errors.
+        """
+        model = assistant.model
+        level = admission.enter(self.metrics_label)
+        if level == SHED:
+            if raise_errors:
+                raise Overloaded(self.metrics_label)
+            return BUSY_REPLY, None, model
+        degraded = level == DEGRADED
         try:
-            logger.info("Initializing OpenAI client...")
-            client = OpenAI(api_key=settings.OPENAI_API_KEY)
-
             messages = []
 
             # System message
             if assistant.instructions:
-                logger.debug(f"Assistant instructions: {assistant.instructions}")
                 messages.append({'role': 'system', 'content': assistant.instructions})
-            else:
-                logger.debug("No assistant instructions provided.")
 
             # Conversation history
+            if history and degraded:
+                history = history[max(len(history) - settings.LLM_DEGRADED_HISTORY, 0):]
             if history:
-                logger.debug(f"Loaded history with {len(history)} messages.")
                 messages.extend(history)
-            else:
-                logger.debug("No conversation history provided.")
 
             # Build content array
             content = [{'type': 'text', 'text': message_text}]
-            logger.debug(f"User message text: {message_text}")
 
             if image_url:
-                logger.debug(f"Including image URL in request: {image_url}")
                 content.append({
                     'type': 'image_url',
                     'image_url': {'url': image_url}
                 })
-            else:
-                logger.debug("No image URL provided.")
 
             user_message = {
                 'role': 'user',
@@ -562,41 +858,75 @@ class TelegramBotManager:
             }
             messages.append(user_message)
 
-            logger.info(f"Calling OpenAI with model: {assistant.model}")
-            logger.debug(f"Payload to OpenAI: {messages}")
+            model, route = choose_model(assistant, message_text, has_image=bool(image_url), degraded=degraded)
+            logger.debug(
+                f"Calling OpenAI ({route}) with {len(messages)} messages{' and an image' if image_url else ''}",
+                extra={'dashboard': self.dashboard.id, 'model': model}
+            )
 
-            # Make the API call
-            response = await asyncio.to_thread(
-                client.chat.completions.create,
-                model=assistant.model,
-                messages=messages,
-                temperature=assistant.config.get('temperature', 0.7),
-                max_tokens=assistant.config.get('max_tokens', 1000),
+            # Make the API call, hedged when the assistant opts in. Requests without
+            # private context are shared with identical concurrent ones
+            params = {
+                'temperature': assistant.config.get('temperature', 0.7),
+                'max_tokens': assistant.config.get('max_tokens', 1000),
+            }
+            if degraded:
+                params['max_tokens'] = min(params['max_tokens'], settings.LLM_DEGRADED_MAX_TOKENS)
+            coalesce_key = None
+            if not image_url and not self.has_private_context(history, message_text):
+                coalesce_key = fingerprint(assistant.id, model, assistant.instructions, message_text, **params)
+            response, shared = await self.llm.complete(
+                model,
+                messages,
+                hedging=None if degraded else assistant.config.get('hedging'),
+                coalesce_key=coalesce_key,
+                **params
             )
 
             reply = response.choices[0].message.content
-            logger.info("Received response from OpenAI.")
-            logger.debug(f"Response content: {reply}")
-            return reply
+            # Tokens are accounted once, to the caller that made the upstream call
+            usage = {
+                'prompt_tokens': response.usage.prompt_tokens if response.usage and not shared else 0,
+                'completion_tokens': response.usage.completion_tokens if response.usage and not shared else 0,
+            }
+            if not shared:
+                TOKENS.inc('prompt', self.metrics_label, model, amount=usage['prompt_tokens'])
+                TOKENS.inc('completion', self.metrics_label, model, amount=usage['completion_tokens'])
+                quotas.add(self.dashboard.id, **usage)
+            logger.debug(
+                f"Received response from OpenAI ({len(reply or '')} chars)",
+                extra={'dashboard': self.dashboard.id, 'model': model}
+            )
+            return reply, usage, model
 
         except AuthenticationError as e:
-            import os
-            logger.error("OpenAI Authentication Failed. Check your API key.")
-            logger.debug(f"Environment variable OPENAI_API_KEY: {os.getenv('OPENAI_API_KEY')}")
-            logger.debug(f"Exception: {e}")
-            return "⚠️ Bot configuration error. Please contact support."
-
-
+            ERRORS.inc('openai_auth', self.metrics_label)
+            logger.error(f"OpenAI Authentication Failed. Check your API key: {str(e)}")
+            if raise_errors:
+                raise
+            return "⚠️ Bot configuration error. Please contact support.", {}, model
             
         except RateLimitError as e:
+            ERRORS.inc('openai_rate_limit', self.metrics_label)
             logger.error("OpenAI Rate Limit Exceeded")
-            return "⏳ I'm getting too many requests. Please try again later."
+            if raise_errors:
+                raise
+            return "⏳ I'm getting too many requests. Please try again later.", {}, model
             
         except APIConnectionError as e:
+            ERRORS.inc('openai_connection', self.metrics_label)
             logger.error("OpenAI Connection Error")
-            return "🔌 Connection error. Please try again."
+            if raise_errors:
+                raise
+            return "🔌 Connection error. Please try again.", {}, model
             
         except Exception as e:
+            ERRORS.inc('openai_other', self.metrics_label)
             logger.error(f"OpenAI Processing Error: {str(e)}", exc_info=True)
-            return "⚠️ I encountered an error processing your request. Please try again."
+            if raise_errors:
+                raise
+            return "⚠️ I encountered an error processing your request. Please try again.", {}, model
+
+        finally:
+            admission.leave()
             
\ No newline at end of file
@@ -0,0 +1,243 @@
+"""
+Update bookkeeping for the bot runner.
+
+The last handled update_id of every messenger is persisted, so a restart
+resumes where the previous process stopped instead of dropping everything
+users sent in between. Updates polled but not yet handled when a process
+crashes are lost (see poller.py). Updates that piled up while the bot was down are
+drained by `catch_up` before regular polling starts.
+
+Before a polled update reaches the handlers, repeated deliveries of an
+update_id are dropped (see DedupeWindow) and so are messages of a client
+sending faster than its FloodControl bucket allows. Handlers then run under
+the update's deadline (see deadlines.py).
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from telegram import Update
+from telegram.ext import SimpleUpdateProcessor
+
+from apps.chatbot.management.deadlines import update_deadline
+from apps.chatbot.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+BACKLOG = registry.counter(
+    'chatbot_backlog_updates_total', 'Updates drained by catch-up, by how they were handled', ('result', 'dashboard')
+)
+DROPPED = registry.counter('chatbot_updates_dropped_total', 'Updates dropped before handling', ('reason', 'dashboard'))
+
+FLOOD_REPLY = "⏳ You're sending messages too fast. Please wait a moment."
+
+
+class UpdateOffsets:
+    """
+    Tracks which update_ids are being handled and reports the watermark:
+    the highest update_id below which every update has been handled.
+    """
+
+    def __init__(self, last_update_id=None):
+        self.highest = last_update_id or 0
+        self.persisted = self.highest
+        self.in_flight = set()
+
+    def begin(self, update_id):
+        self.in_flight.add(update_id)
+        self.highest = max(self.highest, update_id)
+
+    def done(self, update_id):
+        self.in_flight.discard(update_id)
+
+    def watermark(self):
+        if self.in_flight:
+            return min(self.in_flight) - 1
+        return self.highest
+
+    def pending_write(self):
+        """Watermark to persist, None when the stored one is current"""
+        watermark = self.watermark()
+        return watermark if watermark > self.persisted else None
+
+
+class DedupeWindow:
+    """The last `size` update_ids of a bot"""
+
+    def __init__(self, size=2048):
+        self.size = size
+        self.ids = set()
+        self.order = deque()
+
+    def add(self, update_id):
+        """False when the update_id is already in the window"""
+        if update_id in self.ids:
+            return False
+        self.ids.add(update_id)
+        self.order.append(update_id)
+        if len(self.order) > self.size:
+            self.ids.discard(self.order.popleft())
+        return True
+
+
+class ClientBucket:
+    __slots__ = ('tokens', 'updated', 'warned')
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+        self.warned = False
+
+
+class FloodControl:
+    """
+    Token bucket per client of a bot: `rate` messages per second, bursts of
+    `burst`. Only the most recently seen `max_clients` clients are tracked.
+    """
+
+    def __init__(self, rate=1.0, burst=10, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()
+
+    def take(self, client_id):
+        """Returns (allowed, warn), warn being True for the first refused message of a burst"""
+        now = time.monotonic()
+        bucket = self.buckets.get(client_id)
+        if bucket is None:
+            bucket = self.buckets[client_id] = ClientBucket(self.burst, now)
+            if len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(client_id)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.warned = False
+            return True, False
+        warn = not bucket.warned
+        bucket.warned = True
+        return False, warn
+
+    async def admit(self, update):
+        """Whether to handle the update, a throttled client is told once per burst"""
+        user = update.effective_user
+        if user is None:
+            return True
+        allowed, warn = self.take(user.id)
+        if not allowed and warn and update.effective_chat:
+            try:
+                await update.get_bot().send_message(chat_id=update.effective_chat.id, text=FLOOD_REPLY)
+            except Exception as e:
+                logger.warning(f"Failed to send the flood control reply: {str(e)}")
+        return allowed
+
+
+class TrackingUpdateProcessor(SimpleUpdateProcessor):
+    """
+    Concurrent update processing that keeps UpdateOffsets in sync and drops
+    repeated and flooding updates before any handler runs. Handlers get
+    `deadline` seconds per update, 0 means no deadline
+    """
+
+    def __init__(self, offsets, recent=None, flood=None, metrics_label='', deadline=0, max_concurrent_updates=256):
+        super().__init__(max_concurrent_updates)
+        self.offsets = offsets
+        self.recent = recent
+        self.flood = flood
+        self.metrics_label = metrics_label
+        self.deadline = deadline
+
+    async def do_process_update(self, update, coroutine):
+        update_id = getattr(update, 'update_id', None)
+        if update_id is None:
+            await coroutine
+            return
+        if update_id <= self.offsets.persisted or (self.recent is not None and not self.recent.add(update_id)):
+            coroutine.close()
+            DROPPED.inc('duplicate', self.metrics_label)
+            return
+        self.offsets.begin(update_id)
+        try:
+            if self.flood is not None and not await self.flood.admit(update):
+                coroutine.close()
+                DROPPED.inc('flood', self.metrics_label)
+                return
+            with update_deadline(self.deadline):
+                await coroutine
+        finally:
+            self.offsets.done(update_id)
+
+
+def coalesce_backlog(updates):
+    """
+    Group backlog updates per chat and sender in arrival order and merge runs
+    of plain text messages into one update, so a user who sent five lines
+    while the bot was down gets one answer. In a group chat each member's
+    lines stay their own.
+
+    Returns {(chat_id, user_id): [(update, [update_ids it stands for]), ...]}.
+    """
+    chats = {}
+    for update in updates:
+        chat, user = update.effective_chat, update.effective_user
+        queue = chats.setdefault((chat.id if chat else None, user.id if user else None), [])
+        message = update.message
+        mergeable = message is not None and message.text and not message.text.startswith('/')
+        if mergeable and queue and queue[-1][2]:
+            previous, update_ids, _ = queue[-1]
+            data = previous.to_dict()
+            data['update_id'] = update.update_id
+            data['message']['text'] = f"{previous.message.text}\n{message.text}"
+            data['message'].pop('entities', None)
+            queue[-1] = (Update.de_json(data, update.get_bot()), update_ids + [update.update_id], True)
+        else:
+            queue.append((update, [update.update_id], bool(mergeable)))
+    return {key: [(update, update_ids) for update, update_ids, _ in queue] for key, queue in chats.items()}
+
+
+async def catch_up(application, offsets, metrics_label, concurrency=20, batch_size=100):
+    """
+    Handle the updates that arrived while the bot was down, then confirm them.
+
+    Chats (each sender of a group chat on their own) are processed
+    concurrently, at most `concurrency` at a time, each one's updates in order.
+    Updates pass the application's update processor like polled ones, with
+    dedupe, flood control and the update deadline. Returns the number of updates drained.
+    """
+    bot = application.bot
+    semaphore = asyncio.Semaphore(concurrency)
+    drained = 0
+
+    async def handle_chat(queue):
+        async with semaphore:
+            for update, update_ids in queue:
+                try:
+                    await application.update_processor.process_update(update, application.process_update(update))
+                except Exception as e:
+                    logger.error(f"Error handling backlog update {update.update_id}: {str(e)}", exc_info=True)
+                finally:
+                    for update_id in update_ids:
+                        offsets.done(update_id)
+
+    while True:
+        updates = await bot.get_updates(offset=offsets.highest + 1, limit=batch_size, timeout=0)
+        if not updates:
+            break
+        for update in updates:
+            offsets.begin(update.update_id)
+        chats = coalesce_backlog(updates)
+        handled = sum(len(queue) for queue in chats.values())
+        BACKLOG.inc('handled', metrics_label, amount=handled)
+        BACKLOG.inc('merged', metrics_label, amount=len(updates) - handled)
+        await asyncio.gather(*(handle_chat(queue) for queue in chats.values()))
+        drained += len(updates)
+        if len(updates) < batch_size:
+            break
+
+    if drained:
+        # Confirm everything up to the watermark with Telegram
+        await bot.get_updates(offset=offsets.highest + 1, limit=1, timeout=0)
+    return drained
@@ -0,0 +1,205 @@
+"""
+Minimal in-process metrics registry rendered in the Prometheus text format.
+
+Metrics are plain dicts keyed by label values behind a lock, so recording on
+the hot path costs a dict update. Each process has its own registry: the
+telegram runner and the generation worker expose theirs with --metrics-port.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def samples(self):
+        """[(sample name, label values, extra (name, value) label pairs, value)]"""
+        with self.lock:
+            return [(self.name, labels, (), value) for labels, value in self.values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for name, labels, extra, value in self.samples():
+            lines.append(f'{name}{format_labels(self.labelnames, labels, extra)} {value}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self):
+        if self.function is not None:
+            # Callback gauges are evaluated at scrape time: {labels tuple: value} or a number
+            value = self.function()
+            items = value.items() if isinstance(value, dict) else [((), value)]
+            return [(self.name, labels, (), sample) for labels, sample in items]
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        with self.lock:
+            snapshot = [(labels, list(series[0]), series[1], series[2]) for labels, series in self.values.items()]
+        samples = []
+        for labels, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                samples.append((f'{self.name}_bucket', labels, (('le', le),), cumulative))
+            samples.append((f'{self.name}_sum', labels, (), total))
+            samples.append((f'{self.name}_count', labels, (), count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Bot runner metrics
+STAGE_LATENCY = registry.histogram(
+    'chatbot_stage_seconds', 'Latency of update handling stages', ('stage', 'dashboard')
+)
+UPDATES = registry.counter('chatbot_updates_total', 'Telegram updates received', ('kind', 'dashboard'))
+ERRORS = registry.counter('chatbot_errors_total', 'Errors while handling updates', ('kind', 'dashboard'))
+TOKENS = registry.counter('chatbot_llm_tokens_total', 'LLM tokens used', ('type', 'dashboard', 'model'))
+CACHE = registry.counter('chatbot_cache_requests_total', 'Cache lookups', ('cache', 'result'))
+IN_FLIGHT = registry.gauge('chatbot_updates_in_flight', 'Updates currently being handled', ('dashboard',))
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of `values`, 0.0 when there are none"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def process_rss_bytes():
+    """Resident memory of this process, 0 where /proc is not available"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+registry.gauge('process_resident_memory_bytes', 'Resident memory size in bytes', function=process_rss_bytes)
+
+
+def start_http_server(port, address='0.0.0.0'):
+    """Serve the registry at /metrics from a daemon thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0].rstrip('/') != '/metrics':
+                self.send_error(404)
+                return
+            payload = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,65 @@
+# Generated by Django 5.2 on 2026-10-19 09:52
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_clients(apps, schema_editor):
+    """
+    The get-or-create race could store a chat's client twice. Keep the oldest
+    client per (dashboard, chat id) and move the duplicates' messages, and
+    their chat's messages, to it before the unique constraints are added.
+    """
+    Client = apps.get_model('chatbot', 'Client')
+    Chat = apps.get_model('chatbot', 'Chat')
+    Message = apps.get_model('chatbot', 'Message')
+
+    for field in ('telegram_chat_id', 'whatsapp_chat_id'):
+        duplicated = (
+            Client.objects.filter(**{f'{field}__isnull': False}).order_by()
+            .values('dashboard_id', field).annotate(clients=Count('pk')).filter(clients__gt=1)
+        )
+        for key in duplicated:
+            clients = list(
+                Client.objects.filter(dashboard_id=key['dashboard_id'], **{field: key[field]}).order_by('pk')
+            )
+            keep, duplicates = clients[0], clients[1:]
+            keep_chat = Chat.objects.filter(client=keep).first()
+            for duplicate in duplicates:
+                Message.objects.filter(client=duplicate).update(client=keep)
+                chat = Chat.objects.filter(client=duplicate).first()
+                if chat and keep_chat is None:
+                    chat.client = keep
+                    chat.save(update_fields=['client'])
+                    keep_chat = chat
+                elif chat:
+                    Message.objects.filter(chat=chat).update(chat=keep_chat)
+                    chat.delete()
+                duplicate.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0013_remove_message_is_read'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_clients, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='aiassistant',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['dashboard', '-created_date'], name='assistant_active_dashboard_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', '-created_date'], name='message_chat_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='client',
+            constraint=models.UniqueConstraint(condition=models.Q(('telegram_chat_id__isnull', False)), fields=('dashboard', 'telegram_chat_id'), name='unique_dashboard_telegram_chat_id'),
+        ),
+        migrations.AddConstraint(
+            model_name='client',
+            constraint=models.UniqueConstraint(condition=models.Q(('whatsapp_chat_id__isnull', False)), fields=('dashboard', 'whatsapp_chat_id'), name='unique_dashboard_whatsapp_chat_id'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 09:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0014_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dashboard',
+            name='message_retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text='Messages older than this are moved to the archive. Empty uses MESSAGE_RETENTION_DAYS', null=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2 on 2026-10-19 09:58
+
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Left
+
+
+def backfill_counters(apps, schema_editor):
+    Chat = apps.get_model('chatbot', 'Chat')
+    Message = apps.get_model('chatbot', 'Message')
+    AIAssistant = apps.get_model('chatbot', 'AIAssistant')
+
+    chat_messages = Message.objects.filter(chat=OuterRef('pk')).order_by().values('chat')
+    Chat.objects.update(
+        message_count=Coalesce(Subquery(chat_messages.annotate(value=Count('pk')).values('value')[:1]), 0),
+        last_inbound_at=Subquery(chat_messages.filter(outgoing=False).annotate(value=Max('created_date')).values('value')[:1]),
+        last_outbound_at=Subquery(chat_messages.filter(outgoing=True).annotate(value=Max('created_date')).values('value')[:1]),
+        # Same truncation as counters.PREVIEW_LENGTH, the column holds 100 characters
+        last_message_preview=Coalesce(Left(Subquery(
+            Message.objects.filter(chat=OuterRef('pk')).order_by('-created_date').values('text')[:1]
+        ), 100), models.Value('')),
+    )
+    assistant_messages = Message.objects.filter(ai_assistant=OuterRef('pk'), outgoing=True).order_by().values('ai_assistant')
+    AIAssistant.objects.update(
+        usage_count=Coalesce(Subquery(assistant_messages.annotate(value=Count('pk')).values('value')[:1]), 0),
+        last_used=Subquery(assistant_messages.annotate(value=Max('created_date')).values('value')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0015_dashboard_message_retention_days'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiassistant',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of replies generated by the assistant'),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_inbound_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_outbound_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-19 09:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0016_chat_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('messenger_type', models.CharField(choices=[('instagram', 'Instagram'), ('telegram', 'Telegram'), ('whatsapp', 'Whatsapp')], max_length=100)),
+                ('inbound_messages', models.PositiveIntegerField(default=0)),
+                ('outbound_messages', models.PositiveIntegerField(default=0)),
+                ('active_clients', models.PositiveIntegerField(default=0, help_text='Clients that sent at least one message')),
+                ('response_count', models.PositiveIntegerField(default=0)),
+                ('response_time_total_ms', models.BigIntegerField(default=0, help_text='Sum of reply latencies')),
+                ('prompt_tokens', models.BigIntegerField(default=0)),
+                ('completion_tokens', models.BigIntegerField(default=0)),
+                ('dashboard', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='chatbot.dashboard')),
+            ],
+            options={
+                'verbose_name': 'Daily Stats',
+                'verbose_name_plural': 'Daily Stats',
+                'ordering': ('-day',),
+                'constraints': [models.UniqueConstraint(fields=('dashboard', 'day', 'messenger_type'), name='unique_dashboard_day_messenger_type')],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2 on 2026-10-19 10:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0017_dashboard_daily_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aiassistant',
+            name='completion_tokens',
+            field=models.BigIntegerField(default=0, help_text='Completion tokens used by the assistant'),
+        ),
+        migrations.AddField(
+            model_name='aiassistant',
+            name='prompt_tokens',
+            field=models.BigIntegerField(default=0, help_text='Prompt tokens used by the assistant'),
+        ),
+        migrations.AddField(
+            model_name='dashboard',
+            name='daily_request_limit',
+            field=models.PositiveIntegerField(blank=True, help_text='LLM requests allowed per day. Empty means unlimited', null=True),
+        ),
+        migrations.AddField(
+            model_name='dashboard',
+            name='daily_token_limit',
+            field=models.PositiveIntegerField(blank=True, help_text='LLM tokens allowed per day. Empty means unlimited', null=True),
+        ),
+        migrations.AddField(
+            model_name='dashboard',
+            name='monthly_request_limit',
+            field=models.PositiveIntegerField(blank=True, help_text='LLM requests allowed per calendar month. Empty means unlimited', null=True),
+        ),
+        migrations.AddField(
+            model_name='dashboard',
+            name='monthly_token_limit',
+            field=models.PositiveIntegerField(blank=True, help_text='LLM tokens allowed per calendar month. Empty means unlimited', null=True),
+        ),
+        migrations.AddField(
+            model_name='dashboarddailystats',
+            name='llm_requests',
+            field=models.PositiveIntegerField(default=0, help_text='Calls made to the LLM'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='completion_tokens',
+            field=models.PositiveIntegerField(default=0, help_text='Completion tokens of the reply'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='prompt_tokens',
+            field=models.PositiveIntegerField(default=0, help_text='Prompt tokens of the LLM call that produced the reply'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 10:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0018_token_usage_and_quotas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messenger',
+            name='last_update_id',
+            field=models.BigIntegerField(blank=True, help_text='Last handled Telegram update, polling resumes after it', null=True),
+        ),
+    ]
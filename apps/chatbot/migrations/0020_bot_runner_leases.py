@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-19 10:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0019_messenger_last_update_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotRunner',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('hostname', models.CharField(blank=True, max_length=255)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('heartbeat_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MessengerLease',
+            fields=[
+                ('messenger', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='lease', serialize=False, to='chatbot.messenger')),
+                ('owner', models.CharField(blank=True, db_index=True, help_text='Name of the BotRunner holding it', max_length=100)),
+                ('expires_at', models.DateTimeField()),
+                ('acquired_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
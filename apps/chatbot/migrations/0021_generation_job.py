@@ -0,0 +1,37 @@
+# Generated by Django 5.2 on 2026-10-19 10:38
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0020_bot_runner_leases'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('telegram_chat_id', models.BigIntegerField()),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('dead', 'Dead')], default='queued', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Not claimed before this time (retry backoff)')),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_until', models.DateTimeField(blank=True, help_text='A running job is claimed again after this, its worker is presumed dead', null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to='chatbot.chat')),
+                ('message', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='generation_job', to='chatbot.message')),
+                ('messenger', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to='chatbot.messenger')),
+            ],
+            options={
+                'ordering': ('-created_at',),
+                'indexes': [models.Index(fields=['status', 'available_at'], name='generation_job_claim_idx')],
+            },
+        ),
+    ]
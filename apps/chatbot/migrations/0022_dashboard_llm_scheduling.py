@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-19 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0021_generation_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dashboard',
+            name='llm_max_concurrency',
+            field=models.PositiveIntegerField(blank=True, help_text='LLM calls this dashboard may run at once. Empty means no own cap', null=True),
+        ),
+        migrations.AddField(
+            model_name='dashboard',
+            name='llm_weight',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Share of the LLM capacity relative to other dashboards when it is saturated'),
+        ),
+    ]
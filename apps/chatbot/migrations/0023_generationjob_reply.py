@@ -0,0 +1,24 @@
+# Generated by Django 5.2 on 2026-10-19 11:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0022_dashboard_llm_scheduling'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationjob',
+            name='reply',
+            field=models.OneToOneField(blank=True, help_text='Generated reply, a retry sends it instead of generating again', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chatbot.message'),
+        ),
+        migrations.AddField(
+            model_name='generationjob',
+            name='sent_at',
+            field=models.DateTimeField(blank=True, help_text='Reply sent, or possibly sent (timed out): it is never sent again', null=True),
+        ),
+    ]
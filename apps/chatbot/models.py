@@ -1,8 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from django.utils.timezone import now
+
+from .counters import counters
 
 MESSENGER_TYPES = (
     ('instagram', 'Instagram'),
@@ -41,6 +43,29 @@ class Dashboard(models.Model):
         help_text="Token for sharing the dashboard"
     )
     is_shared = models.BooleanField(default=False, help_text="Whether the dashboard is shared with others")
+    message_retention_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Messages older than this are moved to the archive. Empty uses MESSAGE_RETENTION_DAYS"
+    )
+    daily_token_limit = models.PositiveIntegerField(
+        null=True, blank=True, help_text="LLM tokens allowed per day. Empty means unlimited"
+    )
+    monthly_token_limit = models.PositiveIntegerField(
+        null=True, blank=True, help_text="LLM tokens allowed per calendar month. Empty means unlimited"
+    )
+    daily_request_limit = models.PositiveIntegerField(
+        null=True, blank=True, help_text="LLM requests allowed per day. Empty means unlimited"
+    )
+    monthly_request_limit = models.PositiveIntegerField(
+        null=True, blank=True, help_text="LLM requests allowed per calendar month. Empty means unlimited"
+    )
+    llm_weight = models.PositiveSmallIntegerField(
+        default=1, help_text="Share of the LLM capacity relative to other dashboards when it is saturated"
+    )
+    llm_max_concurrency = models.PositiveIntegerField(
+        null=True, blank=True, help_text="LLM calls this dashboard may run at once. Empty means no own cap"
+    )
     
     class Meta:
         ordering = ['-created_date']
@@ -91,10 +116,21 @@ class AIAssistant(models.Model):
         default='gpt-4-turbo',
         help_text="Underlying model used by the assistant"
     )
+    usage_count = models.PositiveIntegerField(default=0, help_text="Number of replies generated by the assistant")
+    prompt_tokens = models.BigIntegerField(default=0, help_text="Prompt tokens used by the assistant")
+    completion_tokens = models.BigIntegerField(default=0, help_text="Completion tokens used by the assistant")
     
     class Meta:
         verbose_name = "AI Assistant"
         verbose_name_plural = "AI Assistants"
+        indexes = [
+            # Default assistant lookup: active assistants of a dashboard, newest first
+            models.Index(
+                fields=['dashboard', '-created_date'],
+                condition=models.Q(is_active=True),
+                name='assistant_active_dashboard_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.model} ({self.get_assistant_type_display()}) - Dashboard: {self.dashboard.name}"
@@ -107,6 +143,8 @@ class Messenger(models.Model):
     messenger_type = models.CharField(max_length=100, choices=MESSENGER_TYPES)
     id_instance = models.CharField(max_length=100, null=True, blank=True,
                                    help_text='Not necessary if messanger type is Instagram or Telegram')
+    last_update_id = models.BigIntegerField(null=True, blank=True,
+                                            help_text='Last handled Telegram update, polling resumes after it')
 
     class Meta:
         constraints = [
@@ -129,11 +167,80 @@ class Messenger(models.Model):
 
     def __str__(self):
         return f"{self.dashboard} - Active: {self.is_active}"
+
+
+class BotRunner(models.Model):
+    """
+    A replica of the Telegram bot runner, alive while its heartbeat is recent
+    """
+    name = models.CharField(max_length=100, unique=True)
+    hostname = models.CharField(max_length=255, blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    heartbeat_at = models.DateTimeField()
+
+    def __str__(self):
+        return self.name
+
+
+class MessengerLease(models.Model):
+    """
+    Ownership of a messenger by one bot runner replica, lost when not renewed before expires_at
+    """
+    messenger = models.OneToOneField(Messenger, on_delete=models.CASCADE, primary_key=True, related_name='lease')
+    owner = models.CharField(max_length=100, blank=True, db_index=True, help_text='Name of the BotRunner holding it')
+    expires_at = models.DateTimeField()
+    acquired_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.messenger_id} - {self.owner or 'free'}"
+
+
+class GenerationJob(models.Model):
+    """
+    Reply to generate for an incoming message, consumed by `manage.py generation_worker`
+    """
+    STATUSES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('dead', 'Dead'),
+    )
+
+    messenger = models.ForeignKey(Messenger, on_delete=models.CASCADE, related_name='generation_jobs')
+    chat = models.ForeignKey('Chat', on_delete=models.CASCADE, related_name='generation_jobs')
+    message = models.OneToOneField('Message', on_delete=models.CASCADE, related_name='generation_job')
+    telegram_chat_id = models.BigIntegerField()
+    status = models.CharField(max_length=10, choices=STATUSES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, help_text='Not claimed before this time (retry backoff)')
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True,
+                                        help_text='A running job is claimed again after this, its worker is presumed dead')
+    last_error = models.TextField(blank=True)
+    reply = models.OneToOneField('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                                 help_text='Generated reply, a retry sends it instead of generating again')
+    sent_at = models.DateTimeField(null=True, blank=True,
+                                   help_text='Reply sent, or possibly sent (timed out): it is never sent again')
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-created_at',)
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='generation_job_claim_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.id} - {self.status}"
     
 
 class Message(models.Model): 
     class Meta:
         ordering = ('created_date',)
+        indexes = [
+            # Conversation history: latest messages of a chat
+            models.Index(fields=['chat', '-created_date'], name='message_chat_created_idx'),
+        ]
 
     text = models.TextField(max_length=500)
     sender_info = models.JSONField(null=True, blank=True)
@@ -151,12 +258,16 @@ class Message(models.Model):
         choices=[('photo', 'Photo'), ('audio', 'Audio'), ('voice', 'Voice')],
         blank=True, null=True
     )
+    prompt_tokens = models.PositiveIntegerField(default=0, help_text="Prompt tokens of the LLM call that produced the reply")
+    completion_tokens = models.PositiveIntegerField(default=0, help_text="Completion tokens of the reply")
 
     def save(self, *args, **kwargs):
+        adding = self._state.adding
         super().save(*args, **kwargs)
-        if self.chat:
-            self.chat.updated_date = now()
-            self.chat.save(update_fields=['updated_date'])
+        if adding:
+            # Chat/assistant counters and updated_date are counted once the message is
+            # committed, written right away or in batches by the runner's periodic flush
+            transaction.on_commit(lambda: counters.record_message(self))
 
  
 class Chat(models.Model): 
@@ -175,14 +286,30 @@ class Chat(models.Model):
     updated_date = models.DateTimeField(auto_now=True)
     last_updated = models.DateTimeField(auto_now=True)
     assistant = models.ForeignKey(AIAssistant, on_delete=models.SET_NULL, related_name='chats', null=True, blank=True)
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_preview = models.CharField(max_length=100, blank=True, default='')
+    last_inbound_at = models.DateTimeField(null=True, blank=True)
+    last_outbound_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f'{self.id} - {self.type}'
 
 
 class Client(models.Model):
-    # class Meta:
-    #     ordering = ('-created_date', '-updated_date')
+    class Meta:
+        # ordering = ('-created_date', '-updated_date')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dashboard', 'telegram_chat_id'],
+                condition=models.Q(telegram_chat_id__isnull=False),
+                name='unique_dashboard_telegram_chat_id'
+            ),
+            models.UniqueConstraint(
+                fields=['dashboard', 'whatsapp_chat_id'],
+                condition=models.Q(whatsapp_chat_id__isnull=False),
+                name='unique_dashboard_whatsapp_chat_id'
+            ),
+        ]
 
     telegram_chat_id = models.BigIntegerField(null=True, blank=True)
     whatsapp_chat_id = models.CharField(max_length=100, null=True, blank=True)
@@ -193,4 +320,38 @@ class Client(models.Model):
     is_bot = models.BooleanField(default=False)
 
     def __str__(self):
-        return f'@{self.username} - {self.name}'
\ No newline at end of file
+        return f'@{self.username} - {self.name}'
+
+class DashboardDailyStats(models.Model):
+    """
+    Per-day rollup of dashboard activity, maintained incrementally as messages are written
+    """
+    dashboard = models.ForeignKey(Dashboard, on_delete=models.CASCADE, related_name='daily_stats')
+    day = models.DateField()
+    messenger_type = models.CharField(max_length=100, choices=MESSENGER_TYPES)
+    inbound_messages = models.PositiveIntegerField(default=0)
+    outbound_messages = models.PositiveIntegerField(default=0)
+    active_clients = models.PositiveIntegerField(default=0, help_text="Clients that sent at least one message")
+    response_count = models.PositiveIntegerField(default=0)
+    response_time_total_ms = models.BigIntegerField(default=0, help_text="Sum of reply latencies")
+    llm_requests = models.PositiveIntegerField(default=0, help_text="Calls made to the LLM")
+    prompt_tokens = models.BigIntegerField(default=0)
+    completion_tokens = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ('-day',)
+        verbose_name = "Daily Stats"
+        verbose_name_plural = "Daily Stats"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dashboard', 'day', 'messenger_type'],
+                name='unique_dashboard_day_messenger_type'
+            ),
+        ]
+
+    @property
+    def average_response_ms(self):
+        return self.response_time_total_ms / self.response_count if self.response_count else None
+
+    def __str__(self):
+        return f"{self.dashboard_id} - {self.day} - {self.messenger_type}"
@@ -0,0 +1,156 @@
+"""
+Per-dashboard LLM quotas enforced from memory.
+
+Usage of the current day and month is seeded from DashboardDailyStats when a
+bot starts and counted in process afterwards. The same calls reach the
+database through the coalesced counter flush (see counters.py), so checking a
+quota never costs a query. Every QUOTA_REFRESH_INTERVAL `refresh_limits`
+re-reads the rollups after a flush, which brings in the calls made by the
+other runner replicas and generation workers: usage then lags by at most the
+others' unflushed calls. The rollups only count replies stored as messages,
+photo and audio replies count in the process that made them.
+"""
+import threading
+from django.apps import apps
+from django.db.models import F, Q, Sum
+from django.utils.timezone import localdate
+
+from .metrics import registry
+
+LIMIT_FIELDS = ('daily_token_limit', 'monthly_token_limit', 'daily_request_limit', 'monthly_request_limit')
+
+
+class DashboardUsage:
+    __slots__ = ('day', 'day_tokens', 'day_requests', 'month_tokens', 'month_requests', 'limits')
+
+    def __init__(self, day, limits):
+        self.day = day
+        self.day_tokens = 0
+        self.day_requests = 0
+        self.month_tokens = 0
+        self.month_requests = 0
+        self.limits = limits
+
+    def roll(self, today):
+        """Reset the counters when the day or the month changed"""
+        if today == self.day:
+            return
+        if (today.year, today.month) != (self.day.year, self.day.month):
+            self.month_tokens = 0
+            self.month_requests = 0
+        self.day_tokens = 0
+        self.day_requests = 0
+        self.day = today
+
+    def exceeded(self):
+        """Name of the first exhausted limit, or None"""
+        for name, used in (
+            ('daily_request_limit', self.day_requests),
+            ('monthly_request_limit', self.month_requests),
+            ('daily_token_limit', self.day_tokens),
+            ('monthly_token_limit', self.month_tokens),
+        ):
+            limit = self.limits.get(name)
+            if limit is not None and used >= limit:
+                return name
+        return None
+
+
+class QuotaTracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.usage = {}
+
+    def load(self, dashboard):
+        """
+        Start tracking a dashboard, seeding this month's usage from the rollups.
+
+        Blocking. For dashboards already tracked only the limits are updated.
+        """
+        limits = {name: getattr(dashboard, name) for name in LIMIT_FIELDS}
+        with self.lock:
+            usage = self.usage.get(dashboard.pk)
+            if usage is not None:
+                usage.limits = limits
+                return usage
+
+        today = localdate()
+        usage = DashboardUsage(today, limits)
+        for name, value in self.read_usage([dashboard.pk], today).get(dashboard.pk, {}).items():
+            setattr(usage, name, value or 0)
+        with self.lock:
+            return self.usage.setdefault(dashboard.pk, usage)
+
+    def read_usage(self, dashboard_ids, today):
+        """{dashboard_id: {field: value}} of this day and month from the rollups. Blocking"""
+        DashboardDailyStats = apps.get_model('chatbot', 'DashboardDailyStats')
+        tokens = F('prompt_tokens') + F('completion_tokens')
+        rows = DashboardDailyStats.objects.filter(
+            dashboard_id__in=dashboard_ids, day__gte=today.replace(day=1), day__lte=today
+        ).values('dashboard_id').annotate(
+            month_tokens=Sum(tokens),
+            month_requests=Sum('llm_requests'),
+            day_tokens=Sum(tokens, filter=Q(day=today)),
+            day_requests=Sum('llm_requests', filter=Q(day=today)),
+        ).order_by()
+        return {row.pop('dashboard_id'): row for row in rows}
+
+    def refresh_limits(self):
+        """
+        Re-read the limits of tracked dashboards so admin changes apply without
+        a restart, and their usage so calls made by other processes count.
+
+        Blocking, call right after counters.flush(). The rollups and the
+        in-process count both trail the real usage, the larger one is kept.
+        """
+        Dashboard = apps.get_model('chatbot', 'Dashboard')
+        with self.lock:
+            dashboard_ids = list(self.usage)
+        today = localdate()
+        totals = self.read_usage(dashboard_ids, today)
+        for dashboard in Dashboard.objects.filter(pk__in=dashboard_ids).only(*LIMIT_FIELDS):
+            limits = {name: getattr(dashboard, name) for name in LIMIT_FIELDS}
+            with self.lock:
+                usage = self.usage[dashboard.pk]
+                usage.limits = limits
+                usage.roll(today)
+                for name, value in totals.get(dashboard.pk, {}).items():
+                    setattr(usage, name, max(getattr(usage, name), value or 0))
+
+    def check(self, dashboard_id):
+        """Name of the exhausted limit of the dashboard, or None when a call is allowed"""
+        with self.lock:
+            usage = self.usage.get(dashboard_id)
+            if usage is None:
+                return None
+            usage.roll(localdate())
+            return usage.exceeded()
+
+    def add(self, dashboard_id, prompt_tokens=0, completion_tokens=0):
+        """Count one LLM call"""
+        with self.lock:
+            usage = self.usage.get(dashboard_id)
+            if usage is None:
+                return
+            usage.roll(localdate())
+            usage.day_requests += 1
+            usage.month_requests += 1
+            usage.day_tokens += prompt_tokens + completion_tokens
+            usage.month_tokens += prompt_tokens + completion_tokens
+
+    def samples(self):
+        """Current usage per dashboard, reported as a gauge"""
+        with self.lock:
+            return {
+                (str(dashboard_id), period, kind): getattr(usage, f'{period}_{kind}')
+                for dashboard_id, usage in self.usage.items()
+                for period in ('day', 'month')
+                for kind in ('tokens', 'requests')
+            }
+
+
+quotas = QuotaTracker()
+registry.gauge(
+    'chatbot_quota_usage', 'LLM usage counted against dashboard quotas',
+    ('dashboard', 'period', 'kind'), quotas.samples
+)
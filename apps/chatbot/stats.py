@@ -0,0 +1,107 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils.timezone import localdate, make_aware
+
+from .models import DashboardDailyStats, Message
+
+STAT_FIELDS = (
+    'inbound_messages', 'outbound_messages', 'active_clients', 'response_count',
+    'response_time_total_ms', 'llm_requests', 'prompt_tokens', 'completion_tokens',
+)
+
+
+def dashboard_stats(dashboard, days=30):
+    """Daily rows and totals for the last `days` days, read from the rollup table only"""
+    since = localdate() - timedelta(days=days - 1)
+    rows = list(
+        DashboardDailyStats.objects.filter(dashboard=dashboard, day__gte=since)
+        .order_by('day', 'messenger_type')
+        .values('day', 'messenger_type', *STAT_FIELDS)
+    )
+    totals = dict.fromkeys(STAT_FIELDS, 0)
+    for row in rows:
+        for name in STAT_FIELDS:
+            totals[name] += row[name]
+    totals['average_response_ms'] = (
+        totals['response_time_total_ms'] / totals['response_count'] if totals['response_count'] else None
+    )
+    return {'since': since, 'days': rows, 'totals': totals}
+
+
+def compute_daily_stats(dashboard, start, end):
+    """
+    Recompute rollup values from Message for days in [start, end).
+
+    Used by rebuild_stats for backfills; the runner maintains the rollups
+    incrementally with the same definitions (llm_requests counts stored
+    replies, see CounterBuffer.record_usage). Returns {(day, messenger_type): values}.
+    """
+    window = Message.objects.filter(
+        chat__dashboard=dashboard,
+        created_date__gte=make_aware(datetime.combine(start, time.min)),
+        created_date__lt=make_aware(datetime.combine(end, time.min)),
+    )
+    stats = defaultdict(lambda: dict.fromkeys(STAT_FIELDS, 0))
+    aggregates = window.annotate(
+        day=TruncDate('created_date'), messenger_type=F('chat__type')
+    ).values('day', 'messenger_type').order_by().annotate(
+        inbound_messages=Count('pk', filter=Q(outgoing=False)),
+        outbound_messages=Count('pk', filter=Q(outgoing=True)),
+        active_clients=Count('client', distinct=True, filter=Q(outgoing=False)),
+        llm_requests=Count('pk', filter=Q(outgoing=True, ai_assistant__isnull=False)),
+        prompt_tokens=Coalesce(Sum('prompt_tokens'), 0),
+        completion_tokens=Coalesce(Sum('completion_tokens'), 0),
+    )
+    for row in aggregates:
+        values = stats[(row.pop('day'), row.pop('messenger_type'))]
+        values.update(row)
+
+    # Reply latency: first outgoing message after each inbound one, per chat
+    pending = {}
+    rows = window.order_by('chat_id', 'created_date').values_list(
+        'chat_id', 'chat__type', 'outgoing', 'created_date'
+    ).iterator(chunk_size=5000)
+    for chat_id, messenger_type, outgoing, created in rows:
+        if not outgoing:
+            pending[chat_id] = created
+            continue
+        inbound_at = pending.pop(chat_id, None)
+        if inbound_at:
+            values = stats[(localdate(created), messenger_type)]
+            values['response_count'] += 1
+            values['response_time_total_ms'] += int((created - inbound_at).total_seconds() * 1000)
+    return stats
+
+
+def rebuild_daily_stats(dashboard, start, end, missing_only=False):
+    """
+    Overwrite (or, with missing_only, fill in) rollup rows for days in [start, end).
+
+    The existing rows are locked before the messages are counted and then
+    upserted in place, so the runner's concurrent increments wait for the
+    rebuild instead of landing on rows that are deleted and recreated.
+    """
+    existing = DashboardDailyStats.objects.filter(dashboard=dashboard, day__gte=start, day__lt=end)
+    with transaction.atomic():
+        present = set(existing.select_for_update().order_by('pk').values_list('day', 'messenger_type'))
+        stats = compute_daily_stats(dashboard, start, end)
+        if missing_only:
+            present_days = {day for day, _ in present}
+            stats = {key: values for key, values in stats.items() if key[0] not in present_days}
+        else:
+            # Rows left without messages are zeroed rather than deleted
+            for key in present - set(stats):
+                stats[key] = dict.fromkeys(STAT_FIELDS, 0)
+        DashboardDailyStats.objects.bulk_create(
+            (
+                DashboardDailyStats(dashboard=dashboard, day=day, messenger_type=messenger_type, **values)
+                for (day, messenger_type), values in stats.items()
+            ),
+            update_conflicts=True,
+            unique_fields=('dashboard', 'day', 'messenger_type'),
+            update_fields=STAT_FIELDS,
+        )
+    return len(stats)
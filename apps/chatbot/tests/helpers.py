@@ -0,0 +1,20 @@
+from apps.accounts.models import User
+from apps.chatbot.models import AIAssistant, Chat, Client, Dashboard, Messenger
+
+
+def create_dashboard(name='Test', **fields):
+    owner = User.objects.create(email=f'owner-{User.objects.count()}@example.com')
+    return Dashboard.objects.create(name=name, owner=owner, **fields)
+
+
+def create_chat(telegram_chat_id=1000, dashboard=None):
+    dashboard = dashboard or create_dashboard()
+    messenger, _ = Messenger.objects.get_or_create(
+        dashboard=dashboard, messenger_type='telegram', defaults={'token': f'{dashboard.pk}:test'}
+    )
+    client = Client.objects.create(dashboard=dashboard, telegram_chat_id=telegram_chat_id, messenger_type='telegram')
+    return Chat.objects.create(messenger=messenger, client=client, dashboard=dashboard, type='telegram')
+
+
+def create_assistant(dashboard, **fields):
+    return AIAssistant.objects.create(dashboard=dashboard, assistant_id=f'asst-{AIAssistant.objects.count()}', **fields)
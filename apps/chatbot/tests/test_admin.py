@@ -0,0 +1,37 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from apps.accounts.models import User
+from apps.chatbot.models import Message
+from apps.chatbot.tests.helpers import create_chat
+
+
+class MessageAdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser(email='admin@example.com', password='admin'))
+        self.chat = create_chat()
+        Message.objects.bulk_create(
+            Message(text=f'message {i}', client=self.chat.client, chat=self.chat) for i in range(60)
+        )
+        self.ids = list(Message.objects.order_by('-id').values_list('id', flat=True))
+        self.url = reverse('admin:chatbot_message_changelist')
+
+    def test_keyset_pages_walk_the_table_without_offsets(self):
+        with self.assertNoLogs('apps.chatbot.admin_utils', level='WARNING'):
+            response = self.client.get(self.url)
+        self.assertEqual([message.pk for message in response.context['cl'].result_list], self.ids[:50])
+        self.assertEqual(response.context['keyset_next_url'], f'?id__lt={self.ids[49]}')
+
+        response = self.client.get(self.url + response.context['keyset_next_url'])
+        self.assertEqual([message.pk for message in response.context['cl'].result_list], self.ids[50:])
+        self.assertNotIn('keyset_next_url', response.context)
+
+    def test_filters_are_kept_in_the_next_page_link(self):
+        response = self.client.get(self.url, {'outgoing__exact': '0'})
+        self.assertEqual(response.context['keyset_next_url'], f'?outgoing__exact=0&id__lt={self.ids[49]}')
+
+    def test_search_uses_exact_lookups(self):
+        response = self.client.get(self.url, {'q': str(self.chat.pk)})
+        self.assertEqual(response.context['cl'].result_count, 60)
+        response = self.client.get(self.url, {'q': 'mess'})
+        self.assertEqual(response.context['cl'].result_count, 0)
@@ -0,0 +1,40 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from apps.chatbot.management.admission import ADMISSIONS, DEGRADED, NORMAL, SHED, AdmissionControl
+from apps.chatbot.management.scheduler import scheduler
+
+
+class AdmissionControlTests(SimpleTestCase):
+    def setUp(self):
+        self.admissions = self.enterContext(mock.patch.object(ADMISSIONS, 'values', {}))
+        self.waiting = self.enterContext(mock.patch.object(scheduler, 'waiting', return_value=0))
+
+    def test_calls_in_flight_are_degraded_then_shed(self):
+        admission = AdmissionControl(soft_in_flight=2, hard_in_flight=3)
+        levels = [admission.enter('test') for _ in range(4)]
+        self.assertEqual(levels, [NORMAL, NORMAL, DEGRADED, SHED])
+        # Shed calls never entered, so they do not leave
+        self.assertEqual(admission.in_flight, 3)
+        self.assertEqual(self.admissions, {('normal', 'test'): 2, ('degraded', 'test'): 1, ('shed', 'test'): 1})
+
+        admission.leave()
+        self.assertEqual(admission.level(), DEGRADED)
+        admission.leave()
+        self.assertEqual(admission.level(), NORMAL)
+
+    def test_scheduler_queue_degrades_and_sheds(self):
+        admission = AdmissionControl(soft_queue=10, hard_queue=50)
+        self.waiting.return_value = 9
+        self.assertEqual(admission.level(), NORMAL)
+        self.waiting.return_value = 10
+        self.assertEqual(admission.level(), DEGRADED)
+        self.waiting.return_value = 50
+        self.assertEqual(admission.level(), SHED)
+
+    def test_zero_thresholds_are_disabled(self):
+        admission = AdmissionControl()
+        admission.in_flight = 1000
+        self.waiting.return_value = 1000
+        self.assertEqual(admission.level(), NORMAL)
@@ -0,0 +1,71 @@
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from apps.chatbot.archive import archive_dashboard, restore_archive
+from apps.chatbot.models import Message
+from apps.chatbot.tests.helpers import create_assistant, create_chat, create_dashboard
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(MESSAGE_ARCHIVE_ROOT=directory.name))
+        self.dashboard = create_dashboard(message_retention_days=1)
+        self.assistant = create_assistant(self.dashboard)
+        self.chat = create_chat(dashboard=self.dashboard)
+        self.old = timezone.now() - timedelta(days=3)
+
+    def create_messages(self, count, chat=None, created_date=None):
+        chat = chat or self.chat
+        messages = [
+            Message.objects.create(text=f'message {i}', client=chat.client, chat=chat, ai_assistant=self.assistant)
+            for i in range(count)
+        ]
+        Message.objects.filter(pk__in=[message.pk for message in messages]).update(created_date=created_date or self.old)
+        return messages
+
+    def archive(self, chunk_size=2):
+        count = archive_dashboard(self.dashboard, chunk_size=chunk_size)
+        [path] = Path(settings.MESSAGE_ARCHIVE_ROOT, str(self.dashboard.pk)).glob('*.jsonl.gz')
+        return count, path
+
+    def test_round_trip_keeps_fields_and_dates(self):
+        archived = self.create_messages(5)
+        recent = self.create_messages(1, created_date=timezone.now())
+        expected = list(Message.objects.filter(pk__in=[m.pk for m in archived]).values())
+
+        count, path = self.archive()
+        self.assertEqual(count, 5)
+        self.assertEqual(list(Message.objects.values_list('pk', flat=True)), [recent[0].pk])
+
+        self.assertEqual(restore_archive(path), (5, 0, False))
+        self.assertEqual(list(Message.objects.filter(pk__in=[m.pk for m in archived]).values()), expected)
+        # Restoring again skips the existing ids
+        self.assertEqual(restore_archive(path), (0, 0, False))
+
+    def test_truncated_archive_restores_the_complete_chunks(self):
+        self.create_messages(5)
+        _, path = self.archive()
+        path.write_bytes(path.read_bytes()[:-10])
+
+        with self.assertLogs('apps.chatbot.archive', level='WARNING'):
+            restored, orphaned, truncated = restore_archive(path)
+        self.assertTrue(truncated)
+        self.assertEqual((restored, orphaned), (4, 0))
+
+    def test_messages_of_deleted_chats_are_skipped(self):
+        other = create_chat(2000, dashboard=self.dashboard)
+        self.create_messages(2)
+        self.create_messages(3, chat=other)
+        _, path = self.archive()
+        other.client.delete()
+        self.assistant.delete()
+
+        self.assertEqual(restore_archive(path), (2, 3, False))
+        self.assertEqual(set(Message.objects.values_list('chat_id', 'ai_assistant_id')), {(self.chat.pk, None)})
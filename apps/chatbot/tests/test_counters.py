@@ -0,0 +1,65 @@
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import TestCase
+
+from apps.chatbot.counters import CounterBuffer
+from apps.chatbot.models import DashboardDailyStats, Message
+from apps.chatbot.tests.helpers import create_chat
+
+
+class CounterBufferTests(TestCase):
+    def setUp(self):
+        self.chat = create_chat()
+        self.buffer = CounterBuffer(flush_interval=5)
+        self.buffer.start_periodic_flush()
+
+    def record(self, text, outgoing=False):
+        message = Message.objects.create(text=text, client=self.chat.client, chat=self.chat, outgoing=outgoing)
+        self.buffer.record_message(message)
+        return message
+
+    def test_flush_writes_chat_counters_and_rollups(self):
+        inbound = self.record('question')
+        reply = self.record('answer ' * 30, outgoing=True)
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.message_count, 0)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.message_count, 2)
+        self.assertEqual(self.chat.last_message_preview, ('answer ' * 30)[:100])
+        self.assertEqual(self.chat.last_inbound_at, inbound.created_date)
+        self.assertEqual(self.chat.last_outbound_at, reply.created_date)
+
+        stats = DashboardDailyStats.objects.get(dashboard=self.chat.dashboard)
+        self.assertEqual((stats.inbound_messages, stats.outbound_messages, stats.active_clients), (1, 1, 1))
+        self.assertEqual(stats.response_count, 1)
+        self.assertEqual(
+            stats.response_time_total_ms, int((reply.created_date - inbound.created_date).total_seconds() * 1000)
+        )
+        self.assertEqual(self.buffer.flush(), 0)
+
+    def test_failed_flush_keeps_the_deltas(self):
+        self.record('first')
+        with mock.patch.object(self.buffer, 'write', side_effect=DatabaseError('down')), \
+                self.assertLogs('apps.chatbot.counters', level='ERROR'):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.record('second')
+
+        self.assertEqual(self.buffer.flush(), 1)
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.message_count, 2)
+        self.assertEqual(self.chat.last_message_preview, 'second')
+        self.assertEqual(DashboardDailyStats.objects.get(dashboard=self.chat.dashboard).inbound_messages, 2)
+
+    def test_without_a_periodic_flush_messages_are_written_on_commit(self):
+        buffer = CounterBuffer(flush_interval=5)
+        with mock.patch('apps.chatbot.models.counters', buffer), self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(text='question', client=self.chat.client, chat=self.chat)
+            self.chat.refresh_from_db()
+            self.assertEqual(self.chat.message_count, 0)
+
+        self.chat.refresh_from_db()
+        self.assertEqual(self.chat.message_count, 1)
+        self.assertEqual(buffer.depth(), {('chats',): 0, ('assistants',): 0, ('stats',): 0})
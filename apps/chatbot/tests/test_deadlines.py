@@ -0,0 +1,46 @@
+import asyncio
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from apps.chatbot.management.deadlines import TIMEOUTS, DeadlineExceeded, budget, remaining, update_deadline
+
+
+@override_settings(STAGE_BUDGETS={'llm': 5, 'db': 0.01})
+class BudgetTests(SimpleTestCase):
+    def setUp(self):
+        self.timeouts = self.enterContext(mock.patch.object(TIMEOUTS, 'values', {}))
+
+    def test_stage_budget_is_capped_by_the_update_deadline(self):
+        self.assertIsNone(remaining('telegram'))
+        self.assertEqual(remaining('llm'), 5)
+        with update_deadline(2):
+            self.assertAlmostEqual(remaining('llm'), 2, places=1)
+            self.assertAlmostEqual(remaining('telegram'), 2, places=1)
+            with update_deadline(0):
+                self.assertIsNone(remaining('telegram'))
+        self.assertEqual(remaining('llm'), 5)
+
+    async def test_stage_over_budget_is_cancelled(self):
+        with self.assertRaises(DeadlineExceeded) as raised:
+            async with budget('db', 'test'):
+                await asyncio.sleep(1)
+        self.assertEqual(raised.exception.stage, 'db')
+        self.assertEqual(self.timeouts, {('db', 'test'): 1})
+
+    async def test_deadline_follows_the_update_into_tasks(self):
+        async def stage():
+            async with budget('llm', 'test'):
+                await asyncio.sleep(1)
+
+        with update_deadline(0.01):
+            task = asyncio.create_task(stage())
+        with self.assertRaises(DeadlineExceeded):
+            await task
+        self.assertEqual(self.timeouts, {('llm', 'test'): 1})
+
+    async def test_timeouts_of_the_block_itself_are_not_budget_overruns(self):
+        with self.assertRaises(TimeoutError):
+            async with budget('llm', 'test'):
+                raise TimeoutError
+        self.assertEqual(self.timeouts, {})
@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from apps.chatbot.management.history import CHAT_BYTES, HistoryCache
+
+
+def turn(id, chat_id=1, text='text'):
+    return SimpleNamespace(id=id, chat_id=chat_id, outgoing=False, text=text, created_date=timezone.now())
+
+
+class HistoryCacheTests(SimpleTestCase):
+    def test_load_keeps_turns_stored_while_loading(self):
+        cache = HistoryCache(turns=3)
+        self.assertIsNone(cache.get(1, 1, 3))
+        cache.append(1, turn(3))
+
+        loaded = cache.load(1, [turn(1), turn(2), turn(3)], 3)
+        self.assertEqual([message.id for message in loaded], [1, 2, 3])
+        cache.append(1, turn(4))
+        self.assertEqual([message.id for message in cache.get(1, 1, 3)], [2, 3, 4])
+
+    def test_load_beyond_the_buffer_returns_the_loaded_messages(self):
+        cache = HistoryCache(turns=2)
+        messages = [turn(1), turn(2), turn(3)]
+        self.assertIsNone(cache.get(1, 1, 3))
+        self.assertEqual([message.id for message in cache.load(1, messages, 3)], [1, 2, 3])
+
+    def test_evict_drops_the_least_recently_used_chat(self):
+        cache = HistoryCache(turns=5)
+        cache.get(1, 1, 2)
+        cache.load(1, [turn(1), turn(2)], 2)
+        cache.max_bytes = cache.size + 100
+
+        cache.get(1, 2, 2)
+        cache.load(2, [turn(3, chat_id=2), turn(4, chat_id=2)], 2)
+        self.assertNotIn(1, cache.chats)
+        self.assertIn(2, cache.chats)
+        self.assertEqual(cache.size, cache.chats[2].size)
+
+    def test_forget_drops_a_messengers_chats(self):
+        cache = HistoryCache(turns=5)
+        cache.get(1, 1, 2)
+        cache.get(2, 2, 2)
+        cache.forget(1)
+        self.assertEqual(list(cache.chats), [2])
+        self.assertEqual(cache.size, cache.chats[2].size)
+
+    def test_ring_buffer_keeps_the_size_in_step(self):
+        cache = HistoryCache(turns=2)
+        cache.get(1, 1, 2)
+        cache.load(1, [], 2)
+        for id in range(1, 5):
+            cache.append(1, turn(id, text='x' * id))
+        # Turns of another messenger's chat with the same id are not mixed in
+        cache.append(2, turn(5))
+        self.assertEqual([message.id for message in cache.get(1, 1, 2)], [3, 4])
+        self.assertEqual(cache.size, CHAT_BYTES + sum(turn.size for turn in cache.chats[1].turns))
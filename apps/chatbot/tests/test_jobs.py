@@ -0,0 +1,97 @@
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from apps.chatbot.management.jobs import LeaseLost, claim, defer, fail, store_reply
+from apps.chatbot.models import GenerationJob, Message
+from apps.chatbot.tests.helpers import create_chat
+
+
+class GenerationJobTests(TestCase):
+    def setUp(self):
+        self.chat = create_chat()
+
+    def create_job(self, chat=None):
+        chat = chat or self.chat
+        message = Message.objects.create(text='hello', client=chat.client, chat=chat)
+        return GenerationJob.objects.create(
+            messenger=chat.messenger, chat=chat, message=message, telegram_chat_id=chat.client.telegram_chat_id
+        )
+
+    def test_claim_leases_each_job_once(self):
+        job = self.create_job()
+        other = self.create_job(create_chat(2000))
+
+        claimed = claim('worker', 10, 60)
+        self.assertEqual({claimed_job.id for claimed_job in claimed}, {job.id, other.id})
+        self.assertTrue(all(claimed_job.status == 'running' and claimed_job.attempts == 1 for claimed_job in claimed))
+        self.assertEqual(claim('worker', 10, 60), [])
+
+    def test_claim_keeps_a_chat_in_order(self):
+        first = self.create_job()
+        second = self.create_job()
+
+        self.assertEqual([job.id for job in claim('worker', 10, 60)], [first.id])
+        fail(GenerationJob.objects.get(pk=first.pk), RuntimeError('boom'))
+        # Not even while the older job waits out its retry backoff
+        self.assertEqual(claim('worker', 10, 60), [])
+
+        GenerationJob.objects.filter(pk=first.pk).update(available_at=timezone.now())
+        self.assertEqual([job.id for job in claim('worker', 10, 60)], [first.id])
+        GenerationJob.objects.filter(pk=first.pk).update(status='done')
+        self.assertEqual([job.id for job in claim('worker', 10, 60)], [second.id])
+
+    def test_claim_takes_back_an_expired_lease(self):
+        job = self.create_job()
+        claim('worker', 10, 60)
+        GenerationJob.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        [reclaimed] = claim('other', 10, 60)
+        self.assertEqual(reclaimed.attempts, 2)
+        self.assertTrue(reclaimed.locked_by.startswith('other:'))
+
+    @override_settings(GENERATION_MAX_ATTEMPTS=2, GENERATION_RETRY_BACKOFF=10)
+    def test_fail_retries_with_backoff_then_dead_letters(self):
+        job = self.create_job()
+
+        [claimed] = claim('worker', 10, 60)
+        self.assertFalse(fail(claimed, RuntimeError('boom')))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertGreater(job.available_at, timezone.now() + timedelta(seconds=5))
+        self.assertEqual(job.last_error, 'RuntimeError: boom')
+
+        GenerationJob.objects.filter(pk=job.pk).update(available_at=timezone.now())
+        [claimed] = claim('worker', 10, 60)
+        self.assertTrue(fail(claimed, RuntimeError('boom')))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'dead')
+        self.assertIsNotNone(job.finished_at)
+
+    def test_fail_ignores_a_job_claimed_again(self):
+        job = self.create_job()
+        [claimed] = claim('worker', 10, 60)
+        GenerationJob.objects.filter(pk=job.pk).update(locked_by='other:1')
+
+        fail(claimed, RuntimeError('late'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+        self.assertEqual(job.last_error, '')
+
+    def test_defer_gives_the_attempt_back(self):
+        job = self.create_job()
+        [claimed] = claim('worker', 10, 60)
+
+        defer(claimed, RuntimeError('no slot'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 0))
+
+    def test_reply_of_a_job_claimed_again_is_not_stored(self):
+        job = self.create_job()
+        [claimed] = claim('worker', 10, 60)
+        GenerationJob.objects.filter(pk=job.pk).update(locked_by='other:1')
+
+        with self.assertRaises(LeaseLost):
+            store_reply(claimed, text='late', chat=self.chat, outgoing=True)
+        self.assertFalse(Message.objects.filter(text='late').exists())
@@ -0,0 +1,57 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from apps.chatbot.management.leases import LeaseManager
+from apps.chatbot.models import BotRunner, Messenger, MessengerLease
+from apps.chatbot.tests.helpers import create_dashboard
+
+
+class LeaseManagerTests(TestCase):
+    def setUp(self):
+        self.messenger_ids = [
+            Messenger.objects.create(dashboard=create_dashboard(), messenger_type='telegram', token=f'{i}:test').pk
+            for i in range(4)
+        ]
+        self.first = LeaseManager('first')
+        self.second = LeaseManager('second')
+
+    def test_a_messenger_has_a_single_owner(self):
+        claimed = self.first._claim(self.messenger_ids, 3)
+        self.assertEqual(len(claimed), 3)
+        self.assertEqual(self.second._claim(self.messenger_ids, 3), list(set(self.messenger_ids) - set(claimed)))
+        self.assertEqual(MessengerLease.objects.filter(owner='first').count(), 3)
+        self.assertEqual(self.first._claim(self.messenger_ids, 3), [])
+
+    def test_expired_lease_is_taken_over_and_reported_lost(self):
+        self.first._claim(self.messenger_ids, 2)
+        MessengerLease.objects.filter(messenger_id=self.messenger_ids[0]).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertEqual(self.second._claim(self.messenger_ids[:2], 2), [self.messenger_ids[0]])
+        self.assertEqual(self.first._renew(), {self.messenger_ids[0]})
+        self.assertEqual(self.first.held, {self.messenger_ids[1]})
+        lease = MessengerLease.objects.get(messenger_id=self.messenger_ids[1])
+        self.assertGreater(lease.expires_at, timezone.now() + timedelta(seconds=10))
+
+    def test_released_leases_are_free_at_once(self):
+        self.first._claim(self.messenger_ids, 4)
+        self.first._heartbeat()
+        self.first._release(self.messenger_ids[:2])
+        self.assertCountEqual(self.second._claim(self.messenger_ids, 4), self.messenger_ids[:2])
+        self.first.release_all()
+        self.assertEqual(self.first.held, set())
+        self.assertFalse(BotRunner.objects.filter(name='first').exists())
+        self.assertEqual(MessengerLease.objects.filter(owner='first').count(), 0)
+
+    def test_messengers_are_shared_between_live_replicas(self):
+        self.assertEqual(self.first._heartbeat(), 1)
+        self.assertEqual(self.second._heartbeat(), 2)
+        BotRunner.objects.filter(name='second').update(heartbeat_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.first._heartbeat(), 1)
+        BotRunner.objects.filter(name='second').update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.first._heartbeat()
+        self.assertFalse(BotRunner.objects.filter(name='second').exists())
+        self.assertEqual(self.first.share(5, 2), 3)
+        self.assertEqual(self.first.share(5, 0), 5)
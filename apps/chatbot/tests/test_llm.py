@@ -0,0 +1,144 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from apps.chatbot.management.llm import HEDGES, HedgeBudget, LLMClient, SingleFlight, fingerprint
+from apps.chatbot.management.routing import ModelHealth
+
+HEDGING = {'percentile': 95, 'min_samples': 5, 'min_delay_ms': 0}
+
+
+class FakeCompletions:
+    """chat.completions stand-in, each call runs the next (delay, result) step"""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.started = []
+        self.cancelled = []
+
+    async def create(self, **request):
+        index = len(self.started)
+        self.started.append(request)
+        delay, result = self.steps[index]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(index)
+            raise
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class HedgingTests(SimpleTestCase):
+    def setUp(self):
+        self.health = ModelHealth()
+        self.enterContext(mock.patch('apps.chatbot.management.llm.health', self.health))
+        self.budget = self.enterContext(mock.patch('apps.chatbot.management.llm.hedge_budget', HedgeBudget(0.5, burst=1)))
+        self.hedges = self.enterContext(mock.patch.object(HEDGES, 'values', {}))
+
+    def make_client(self, *steps, samples=5):
+        for _ in range(samples):
+            self.health.record('model', 0.01, True)
+        client = LLMClient()
+        self.completions = FakeCompletions(*steps)
+        client.client = SimpleNamespace(chat=SimpleNamespace(completions=self.completions))
+        return client
+
+    async def test_slow_call_is_hedged_and_the_loser_cancelled(self):
+        client = self.make_client((1, 'primary'), (0, 'hedge'))
+        self.assertEqual(await client.complete('model', [], hedging=HEDGING), ('hedge', False))
+        self.assertEqual(len(self.completions.started), 2)
+        await asyncio.sleep(0)
+        self.assertEqual(self.completions.cancelled, [0])
+        self.assertEqual(self.hedges, {('model', 'sent'): 1, ('model', 'won'): 1})
+
+    async def test_failed_hedge_waits_for_the_primary(self):
+        client = self.make_client((0.05, 'primary'), (0, RuntimeError('hedge failed')))
+        self.assertEqual(await client.call('model', [], HEDGING), 'primary')
+        self.assertEqual(self.hedges, {('model', 'sent'): 1, ('model', 'lost'): 1})
+
+    async def test_both_failing_raises(self):
+        client = self.make_client((0.05, ValueError('primary failed')), (0, RuntimeError('hedge failed')))
+        with self.assertRaisesMessage(RuntimeError, 'hedge failed'):
+            await client.call('model', [], HEDGING)
+
+    async def test_no_hedge_without_enough_samples_or_budget(self):
+        client = self.make_client((0.05, 'primary'), samples=4)
+        self.assertEqual(await client.call('model', [], HEDGING), 'primary')
+
+        self.health.calls.clear()
+        self.budget.tokens = 0
+        client = self.make_client((0.05, 'primary'))
+        self.assertEqual(await client.call('model', [], HEDGING), 'primary')
+        self.assertEqual(len(self.completions.started), 1)
+        self.assertEqual(self.hedges, {('model', 'budget_exhausted'): 1})
+
+    def test_budget_earns_a_share_of_a_hedge_per_call(self):
+        budget = HedgeBudget(0.5, burst=1)
+        self.assertTrue(budget.spend())
+        self.assertFalse(budget.spend())
+        budget.earn()
+        self.assertFalse(budget.spend())
+        budget.earn()
+        budget.earn()
+        self.assertTrue(budget.spend())
+        self.assertFalse(budget.spend())
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.calls = 0
+
+    async def slow(self, result='answer', delay=0.02):
+        self.calls += 1
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def test_concurrent_callers_share_one_call(self):
+        results = await asyncio.gather(*(self.single_flight.do('key', self.slow) for _ in range(3)))
+        self.assertEqual(results, [('answer', False), ('answer', True), ('answer', True)])
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.single_flight.calls, {})
+
+        await self.single_flight.do('key', self.slow)
+        self.assertEqual(self.calls, 2)
+
+    async def test_a_cancelled_caller_leaves_the_call_running(self):
+        first = asyncio.ensure_future(self.single_flight.do('key', self.slow))
+        second = asyncio.ensure_future(self.single_flight.do('key', self.slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual(await second, ('answer', True))
+        self.assertTrue(first.cancelled())
+
+    async def test_errors_reach_every_caller_and_are_not_cached(self):
+        failing = lambda: self.slow(RuntimeError('upstream'))
+        results = await asyncio.gather(
+            self.single_flight.do('key', failing), self.single_flight.do('key', failing), return_exceptions=True
+        )
+        self.assertEqual([str(result) for result in results], ['upstream', 'upstream'])
+        self.assertEqual(await self.single_flight.do('key', self.slow), ('answer', False))
+
+    async def test_llm_client_coalesces_requests_with_the_same_key(self):
+        client = LLMClient()
+        completions = FakeCompletions((0.02, 'answer'), (0, 'second'))
+        client.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        with mock.patch('apps.chatbot.management.llm.single_flight', self.single_flight):
+            results = await asyncio.gather(
+                client.complete('model', [], coalesce_key='key'), client.complete('model', [], coalesce_key='key')
+            )
+        self.assertEqual(results, [('answer', False), ('answer', True)])
+        self.assertEqual(len(completions.started), 1)
+
+    def test_fingerprint_ignores_case_and_whitespace_only(self):
+        key = fingerprint('asst', 'model', 'Be brief', ' Hello   World ', temperature=0)
+        self.assertEqual(key, fingerprint('asst', 'model', 'Be brief', 'hello world', temperature=0))
+        self.assertNotEqual(key, fingerprint('asst', 'model', 'Be brief', 'hello world!', temperature=0))
+        self.assertNotEqual(key, fingerprint('asst', 'model', 'Be brief', 'hello world', temperature=1))
+        self.assertNotEqual(key, fingerprint('other', 'model', 'Be brief', 'hello world', temperature=0))
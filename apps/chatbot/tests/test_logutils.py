@@ -0,0 +1,51 @@
+import logging
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from apps.chatbot.logutils import RedactingFilter, SamplingFilter, redact
+
+BOT_TOKEN = '900004:AAHdqTcvCH1vGWJxfSeofSAs0K5PALDsaw'
+
+
+def make_record(msg, *args, name='apps.chatbot', level=logging.INFO, exc_text=None):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    record.exc_text = exc_text
+    return record
+
+
+class RedactTests(SimpleTestCase):
+    def test_secrets_and_personal_data_are_masked(self):
+        for text, expected in (
+            (f'token {BOT_TOKEN} rejected', 'token <bot-token> rejected'),
+            (f'POST https://api.telegram.org/bot{BOT_TOKEN}/getUpdates', 'POST https://api.telegram.org/bot<bot-token>/getUpdates'),
+            ('key sk-proj-abcdefghijklmnop1234', 'key <api-key>'),
+            ('Authorization: Bearer abc.def.ghi', 'Authorization: Bearer <redacted>'),
+            ('{"password": "hunter2", "token"="xyz"}', '{"password": "<redacted>", "token"="<redacted>"}'),
+            ('from jane.doe+bot@example.co.uk', 'from <email>'),
+            ('call +1 (555) 123-4567 now', 'call <phone> now'),
+        ):
+            with self.subTest(text=text):
+                self.assertEqual(redact(text), expected)
+
+    def test_plain_text_is_kept(self):
+        text = 'Processed update 123456789 for chat 42 in 12:30 ms'
+        self.assertEqual(redact(text), text)
+
+
+class RedactingFilterTests(SimpleTestCase):
+    def test_merges_args_and_masks_the_traceback(self):
+        record = make_record('Bot %s failed', BOT_TOKEN, exc_text=f'InvalidToken: {BOT_TOKEN}')
+        self.assertTrue(RedactingFilter().filter(record))
+        self.assertEqual(record.getMessage(), 'Bot <bot-token> failed')
+        self.assertEqual(record.exc_text, 'InvalidToken: <bot-token>')
+
+
+class SamplingFilterTests(SimpleTestCase):
+    @mock.patch('apps.chatbot.logutils.random.random', return_value=0.5)
+    def test_longest_prefix_wins_and_warnings_are_kept(self, _):
+        sampling = SamplingFilter({'apps.chatbot': 1, 'apps.chatbot.management': 0.1})
+        self.assertTrue(sampling.filter(make_record('kept', name='apps.chatbot.views')))
+        self.assertFalse(sampling.filter(make_record('dropped', name='apps.chatbot.management.poller')))
+        self.assertTrue(sampling.filter(make_record('kept', name='apps.chatbot.management', level=logging.WARNING)))
+        self.assertTrue(sampling.filter(make_record('kept', name='apps.chatbotx')))
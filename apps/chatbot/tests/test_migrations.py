@@ -0,0 +1,48 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+class MergeDuplicateClientsTests(TransactionTestCase):
+    before = [('chatbot', '0013_remove_message_is_read')]
+    after = [('chatbot', '0014_hot_path_indexes')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_duplicates_are_merged_before_the_constraints(self):
+        apps = self.migrate(self.before)
+        User = apps.get_model('accounts', 'User')
+        Dashboard = apps.get_model('chatbot', 'Dashboard')
+        Client = apps.get_model('chatbot', 'Client')
+        Chat = apps.get_model('chatbot', 'Chat')
+        Message = apps.get_model('chatbot', 'Message')
+
+        dashboard = Dashboard.objects.create(name='Test', owner=User.objects.create(email='owner@example.com'))
+        keep = Client.objects.create(dashboard=dashboard, telegram_chat_id=1, messenger_type='telegram')
+        orphan = Client.objects.create(dashboard=dashboard, telegram_chat_id=1, messenger_type='telegram')
+        duplicate = Client.objects.create(dashboard=dashboard, telegram_chat_id=1, messenger_type='telegram')
+        other = Client.objects.create(dashboard=dashboard, telegram_chat_id=2, messenger_type='telegram')
+        keep_chat = Chat.objects.create(client=keep, dashboard=dashboard, type='telegram')
+        duplicate_chat = Chat.objects.create(client=duplicate, dashboard=dashboard, type='telegram')
+        Message.objects.create(text='first', client=keep, chat=keep_chat)
+        Message.objects.create(text='second', client=orphan)
+        Message.objects.create(text='third', client=duplicate, chat=duplicate_chat)
+
+        apps = self.migrate(self.after)
+        Client = apps.get_model('chatbot', 'Client')
+        Chat = apps.get_model('chatbot', 'Chat')
+        Message = apps.get_model('chatbot', 'Message')
+
+        self.assertEqual(set(Client.objects.values_list('pk', flat=True)), {keep.pk, other.pk})
+        self.assertEqual(list(Chat.objects.values_list('pk', flat=True)), [keep_chat.pk])
+        self.assertEqual(
+            sorted(Message.objects.values_list('text', 'client_id', 'chat_id')),
+            [('first', keep.pk, keep_chat.pk), ('second', keep.pk, None), ('third', keep.pk, keep_chat.pk)],
+        )
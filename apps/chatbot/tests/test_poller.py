@@ -0,0 +1,105 @@
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+from telegram.error import InvalidToken, TimedOut
+
+from apps.chatbot.management.poller import HIBERNATED_BOTS, SharedPoller
+from apps.chatbot.management.updates import UpdateOffsets
+
+
+class FakePollBot:
+    """getUpdates stand-in answering with the scripted steps, then blocking"""
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.calls = []
+        self.finished = asyncio.Event()
+
+    async def get_updates(self, offset, timeout, allowed_updates):
+        self.calls.append((offset, timeout))
+        if not self.steps:
+            self.finished.set()
+            await asyncio.Event().wait()
+        step = self.steps.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        return [SimpleNamespace(update_id=update_id) for update_id in step]
+
+
+class FakeManager:
+    def __init__(self, steps, wake_errors=0):
+        self.token = 'token'
+        self.dashboard = SimpleNamespace(id=1)
+        self.offsets = UpdateOffsets(4)
+        self.poll_bot = FakePollBot(steps)
+        self.application = SimpleNamespace(update_queue=asyncio.Queue())
+        self.hibernated = False
+        self.wake_errors = wake_errors
+
+    async def hibernate(self):
+        self.hibernated = True
+        self.application = None
+
+    async def wake(self):
+        if self.wake_errors:
+            self.wake_errors -= 1
+            raise RuntimeError('initialize failed')
+        self.hibernated = False
+        self.application = SimpleNamespace(update_queue=asyncio.Queue())
+
+    def queued(self):
+        queue = self.application.update_queue
+        return [queue.get_nowait().update_id for _ in range(queue.qsize())]
+
+
+class SharedPollerTests(SimpleTestCase):
+    def setUp(self):
+        self.hibernated = self.enterContext(mock.patch.object(HIBERNATED_BOTS, 'values', {}))
+        sleep = asyncio.sleep
+        # Error backoffs are not waited out
+        self.enterContext(mock.patch('apps.chatbot.management.poller.asyncio.sleep', lambda _: sleep(0)))
+
+    async def poll(self, manager, **options):
+        poller = SharedPoller(timeout=10, idle_timeout=40, **options)
+        poller.register(manager)
+        try:
+            await asyncio.wait_for(manager.poll_bot.finished.wait(), 1)
+        finally:
+            await poller.close()
+        return poller
+
+    async def test_updates_are_queued_and_confirmed_by_the_next_poll(self):
+        manager = FakeManager([[5, 6], TimedOut(), [], [], [], [7]])
+        await self.poll(manager)
+        self.assertEqual(manager.queued(), [5, 6, 7])
+        # Empty polls double the long-poll timeout up to idle_timeout, updates reset it
+        self.assertEqual(
+            manager.poll_bot.calls, [(5, 10), (7, 10), (7, 10), (7, 20), (7, 40), (7, 40), (8, 10)]
+        )
+
+    async def test_rejected_token_is_reported_for_the_runner(self):
+        manager = FakeManager([InvalidToken()])
+        poller = SharedPoller()
+        with self.assertLogs('apps.chatbot.management.poller', level='ERROR'):
+            poller.register(manager)
+            await asyncio.sleep(0.01)
+        self.assertEqual(poller.rejected, {'token'})
+        self.assertTrue(poller.tasks['token'].done())
+        poller.unregister(manager)
+        self.assertEqual(poller.rejected, set())
+
+    async def test_idle_bot_hibernates_and_wakes_on_its_next_update(self):
+        manager = FakeManager([[], [5]])
+        await self.poll(manager, hibernate_after=1e-6)
+        self.assertFalse(manager.hibernated)
+        self.assertEqual(manager.queued(), [5])
+        self.assertEqual(self.hibernated, {(): 0})
+
+    async def test_failed_wake_is_retried_without_losing_updates(self):
+        manager = FakeManager([[], [5], [5]], wake_errors=1)
+        with self.assertLogs('apps.chatbot.management.poller', level='ERROR'):
+            await self.poll(manager, hibernate_after=1e-6)
+        self.assertEqual(manager.queued(), [5])
+        self.assertEqual([offset for offset, _ in manager.poll_bot.calls], [5, 5, 5, 6])
@@ -0,0 +1,59 @@
+from datetime import date
+from unittest import mock
+
+from django.test import TestCase
+from django.utils.timezone import localdate
+
+from apps.chatbot.models import DashboardDailyStats
+from apps.chatbot.quotas import QuotaTracker
+from apps.chatbot.tests.helpers import create_dashboard
+
+
+class QuotaTrackerTests(TestCase):
+    def setUp(self):
+        self.today = localdate()
+        self.dashboard = create_dashboard(daily_request_limit=3, monthly_token_limit=1000)
+        self.quotas = QuotaTracker()
+
+    def add_rollup(self, day, requests, tokens):
+        DashboardDailyStats.objects.create(
+            dashboard=self.dashboard, day=day, messenger_type='telegram', llm_requests=requests, prompt_tokens=tokens
+        )
+
+    def test_usage_is_seeded_from_the_rollups_and_counted_in_process(self):
+        self.add_rollup(self.today, 2, 100)
+        self.quotas.load(self.dashboard)
+        self.assertIsNone(self.quotas.check(self.dashboard.pk))
+
+        self.quotas.add(self.dashboard.pk, prompt_tokens=10, completion_tokens=5)
+        self.assertEqual(self.quotas.check(self.dashboard.pk), 'daily_request_limit')
+        self.assertIsNone(self.quotas.check(0))
+
+    def test_refresh_brings_in_other_processes_and_new_limits(self):
+        self.quotas.load(self.dashboard)
+        self.quotas.add(self.dashboard.pk, prompt_tokens=400)
+        # Another replica flushed more calls than this process made
+        self.add_rollup(self.today, 1, 700)
+
+        self.quotas.refresh_limits()
+        usage = self.quotas.usage[self.dashboard.pk]
+        self.assertEqual((usage.day_requests, usage.month_tokens), (1, 700))
+        self.assertIsNone(self.quotas.check(self.dashboard.pk))
+        self.quotas.add(self.dashboard.pk, completion_tokens=300)
+        self.assertEqual(self.quotas.check(self.dashboard.pk), 'monthly_token_limit')
+
+        self.dashboard.monthly_token_limit = None
+        self.dashboard.save()
+        self.quotas.refresh_limits()
+        self.assertIsNone(self.quotas.check(self.dashboard.pk))
+
+    def test_counters_roll_over_with_the_day_and_month(self):
+        self.quotas.load(self.dashboard)
+        for _ in range(3):
+            self.quotas.add(self.dashboard.pk, prompt_tokens=300)
+        self.assertEqual(self.quotas.check(self.dashboard.pk), 'daily_request_limit')
+
+        with mock.patch('apps.chatbot.quotas.localdate', return_value=date(2100, 1, 1)):
+            self.assertIsNone(self.quotas.check(self.dashboard.pk))
+            usage = self.quotas.usage[self.dashboard.pk]
+            self.assertEqual((usage.day_requests, usage.month_tokens), (0, 0))
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from apps.chatbot.management.routing import ROUTES, ModelHealth, choose_model, is_small_talk
+
+POLICY = {
+    'fast_model': 'fast', 'fallback_model': 'fallback',
+    'max_p95_ms': 1000, 'max_error_rate': 0.5, 'min_samples': 3,
+}
+
+
+def make_assistant(routing=None):
+    return SimpleNamespace(model='primary', config={'routing': routing} if routing else {})
+
+
+class ChooseModelTests(SimpleTestCase):
+    def setUp(self):
+        self.health = ModelHealth()
+        self.enterContext(mock.patch('apps.chatbot.management.routing.health', self.health))
+        self.routes = self.enterContext(mock.patch.object(ROUTES, 'values', {}))
+
+    def test_without_a_policy_the_assistant_model_is_counted(self):
+        self.assertEqual(choose_model(make_assistant(), 'thanks'), ('primary', 'primary'))
+        self.assertEqual(self.routes, {('primary', 'primary'): 1})
+
+    def test_small_talk_and_overload_use_the_fast_model(self):
+        assistant = make_assistant(POLICY)
+        self.assertEqual(choose_model(assistant, 'thanks!'), ('fast', 'fast'))
+        self.assertEqual(choose_model(assistant, 'How do I reset my password?'), ('primary', 'primary'))
+        self.assertEqual(choose_model(assistant, 'How do I reset my password?', degraded=True), ('fast', 'degraded'))
+        self.assertEqual(choose_model(assistant, 'thanks', has_image=True, degraded=True), ('primary', 'primary'))
+        self.assertEqual(self.routes, {('fast', 'fast'): 1, ('primary', 'primary'): 2, ('degraded', 'fast'): 1})
+
+    def test_unhealthy_model_fails_over_to_a_healthy_fallback(self):
+        assistant = make_assistant(POLICY)
+        for _ in range(3):
+            self.health.record('primary', 2.0, True)
+        self.assertEqual(choose_model(assistant, 'Tell me about your pricing plans'), ('fallback', 'fallback'))
+
+        for _ in range(3):
+            self.health.record('fallback', 0.1, False)
+        self.assertEqual(choose_model(assistant, 'Tell me about your pricing plans'), ('primary', 'primary'))
+
+
+class ModelHealthTests(SimpleTestCase):
+    def test_too_few_or_expired_samples_count_as_healthy(self):
+        health = ModelHealth(window=10, max_age=60)
+        with mock.patch('apps.chatbot.management.routing.time.monotonic', return_value=100.0):
+            health.record('model', 5.0, False)
+            health.record('model', 5.0, False)
+            self.assertTrue(health.is_healthy('model', max_p95_ms=1000, min_samples=3))
+            health.record('model', 5.0, False)
+            self.assertFalse(health.is_healthy('model', max_p95_ms=1000, min_samples=3))
+            self.assertEqual(health.stats('model'), (3, 5.0, 1.0))
+        with mock.patch('apps.chatbot.management.routing.time.monotonic', return_value=200.0):
+            self.assertEqual(health.stats('model'), (0, 0.0, 0.0))
+            self.assertTrue(health.is_healthy('model', max_p95_ms=1000, min_samples=3))
+
+    def test_latency_percentile_uses_successful_calls(self):
+        health = ModelHealth()
+        for seconds in (1.0, 2.0, 3.0):
+            health.record('model', seconds, True)
+        health.record('model', 60.0, False)
+        self.assertIsNone(health.latency_percentile('model', 0.5, min_samples=4))
+        self.assertEqual(health.latency_percentile('model', 1.0, min_samples=3), 3.0)
+
+
+class SmallTalkTests(SimpleTestCase):
+    def test_short_messages_without_questions_code_or_math(self):
+        for text in ('ok', 'Thank you!', 'спасибо', '👍', 'see you'):
+            with self.subTest(text=text):
+                self.assertTrue(is_small_talk(text))
+        for text in ('why?', 'what is 2+2', 'see https://x.io', 'Could you explain the refund policy'):
+            with self.subTest(text=text):
+                self.assertFalse(is_small_talk(text))
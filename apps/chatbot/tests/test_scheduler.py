@@ -0,0 +1,74 @@
+import asyncio
+
+from django.test import SimpleTestCase
+
+from apps.chatbot.management.scheduler import FairScheduler
+
+
+class FairSchedulerTests(SimpleTestCase):
+    async def run_calls(self, scheduler, dashboard_ids):
+        """Run one call per dashboard id once the blocking call ends, returns the order they started in"""
+        started = []
+
+        async def call(dashboard_id):
+            async with scheduler.slot(dashboard_id):
+                started.append(dashboard_id)
+                await asyncio.sleep(0)
+
+        blocking = scheduler.slot(0)
+        await blocking.__aenter__()
+        tasks = [asyncio.create_task(call(dashboard_id)) for dashboard_id in dashboard_ids]
+        await asyncio.sleep(0)
+        await blocking.__aexit__(None, None, None)
+        await asyncio.gather(*tasks)
+        return started
+
+    async def test_slots_follow_the_dashboard_weights(self):
+        scheduler = FairScheduler(capacity=1)
+        scheduler.configure(1, weight=2)
+        started = await self.run_calls(scheduler, [2] * 6 + [1] * 6)
+        self.assertEqual(started[:6].count(1), 4)
+        self.assertEqual(scheduler.running, 0)
+
+    async def test_dashboard_cap_leaves_room_for_the_others(self):
+        scheduler = FairScheduler(capacity=3)
+        scheduler.configure(1, max_concurrency=1)
+        async with scheduler.slot(1):
+            waiter = asyncio.create_task(scheduler.slot(1).__aenter__())
+            await asyncio.sleep(0)
+            async with scheduler.slot(2):
+                self.assertEqual(scheduler.running, 2)
+                self.assertEqual(scheduler.waiting(), 1)
+        await waiter
+        self.assertEqual(scheduler.shares[1].running, 1)
+
+    async def test_cancelled_waiter_leaves_the_queue(self):
+        scheduler = FairScheduler(capacity=1)
+        held = scheduler.slot(1)
+        await held.__aenter__()
+        waiter = asyncio.create_task(scheduler.slot(2).__aenter__())
+        await asyncio.sleep(0)
+        self.assertEqual(scheduler.waiting(), 1)
+
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(scheduler.waiting(), 0)
+        await held.__aexit__(None, None, None)
+        self.assertEqual(scheduler.running, 0)
+
+    async def test_waiter_cancelled_after_its_grant_releases_the_slot(self):
+        scheduler = FairScheduler(capacity=1)
+        held = scheduler.slot(1)
+        await held.__aenter__()
+        waiter = asyncio.create_task(scheduler.slot(2).__aenter__())
+        await asyncio.sleep(0)
+
+        # Releasing grants the slot to the waiter, which is cancelled before it runs
+        await held.__aexit__(None, None, None)
+        self.assertEqual(scheduler.running, 1)
+        waiter.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+        self.assertEqual(scheduler.running, 0)
+        self.assertEqual(scheduler.shares[2].running, 0)
@@ -0,0 +1,143 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from telegram import Bot, Update
+
+from django.test import SimpleTestCase
+
+from apps.chatbot.management.updates import (
+    DROPPED, DedupeWindow, FloodControl, TrackingUpdateProcessor, UpdateOffsets, catch_up, coalesce_backlog
+)
+
+BOT = Bot('123456:test-token')
+
+
+def make_update(update_id, text, chat_id=1, user_id=1):
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': 0, 'text': text,
+            'chat': {'id': chat_id, 'type': 'private' if chat_id == user_id else 'group'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user {user_id}'},
+        },
+    }, BOT)
+
+
+class UpdateOffsetsTests(SimpleTestCase):
+    def test_watermark_stops_below_the_oldest_update_in_flight(self):
+        offsets = UpdateOffsets(10)
+        for update_id in (11, 12, 13):
+            offsets.begin(update_id)
+        offsets.done(12)
+        self.assertEqual(offsets.watermark(), 10)
+        offsets.done(11)
+        self.assertEqual(offsets.watermark(), 12)
+        offsets.done(13)
+        self.assertEqual(offsets.watermark(), 13)
+
+    def test_pending_write_only_when_the_watermark_moved(self):
+        offsets = UpdateOffsets(10)
+        self.assertIsNone(offsets.pending_write())
+        offsets.begin(11)
+        offsets.done(11)
+        self.assertEqual(offsets.pending_write(), 11)
+        offsets.persisted = 11
+        self.assertIsNone(offsets.pending_write())
+
+
+class FloodControlTests(SimpleTestCase):
+    @mock.patch('apps.chatbot.management.updates.time')
+    def test_bursts_are_limited_and_refill_over_time(self, clock):
+        clock.monotonic.return_value = 100.0
+        flood = FloodControl(rate=1.0, burst=3)
+
+        self.assertEqual([flood.take(1) for _ in range(3)], [(True, False)] * 3)
+        self.assertEqual(flood.take(1), (False, True))
+        self.assertEqual(flood.take(1), (False, False))
+        self.assertEqual(flood.take(2), (True, False))
+
+        clock.monotonic.return_value = 101.5
+        self.assertEqual(flood.take(1), (True, False))
+        self.assertEqual(flood.take(1), (False, True))
+
+    @mock.patch('apps.chatbot.management.updates.time')
+    def test_only_the_latest_clients_are_tracked(self, clock):
+        clock.monotonic.return_value = 100.0
+        flood = FloodControl(rate=1.0, burst=1, max_clients=2)
+        for client_id in (1, 2, 3):
+            flood.take(client_id)
+        self.assertEqual(list(flood.buckets), [2, 3])
+
+
+class TrackingUpdateProcessorTests(SimpleTestCase):
+    async def test_repeated_and_flooding_updates_are_dropped(self):
+        dropped = self.enterContext(mock.patch.object(DROPPED, 'values', {}))
+        send_message = self.enterContext(mock.patch.object(Bot, 'send_message', mock.AsyncMock()))
+        offsets = UpdateOffsets(4)
+        processor = TrackingUpdateProcessor(
+            offsets, recent=DedupeWindow(), flood=FloodControl(rate=0, burst=1), metrics_label='test'
+        )
+        handled = []
+
+        async def handle(update):
+            handled.append(update.update_id)
+
+        for update_id, user_id in ((5, 1), (5, 1), (3, 1), (6, 1), (7, 1), (8, 2)):
+            update = make_update(update_id, 'hi', chat_id=user_id, user_id=user_id)
+            await processor.do_process_update(update, handle(update))
+
+        self.assertEqual(handled, [5, 8])
+        self.assertEqual(dropped, {('duplicate', 'test'): 2, ('flood', 'test'): 2})
+        # The throttled client is told once per burst
+        send_message.assert_awaited_once()
+        self.assertEqual(offsets.in_flight, set())
+        self.assertEqual(offsets.watermark(), 8)
+
+
+class CoalesceBacklogTests(SimpleTestCase):
+    def test_text_runs_are_merged_per_chat_and_sender(self):
+        chats = coalesce_backlog([
+            make_update(1, 'hi'),
+            make_update(2, 'are you there', chat_id=-5, user_id=2),
+            make_update(3, 'I need help'),
+            make_update(4, 'me too', chat_id=-5, user_id=3),
+            make_update(5, '/start'),
+            make_update(6, 'with my order'),
+        ])
+        self.assertEqual(
+            {key: [(update.message.text, update_ids) for update, update_ids in queue] for key, queue in chats.items()},
+            {
+                (1, 1): [('hi\nI need help', [1, 3]), ('/start', [5]), ('with my order', [6])],
+                (-5, 2): [('are you there', [2])],
+                (-5, 3): [('me too', [4])],
+            },
+        )
+        self.assertEqual(chats[(1, 1)][0][0].update_id, 3)
+
+
+class FakeBot:
+    def __init__(self, updates):
+        self.updates = updates
+        self.offsets = []
+
+    async def get_updates(self, offset, limit, timeout):
+        self.offsets.append(offset)
+        return [update for update in self.updates if update.update_id >= offset][:limit]
+
+
+class CatchUpTests(SimpleTestCase):
+    async def test_backlog_is_handled_in_batches_and_confirmed(self):
+        offsets = UpdateOffsets(10)
+        bot = FakeBot([make_update(update_id, f'line {update_id}') for update_id in range(9, 14)])
+        handled = []
+
+        async def process_update(update):
+            handled.append(update.message.text)
+
+        application = SimpleNamespace(
+            bot=bot, process_update=process_update, update_processor=TrackingUpdateProcessor(offsets)
+        )
+        self.assertEqual(await catch_up(application, offsets, 'test', batch_size=2), 3)
+        self.assertEqual(handled, ['line 11\nline 12', 'line 13'])
+        self.assertEqual(bot.offsets, [11, 13, 14])
+        self.assertEqual(offsets.watermark(), 13)
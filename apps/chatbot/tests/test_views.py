@@ -0,0 +1,74 @@
+import csv
+import io
+import json
+
+from django.test import TestCase
+from django.urls import reverse
+
+from apps.accounts.models import User
+from apps.chatbot.models import Message
+from apps.chatbot.tests.helpers import create_chat, create_dashboard
+
+
+class ExportMessagesTests(TestCase):
+    def setUp(self):
+        self.chat = create_chat()
+        self.dashboard = self.chat.dashboard
+        self.messages = [
+            Message.objects.create(text=f'message {i}', client=self.chat.client, chat=self.chat, sender_info={'n': i})
+            for i in range(3)
+        ]
+        # Chat without a client, still part of the dashboard
+        Message.objects.create(text='no client', chat=self.chat)
+        self.url = reverse('chatbot:export_messages', args=[self.dashboard.pk])
+
+    def content(self, response):
+        return b''.join(response.streaming_content).decode()
+
+    def test_requires_an_authenticated_user_with_access(self):
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        self.client.force_login(User.objects.create(email='stranger@example.com'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_login(User.objects.create(email='member@example.com', dashboard=self.dashboard))
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(self.client.get(reverse('chatbot:export_messages', args=[0])).status_code, 404)
+
+    def test_jsonl_streams_every_message_of_the_dashboard(self):
+        self.client.force_login(self.dashboard.owner)
+        Message.objects.create(text='other dashboard', chat=create_chat(2000, dashboard=create_dashboard()))
+
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual([row['text'] for row in rows], ['message 0', 'message 1', 'message 2', 'no client'])
+        self.assertEqual(rows[0]['sender_info'], {'n': 0})
+
+    def test_csv_and_date_bounds(self):
+        self.client.force_login(self.dashboard.owner)
+        Message.objects.filter(pk=self.messages[0].pk).update(created_date='2020-01-01T12:00:00Z')
+
+        response = self.client.get(self.url, {'format': 'csv', 'end': '2020-01-02'})
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(io.StringIO(self.content(response))))
+        self.assertEqual([(row['text'], row['sender_info']) for row in rows], [('message 0', '{"n": 0}')])
+
+        self.assertEqual(self.client.get(self.url, {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'start': 'yesterday'}).status_code, 400)
+
+
+class DashboardStatsViewTests(TestCase):
+    def setUp(self):
+        self.dashboard = create_dashboard()
+        self.url = reverse('chatbot:dashboard_stats', args=[self.dashboard.pk])
+
+    def test_access_and_days_validation(self):
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+        self.client.force_login(User.objects.create(email='stranger@example.com'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+        self.client.force_login(self.dashboard.owner)
+        response = self.client.get(self.url, {'days': 7})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['days'], [])
+        self.assertEqual(self.client.get(self.url, {'days': 0}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'days': 'week'}).status_code, 400)
@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'chatbot'
+
+urlpatterns = [
+    path('dashboards/<int:dashboard_id>/messages/export/', views.export_messages, name='export_messages'),
+    path('dashboards/<int:dashboard_id>/stats/', views.dashboard_daily_stats, name='dashboard_stats'),
+]
@@ -1,3 +1,63 @@
-from django.shortcuts import render
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET
 
-# Create your views here.
+from .exports import EXPORT_FORMATS, export_lines, parse_bound
+from .models import Dashboard
+from .stats import dashboard_stats
+
+
+def can_access_dashboard(user, dashboard):
+    return user.is_staff or dashboard.owner_id == user.pk or user.dashboard_id == dashboard.pk
+
+
+@require_GET
+def export_messages(request, dashboard_id):
+    """
+    Streams the messages of a dashboard as JSONL or CSV.
+
+    Query parameters: format (jsonl, csv), start and end (ISO date or datetime, end exclusive).
+    """
+    if not request.user.is_authenticated:
+        return HttpResponse('Authentication required', status=401)
+    dashboard = get_object_or_404(Dashboard, pk=dashboard_id)
+    if not can_access_dashboard(request.user, dashboard):
+        return HttpResponse('Forbidden', status=403)
+
+    export_format = request.GET.get('format', 'jsonl')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest(f"Unsupported format, use one of: {', '.join(EXPORT_FORMATS)}")
+    try:
+        start = parse_bound(request.GET.get('start'))
+        end = parse_bound(request.GET.get('end'))
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(
+        export_lines(dashboard, start, end, export_format),
+        content_type=f'{content_type}; charset=utf-8'
+    )
+    response['Content-Disposition'] = f'attachment; filename="dashboard-{dashboard.pk}-messages.{export_format}"'
+    return response
+
+
+@require_GET
+def dashboard_daily_stats(request, dashboard_id):
+    """
+    Daily message volume, active clients, reply latency and token usage of a dashboard.
+
+    Query parameters: days (1-366, default 30).
+    """
+    if not request.user.is_authenticated:
+        return HttpResponse('Authentication required', status=401)
+    dashboard = get_object_or_404(Dashboard, pk=dashboard_id)
+    if not can_access_dashboard(request.user, dashboard):
+        return HttpResponse('Forbidden', status=403)
+    try:
+        days = int(request.GET.get('days', 30))
+    except ValueError:
+        return HttpResponseBadRequest('days must be an integer')
+    if not 1 <= days <= 366:
+        return HttpResponseBadRequest('days must be between 1 and 366')
+    return JsonResponse(dashboard_stats(dashboard, days))
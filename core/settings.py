@@ -84,17 +84,43 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# Threads running the bot runner's and worker's ORM calls (db_task in apps/chatbot/management/repository.py),
+# each holds at most one database connection
+DB_TASK_THREADS = config('DB_TASK_THREADS', default=8, cast=int)
+
+# Postgres goes through psycopg 3 in every process, pooled or not
 if json.loads(config('USE_POSTGRES')):
     DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.postgresql_psycopg2',
+            'ENGINE': 'django.db.backends.postgresql',
             'NAME': config('POSTGRES_DB'),
             'USER': config('POSTGRES_USER'),
             'PASSWORD': config('POSTGRES_PASSWORD'),
             'HOST': config('POSTGRES_HOST'),
             'PORT': config('POSTGRES_PORT'),
+            'CONN_MAX_AGE': config('CONN_MAX_AGE', default=0, cast=int),
+            'CONN_HEALTH_CHECKS': True,
         }
     }
+    # Connection pool (psycopg 3) for long-running processes such as the telegram runner,
+    # enabled per process with DB_POOL=true. Pooled connections are returned on close,
+    # so persistent connections have to stay disabled. Every DB_TASK_THREADS thread may hold
+    # a connection at once, max_size defaults to that plus two for the event loop thread and
+    # shutdown flushes, a smaller pool makes db_task calls wait and fail with PoolTimeout.
+    # Checkouts are health checked, Django passes the pool's check from CONN_HEALTH_CHECKS.
+    if json.loads(config('DB_POOL', default='false')):
+        DATABASES['default'].update({
+            'CONN_MAX_AGE': 0,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+                    'max_size': config('DB_POOL_MAX_SIZE', default=DB_TASK_THREADS + 2, cast=int),
+                    'timeout': config('DB_POOL_TIMEOUT', default=10, cast=float),
+                    'max_idle': config('DB_POOL_MAX_IDLE', default=300, cast=float),
+                    'max_lifetime': config('DB_POOL_MAX_LIFETIME', default=1800, cast=float),
+                },
+            },
+        })
 else:
     DATABASES = {
         'default': {
@@ -153,4 +179,102 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-OPENAI_API_KEY = config("OPENAI_API_KEY")
\ No newline at end of file
+OPENAI_API_KEY = config("OPENAI_API_KEY")
+# API endpoints, overridden e.g. by `manage.py bench_load` to point at local fakes
+OPENAI_BASE_URL = config('OPENAI_BASE_URL', default=None)
+TELEGRAM_API_BASE_URL = config('TELEGRAM_API_BASE_URL', default='https://api.telegram.org/bot')
+TELEGRAM_FILE_BASE_URL = config('TELEGRAM_FILE_BASE_URL', default='https://api.telegram.org/file/bot')
+
+# Seconds between writes of the coalesced chat/assistant counters
+CHAT_COUNTERS_FLUSH_INTERVAL = config('CHAT_COUNTERS_FLUSH_INTERVAL', default=5, cast=float)
+# Telegram runner: chats drained in parallel after a restart, seconds between update offset writes
+TELEGRAM_CATCH_UP_CONCURRENCY = config('TELEGRAM_CATCH_UP_CONCURRENCY', default=20, cast=int)
+TELEGRAM_OFFSET_SAVE_INTERVAL = config('TELEGRAM_OFFSET_SAVE_INTERVAL', default=2, cast=float)
+# update_ids remembered per bot to drop repeated deliveries, and per-client flood control:
+# TELEGRAM_FLOOD_RATE messages per second in bursts of TELEGRAM_FLOOD_BURST, 0 disables
+TELEGRAM_DEDUPE_WINDOW = config('TELEGRAM_DEDUPE_WINDOW', default=2048, cast=int)
+TELEGRAM_FLOOD_RATE = config('TELEGRAM_FLOOD_RATE', default=1.0, cast=float)
+TELEGRAM_FLOOD_BURST = config('TELEGRAM_FLOOD_BURST', default=10, cast=int)
+TELEGRAM_FLOOD_CLIENTS = config('TELEGRAM_FLOOD_CLIENTS', default=10000, cast=int)
+
+# Long-poll every bot over shared connection pools (apps/chatbot/management/poller.py)
+# instead of one python-telegram-bot Updater per bot
+TELEGRAM_SHARED_POLLER = config('TELEGRAM_SHARED_POLLER', default=True, cast=bool)
+TELEGRAM_POLL_TIMEOUT = config('TELEGRAM_POLL_TIMEOUT', default=30, cast=int)
+TELEGRAM_POLL_CONNECTIONS = config('TELEGRAM_POLL_CONNECTIONS', default=256, cast=int)
+TELEGRAM_API_CONNECTIONS = config('TELEGRAM_API_CONNECTIONS', default=64, cast=int)
+# Each empty poll doubles a bot's getUpdates timeout up to TELEGRAM_IDLE_POLL_TIMEOUT (Telegram allows 50).
+# Bots without updates for TELEGRAM_HIBERNATE_AFTER seconds are unloaded until their next update, 0 disables
+TELEGRAM_IDLE_POLL_TIMEOUT = config('TELEGRAM_IDLE_POLL_TIMEOUT', default=50, cast=int)
+TELEGRAM_HIBERNATE_AFTER = config('TELEGRAM_HIBERNATE_AFTER', default=900, cast=float)
+
+# Runner replicas split the bots through messenger leases (apps/chatbot/management/leases.py).
+# A dead replica's bots are taken over TELEGRAM_LEASE_TTL seconds after its last renewal
+TELEGRAM_RUNNER_NAME = config('TELEGRAM_RUNNER_NAME', default='')
+TELEGRAM_LEASE_TTL = config('TELEGRAM_LEASE_TTL', default=15, cast=float)
+TELEGRAM_LEASE_RENEW_INTERVAL = config('TELEGRAM_LEASE_RENEW_INTERVAL', default=5, cast=float)
+TELEGRAM_LEASE_CLAIM_BATCH = config('TELEGRAM_LEASE_CLAIM_BATCH', default=25, cast=int)
+
+# Reply generation through the GenerationJob queue and `manage.py generation_worker` processes
+# (apps/chatbot/management/jobs.py) instead of inside the update handler
+GENERATION_QUEUE = config('GENERATION_QUEUE', default=False, cast=bool)
+GENERATION_WORKER_CONCURRENCY = config('GENERATION_WORKER_CONCURRENCY', default=20, cast=int)
+GENERATION_POLL_INTERVAL = config('GENERATION_POLL_INTERVAL', default=0.5, cast=float)
+GENERATION_JOB_TIMEOUT = config('GENERATION_JOB_TIMEOUT', default=300, cast=float)
+GENERATION_MAX_ATTEMPTS = config('GENERATION_MAX_ATTEMPTS', default=5, cast=int)
+GENERATION_RETRY_BACKOFF = config('GENERATION_RETRY_BACKOFF', default=2, cast=float)
+GENERATION_JOB_RETENTION = config('GENERATION_JOB_RETENTION', default=86400, cast=float)
+
+# Share of LLM calls that may be hedged (see apps/chatbot/management/llm.py) and the allowed burst
+LLM_HEDGE_BUDGET_RATIO = config('LLM_HEDGE_BUDGET_RATIO', default=0.05, cast=float)
+LLM_HEDGE_BUDGET_BURST = config('LLM_HEDGE_BUDGET_BURST', default=10, cast=int)
+# LLM calls running at once per process, shared fairly between dashboards (apps/chatbot/management/scheduler.py).
+# 0 means unlimited, only the dashboards' own caps apply
+LLM_MAX_CONCURRENCY = config('LLM_MAX_CONCURRENCY', default=100, cast=int)
+# Admission control of LLM calls per process (apps/chatbot/management/admission.py). Above a soft
+# threshold calls are degraded, above a hard one they get a "busy" reply. 0 disables a threshold
+ADMISSION_SOFT_IN_FLIGHT = config('ADMISSION_SOFT_IN_FLIGHT', default=150, cast=int)
+ADMISSION_HARD_IN_FLIGHT = config('ADMISSION_HARD_IN_FLIGHT', default=400, cast=int)
+ADMISSION_SOFT_QUEUE = config('ADMISSION_SOFT_QUEUE', default=50, cast=int)
+ADMISSION_HARD_QUEUE = config('ADMISSION_HARD_QUEUE', default=300, cast=int)
+LLM_DEGRADED_MAX_TOKENS = config('LLM_DEGRADED_MAX_TOKENS', default=300, cast=int)
+LLM_DEGRADED_HISTORY = config('LLM_DEGRADED_HISTORY', default=2, cast=int)
+
+# Per-chat history ring buffers of the bot runner (apps/chatbot/management/history.py): messages kept
+# per chat and the approximate memory cap, least recently used chats are evicted beyond it
+HISTORY_CACHE_TURNS = config('HISTORY_CACHE_TURNS', default=20, cast=int)
+HISTORY_CACHE_MAX_BYTES = config('HISTORY_CACHE_MAX_BYTES', default=64 * 2 ** 20, cast=int)
+
+# Deadline budgets of update handling in seconds (apps/chatbot/management/deadlines.py). A stage is
+# cancelled after its own budget or when the update's deadline passes, whichever comes first
+UPDATE_DEADLINE = config('UPDATE_DEADLINE', default=120, cast=float)
+DB_STAGE_TIMEOUT = config('DB_STAGE_TIMEOUT', default=10, cast=float)
+LLM_CALL_TIMEOUT = config('LLM_CALL_TIMEOUT', default=90, cast=float)
+TRANSCRIPTION_TIMEOUT = config('TRANSCRIPTION_TIMEOUT', default=60, cast=float)
+TELEGRAM_SEND_TIMEOUT = config('TELEGRAM_SEND_TIMEOUT', default=15, cast=float)
+STAGE_BUDGETS = {
+    'client_lookup': DB_STAGE_TIMEOUT,
+    'assistant_lookup': DB_STAGE_TIMEOUT,
+    'history_fetch': DB_STAGE_TIMEOUT,
+    'message_write': DB_STAGE_TIMEOUT,
+    'llm_call': LLM_CALL_TIMEOUT,
+    'transcription': TRANSCRIPTION_TIMEOUT,
+    'file_lookup': TELEGRAM_SEND_TIMEOUT,
+    'telegram_send': TELEGRAM_SEND_TIMEOUT,
+}
+
+# Seconds between reloads of the dashboard LLM quota limits by the bot runner
+QUOTA_REFRESH_INTERVAL = config('QUOTA_REFRESH_INTERVAL', default=60, cast=float)
+
+# Message archive (see `manage.py archive_messages`), 0 keeps messages forever
+MESSAGE_RETENTION_DAYS = config('MESSAGE_RETENTION_DAYS', default=0, cast=int)
+MESSAGE_ARCHIVE_ROOT = Path(config('MESSAGE_ARCHIVE_ROOT', default=str(BASE_DIR / 'archive')))
+# Bot runner logging (see apps/chatbot/logutils.py)
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_FILE = config('LOG_FILE', default='telegram_bot_manager.log')
+LOG_FORMAT = config('LOG_FORMAT', default='json')
+LOG_MAX_BYTES = config('LOG_MAX_BYTES', default=50 * 1024 * 1024, cast=int)
+LOG_BACKUP_COUNT = config('LOG_BACKUP_COUNT', default=5, cast=int)
+LOG_QUEUE_SIZE = config('LOG_QUEUE_SIZE', default=10000, cast=int)
+# Fraction of sub-WARNING records kept per logger, e.g. {"apps.chatbot.management.telegram_manager": 0.1}
+LOG_SAMPLING = json.loads(config('LOG_SAMPLING', default='{}'))